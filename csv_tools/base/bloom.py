@@ -0,0 +1,65 @@
+""" A Bloom filter: a compact set of values which may give false positives.
+
+    A Bloom filter answers "is this value in the set?" with either
+    "definitely not" or "probably", using a fixed number of bits per value
+    no matter how long the values are.  It is useful when a set of keys
+    is too large to hold in memory, or to cheaply reject most values
+    before a more expensive lookup.
+
+    Bit positions are derived from the built-in hash(), which is randomized
+    for text in each python process, so a filter must not be saved to a file
+    or sent to a process which was not forked from the one that built it.
+"""
+
+import math
+
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+class BloomFilter:
+    """ A set of hashable values which supports add() and the 'in' operator. """
+
+    def __init__(self, capacity, false_positive_rate=None):
+        """ Creates an empty filter sized for capacity values.
+
+            If more values are added, the false positive rate rises
+            (but values which were added are still always found).
+        """
+        if false_positive_rate is None:
+            false_positive_rate = DEFAULT_FALSE_POSITIVE_RATE
+        if not 0.0 < false_positive_rate < 1.0:
+            raise ValueError(
+                "false positive rate must be between 0 and 1: {0}".format(false_positive_rate)
+                )
+        capacity = max(1, capacity)
+        bit_count = int(math.ceil(
+            -capacity * math.log(false_positive_rate) / (math.log(2) ** 2)
+            ))
+        self.bit_count = max(8, bit_count)
+        self.hash_count = max(1, int(round(self.bit_count / capacity * math.log(2))))
+        self.bit_array = bytearray((self.bit_count + 7) // 8)
+
+    def _get_bit_positions(self, value):
+        # split one 64 bit hash into two 32 bit hashes,
+        #  and combine them to make hash_count hashes (Kirsch & Mitzenmacher)
+        value_hash = hash(value) & 0xFFFFFFFFFFFFFFFF
+        hash1 = value_hash & 0xFFFFFFFF
+        hash2 = (value_hash >> 32) | 1
+        bit_count = self.bit_count
+        return [
+            (hash1 + hash_index * hash2) % bit_count
+            for hash_index in range(self.hash_count)
+            ]
+
+    def add(self, value):
+        bit_array = self.bit_array
+        for bit_position in self._get_bit_positions(value):
+            bit_array[bit_position >> 3] |= 1 << (bit_position & 7)
+
+    def __contains__(self, value):
+        bit_array = self.bit_array
+        for bit_position in self._get_bit_positions(value):
+            if not bit_array[bit_position >> 3] & (1 << (bit_position & 7)):
+                return False
+        return True
@@ -0,0 +1,117 @@
+""" Split CSV text into whole records without parsing the cells.
+
+    A line of text ends a CSV record unless it ends inside a quoted cell.
+    Since quote characters inside a quoted cell are escaped by doubling them,
+    a record is complete when it contains an even number of quote characters.
+    This is much cheaper than parsing the record,
+    and it allows blocks of records to be handed to a CSV reader elsewhere
+    (e.g. in another process).
+
+    The quote counting assumes that quote characters only appear in quoted cells,
+    which is what a CSV writer produces.
+"""
+
+
+DEFAULT_QUOTECHAR = '"'
+
+
+def iter_record_lines(in_io, quotechar=None):
+    """ Yields a list of text lines for each CSV record read from in_io.
+
+        Most records are a single line,
+        but a record with a quoted line break spans several lines.
+    """
+    quotechar = quotechar or DEFAULT_QUOTECHAR
+    record_line_list = []
+    quote_count = 0
+    for line in in_io:
+        record_line_list.append(line)
+        quote_count += line.count(quotechar)
+        if quote_count % 2 == 0:
+            yield record_line_list
+            record_line_list = []
+            quote_count = 0
+    if record_line_list:
+        yield record_line_list
+
+
+def iter_record_blocks(
+        in_io,
+        record_count_max=None,
+        char_count_max=None,
+        quotechar=None,
+        ):
+    """ Yields blocks of whole CSV records read from in_io.
+
+        Each block is a tuple (record_count, line_list).
+        A block ends when it holds record_count_max records
+        or when it holds at least char_count_max characters.
+    """
+    quotechar = quotechar or DEFAULT_QUOTECHAR
+    block_line_list = []
+    block_record_count = 0
+    block_char_count = 0
+    quote_count = 0
+    for line in in_io:
+        block_line_list.append(line)
+        block_char_count += len(line)
+        quote_count += line.count(quotechar)
+        if quote_count % 2 == 0:
+            quote_count = 0
+            block_record_count += 1
+            if ((record_count_max is not None
+                    and block_record_count >= record_count_max)
+                    or (char_count_max is not None
+                    and block_char_count >= char_count_max)
+                    ):
+                yield (block_record_count, block_line_list)
+                block_line_list = []
+                block_record_count = 0
+                block_char_count = 0
+    if block_line_list:
+        if quote_count != 0:
+            # an unterminated quoted cell still counts as a record
+            block_record_count += 1
+        yield (block_record_count, block_line_list)
+
+
+def iter_record_offsets(in_bin_io, quotechar=None):
+    """ Yields (offset, line_list) for each CSV record in a binary file.
+
+        offset is the byte position of the start of the record,
+        line_list is a list of the (undecoded) lines of the record.
+        The file encoding must be compatible with ASCII (e.g. UTF-8, cp1252),
+        and lines must end with LF (or CR LF).
+    """
+    quote_byte = (quotechar or DEFAULT_QUOTECHAR).encode("ascii")
+    record_offset = in_bin_io.tell()
+    offset = record_offset
+    record_line_list = []
+    quote_count = 0
+    for line in in_bin_io:
+        record_line_list.append(line)
+        offset += len(line)
+        quote_count += line.count(quote_byte)
+        if quote_count % 2 == 0:
+            yield (record_offset, record_line_list)
+            record_offset = offset
+            record_line_list = []
+            quote_count = 0
+    if record_line_list:
+        yield (record_offset, record_line_list)
+
+
+def read_record_lines_at(in_bin_io, offset, quotechar=None):
+    """ Reads the lines of the CSV record which starts at offset in a binary file. """
+    quote_byte = (quotechar or DEFAULT_QUOTECHAR).encode("ascii")
+    in_bin_io.seek(offset)
+    record_line_list = []
+    quote_count = 0
+    line = in_bin_io.readline()
+    while line:
+        record_line_list.append(line)
+        quote_count += line.count(quote_byte)
+        if quote_count % 2 == 0:
+            break
+        line = in_bin_io.readline()
+    return record_line_list
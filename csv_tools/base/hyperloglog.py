@@ -0,0 +1,87 @@
+""" A HyperLogLog sketch: an estimate of the number of distinct values in a stream.
+
+    A sketch with precision P has 2**P small registers (one byte each).
+    Each value is hashed; the first P bits of the hash choose a register,
+    and the register keeps the longest run of leading zero bits seen
+    in the rest of the hash.  The estimate has a relative standard error
+    of about 1.04 / sqrt(2**P), e.g. 0.8% for the default precision of 14,
+    no matter how many values are added.
+
+    Sketches of the same precision can be merged (the result is the same as
+    a sketch of both streams), and since values are hashed with a fixed
+    function (not the built-in hash()), sketches can be saved and merged
+    by later runs.
+"""
+
+import hashlib
+import math
+
+
+PRECISION_MIN = 4
+PRECISION_MAX = 18
+DEFAULT_PRECISION = 14
+
+HASH_BIT_COUNT = 64
+
+
+class HyperLogLog:
+    """ A sketch of the distinct text values added to it. """
+
+    def __init__(self, precision=None, register_bytes=None):
+        if precision is None:
+            precision = DEFAULT_PRECISION
+        if not PRECISION_MIN <= precision <= PRECISION_MAX:
+            raise ValueError(
+                "HyperLogLog precision must be from {0} to {1}: {2}".format(
+                    PRECISION_MIN, PRECISION_MAX, precision
+                    ))
+        self.precision = precision
+        register_count = 1 << precision
+        if register_bytes is None:
+            self.registers = bytearray(register_count)
+        else:
+            if len(register_bytes) != register_count:
+                raise ValueError("HyperLogLog sketch does not match its precision")
+            self.registers = bytearray(register_bytes)
+        # bits of the hash which are left after the register index
+        self._rank_bit_count = HASH_BIT_COUNT - precision
+        self._rank_mask = (1 << self._rank_bit_count) - 1
+
+    def add(self, value):
+        value_hash = int.from_bytes(
+            hashlib.blake2b(value.encode("utf_8"), digest_size=8).digest(),
+            "big"
+            )
+        register_index = value_hash >> self._rank_bit_count
+        rank = self._rank_bit_count - (value_hash & self._rank_mask).bit_length() + 1
+        if rank > self.registers[register_index]:
+            self.registers[register_index] = rank
+
+    def merge(self, other):
+        """ Adds the values of another sketch (of the same precision) to this one. """
+        if other.precision != self.precision:
+            raise ValueError(
+                "cannot merge HyperLogLog sketches of precision {0} and {1}".format(
+                    self.precision, other.precision
+                    ))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """ Returns the estimated number of distinct values added. """
+        register_count = len(self.registers)
+        if register_count == 16:
+            alpha = 0.673
+        elif register_count == 32:
+            alpha = 0.697
+        elif register_count == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1.0 + 1.079 / register_count)
+        estimate = alpha * register_count * register_count / math.fsum(
+            2.0 ** -register for register in self.registers
+            )
+        zero_register_count = self.registers.count(0)
+        if estimate <= 2.5 * register_count and zero_register_count > 0:
+            # small cardinalities are estimated better by "linear counting"
+            estimate = register_count * math.log(register_count / zero_register_count)
+        return int(round(estimate))
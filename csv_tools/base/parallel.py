@@ -0,0 +1,60 @@
+""" Helpers for processing blocks of CSV input in a pool of worker processes. """
+
+from collections import deque
+import gc
+import multiprocessing
+import os
+
+
+def lookup_job_count(job_count_str):
+    """ Decodes a --jobs argument; 'ALL' means one job per CPU. """
+    if job_count_str is None:
+        return 1
+    if job_count_str.strip().upper() == "ALL":
+        return os.cpu_count() or 1
+    return max(1, int(job_count_str))
+
+
+def create_pool(job_count, initializer=None, initargs=(), should_share_initargs=False):
+    """ Creates a multiprocessing pool of job_count worker processes.
+
+        If should_share_initargs is True and the platform supports it,
+        the workers are forked, so that initargs (e.g. a large lookup table)
+        are inherited copy-on-write rather than pickled to each worker.
+        The garbage collector is frozen while the workers are forked
+        so that it does not touch (and so copy) the inherited objects.
+    """
+    if (not should_share_initargs
+            or "fork" not in multiprocessing.get_all_start_methods()):
+        return multiprocessing.Pool(
+            job_count,
+            initializer=initializer,
+            initargs=initargs,
+            )
+    gc.freeze()
+    try:
+        return multiprocessing.get_context("fork").Pool(
+            job_count,
+            initializer=initializer,
+            initargs=initargs,
+            )
+    finally:
+        gc.unfreeze()
+
+
+def imap_ordered(pool, func, arg_iter, pending_count_max):
+    """ Applies func to each item from arg_iter in the pool.
+
+        Results are yielded in the order of arg_iter.
+        This is similar to Pool.imap(), except that at most pending_count_max
+        items are submitted before their results are consumed,
+        so that arg_iter (e.g. a large input stream) is not read far ahead
+        and finished results wait in a bounded reorder buffer.
+    """
+    pending_result_queue = deque()
+    for arg in arg_iter:
+        pending_result_queue.append(pool.apply_async(func, (arg,)))
+        while len(pending_result_queue) >= pending_count_max:
+            yield pending_result_queue.popleft().get()
+    while pending_result_queue:
+        yield pending_result_queue.popleft().get()
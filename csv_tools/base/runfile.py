@@ -0,0 +1,286 @@
+""" Temporary "run" files for spilling CSV rows to disk.
+
+    Tools which must hold more rows than fit in memory follow a common
+    pattern: rows are accumulated in memory until a memory budget is used up,
+    then they are written to a temporary CSV file (a "run"),
+    and the runs are read back and merged after the input is exhausted.
+"""
+
+import csv
+import heapq
+import io
+import sys
+import tempfile
+
+
+# Run files are private to the process, so the encoding is fixed.
+RUN_FILE_CHARSET = "utf_8"
+
+# Number of rows examined when estimating the memory used per row.
+ROW_SAMPLE_COUNT = 1000
+
+# Maximum number of run files which are merged (and held open) at once.
+MERGE_FAN_IN = 64
+
+
+def parse_memory_size(size_str):
+    """ Converts a size such as '512M' or '2G' into a number of bytes.
+
+        A bare number is a count of bytes.
+        Returns None if size_str is 'ALL' (i.e. there is no limit).
+    """
+    if size_str is None:
+        return None
+    size_str = size_str.strip().upper()
+    if size_str == "ALL":
+        return None
+    multiplier = 1
+    for suffix, suffix_multiplier in (
+            ("K", 1024),
+            ("M", 1024*1024),
+            ("G", 1024*1024*1024),
+            ("T", 1024*1024*1024*1024),
+            ):
+        if size_str.endswith(suffix + "B"):
+            size_str = size_str[:-2]
+            multiplier = suffix_multiplier
+            break
+        if size_str.endswith(suffix):
+            size_str = size_str[:-1]
+            multiplier = suffix_multiplier
+            break
+    size = int(float(size_str) * multiplier)
+    if size <= 0:
+        raise ValueError("memory size must be positive: " + size_str)
+    return size
+
+
+def estimate_object_size(obj):
+    """ Approximate memory used by a row, tuple or cell value (in bytes). """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += estimate_object_size(item)
+    return size
+
+
+def estimate_row_capacity(row_sample, memory_limit, row_overhead=None):
+    """ Computes how many rows like the ones in row_sample fit in memory_limit.
+
+        row_overhead is an optional function which returns
+        extra memory that is used for each row (e.g. a sort key).
+        Returns None if there is no memory limit.
+    """
+    if memory_limit is None:
+        return None
+    sample_size = 0
+    sample_count = 0
+    for row in row_sample:
+        sample_size += estimate_object_size(row)
+        if row_overhead is not None:
+            sample_size += row_overhead(row)
+        # one list slot to reference the row:
+        sample_size += 8
+        sample_count += 1
+    if sample_count == 0:
+        return None
+    row_size = max(1, sample_size // sample_count)
+    return max(1, memory_limit // row_size)
+
+
+def create_run_file(temp_dir_name=None):
+    """ Creates a new, empty temporary CSV file open for writing and reading.
+
+        The file is deleted when it is closed.
+    """
+    return tempfile.TemporaryFile(
+        mode="w+",
+        encoding=RUN_FILE_CHARSET,
+        newline="",
+        dir=temp_dir_name,
+        )
+
+
+def write_run_file(row_iter, temp_dir_name=None):
+    """ Writes rows to a new temporary CSV file.
+
+        Returns the file object rewound to the start of the file;
+        the file is deleted when it is closed.
+    """
+    run_io = create_run_file(temp_dir_name)
+    run_csv = csv.writer(run_io)
+    run_csv.writerows(row_iter)
+    run_io.seek(0)
+    return run_io
+
+
+def write_named_run_file(row_iter, dir_name):
+    """ Writes rows to a new CSV file in the directory dir_name.
+
+        Returns the path of the file.
+        Unlike write_run_file(), the file can be opened by another process,
+        and it is not deleted automatically.
+    """
+    (run_fd, run_file_path) = tempfile.mkstemp(suffix=".csv", dir=dir_name)
+    with io.open(run_fd, "w", encoding=RUN_FILE_CHARSET, newline="") as run_io:
+        run_csv = csv.writer(run_io)
+        run_csv.writerows(row_iter)
+    return run_file_path
+
+
+def open_run_file(run_file_path):
+    """ Opens a run file written by write_named_run_file(). """
+    return io.open(run_file_path, "r", encoding=RUN_FILE_CHARSET, newline="")
+
+
+def read_run_file(run_io):
+    """ Returns an iterator of the rows stored in a run file. """
+    return csv.reader(run_io)
+
+
+def merge_run_files(run_io_list, key=None, temp_dir_name=None):
+    """ Merges sorted run files into a single sorted row iterator.
+
+        Rows with equal keys are returned in the order of run_io_list,
+        so the merge is stable if the runs were made in input order.
+        If there are too many runs to hold open at once,
+        then groups of runs are first merged into larger runs.
+        Run files are closed when the iterator is exhausted.
+    """
+    run_io_list = list(run_io_list)
+    while len(run_io_list) > MERGE_FAN_IN:
+        next_run_io_list = []
+        run_index = 0
+        while run_index < len(run_io_list):
+            group_io_list = run_io_list[run_index:run_index + MERGE_FAN_IN]
+            if len(group_io_list) == 1:
+                next_run_io_list.append(group_io_list[0])
+            else:
+                next_run_io_list.append(
+                    _merge_into_run_file(group_io_list, key, temp_dir_name)
+                    )
+            run_index += MERGE_FAN_IN
+        run_io_list = next_run_io_list
+    try:
+        row_iter = heapq.merge(
+            *[read_run_file(run_io) for run_io in run_io_list],
+            key=key
+            )
+        for row in row_iter:
+            yield row
+    finally:
+        for run_io in run_io_list:
+            run_io.close()
+
+
+def _merge_into_run_file(run_io_list, key, temp_dir_name):
+    """ Merges sorted run files into a new run file and closes them. """
+    try:
+        row_iter = heapq.merge(
+            *[read_run_file(run_io) for run_io in run_io_list],
+            key=key
+            )
+        return write_run_file(row_iter, temp_dir_name)
+    finally:
+        for run_io in run_io_list:
+            run_io.close()
+
+
+class RunFileSet:
+    """ Sorted run files which are merged in the order they were added.
+
+        To avoid holding too many files open,
+        every MERGE_FAN_IN runs of similar size are merged into a single run
+        as soon as they are added.
+    """
+
+    def __init__(self, key=None, temp_dir_name=None):
+        self.key = key
+        self.temp_dir_name = temp_dir_name
+        # list of (level, run_io); a run at level L holds about FAN_IN**L runs.
+        self.run_list = []
+
+    def __len__(self):
+        return len(self.run_list)
+
+    def add_run(self, row_iter):
+        """ Writes sorted rows to a new run file. """
+        self.add_run_file(write_run_file(row_iter, self.temp_dir_name))
+
+    def add_run_file(self, run_io):
+        """ Adds an open run file of sorted rows (rewound to its start). """
+        run_list = self.run_list
+        run_list.append((0, run_io))
+        while (len(run_list) >= MERGE_FAN_IN
+                and run_list[-MERGE_FAN_IN][0] == run_list[-1][0]
+                ):
+            level = run_list[-1][0]
+            group_io_list = [run_io for _, run_io in run_list[-MERGE_FAN_IN:]]
+            del run_list[-MERGE_FAN_IN:]
+            run_io = _merge_into_run_file(group_io_list, self.key, self.temp_dir_name)
+            run_list.append((level + 1, run_io))
+
+    def merge(self, tail_row_iter=None):
+        """ Returns an iterator over all the rows from all the runs.
+
+            tail_row_iter is an optional sorted row iterator
+            which is merged after (i.e. as if it was added after) the runs.
+            The run files are closed when the iterator is exhausted.
+        """
+        run_io_list = [run_io for _, run_io in self.run_list]
+        self.run_list = []
+        row_iter = merge_run_files(run_io_list, self.key, self.temp_dir_name)
+        if tail_row_iter is not None:
+            row_iter = heapq.merge(row_iter, tail_row_iter, key=self.key)
+        return row_iter
+
+    def close(self):
+        """ Closes (and deletes) any run files which have not been merged. """
+        for _, run_io in self.run_list:
+            run_io.close()
+        self.run_list = []
+
+
+class PartitionFileSet:
+    """ Temporary CSV files which rows are distributed among (e.g. by hash).
+
+        Rows keep their relative order within each partition.
+    """
+
+    def __init__(self, partition_count, temp_dir_name=None):
+        self.partition_io_list = []
+        self.partition_csv_list = []
+        try:
+            for _ in range(partition_count):
+                partition_io = create_run_file(temp_dir_name)
+                self.partition_io_list.append(partition_io)
+                self.partition_csv_list.append(csv.writer(partition_io))
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.partition_io_list)
+
+    def writerow(self, partition_index, row):
+        """ Appends a row to a partition. """
+        self.partition_csv_list[partition_index].writerow(row)
+
+    def read_partition(self, partition_index):
+        """ Returns an iterator of the rows written to a partition. """
+        partition_io = self.partition_io_list[partition_index]
+        partition_io.seek(0)
+        return read_run_file(partition_io)
+
+    def close_partition(self, partition_index):
+        """ Closes (and deletes) a partition after it has been read. """
+        partition_io = self.partition_io_list[partition_index]
+        if partition_io is not None:
+            partition_io.close()
+            self.partition_io_list[partition_index] = None
+            self.partition_csv_list[partition_index] = None
+
+    def close(self):
+        """ Closes (and deletes) all the partitions. """
+        for partition_index in range(len(self.partition_io_list)):
+            self.close_partition(partition_index)
@@ -0,0 +1,93 @@
+""" A sorted array of text keys: a set which uses much less memory than a python set.
+
+    The distinct keys are sorted and concatenated into one string,
+    with an array of the positions where each key ends.
+    So each key costs its characters plus 8 bytes,
+    instead of a string object (about 50 bytes plus its characters)
+    and a hash table slot.  A lookup is a binary search,
+    which is slower than a hash lookup but still O(log N).
+
+    The keys are sorted in chunks, which are packed the same way and merged,
+    so the keys are never all held as string objects at once.
+"""
+
+import heapq
+from array import array
+from itertools import islice
+
+
+DEFAULT_CHUNK_KEY_COUNT = 100000
+
+
+class SortedKeyArray:
+    """ A set of text keys which supports the 'in' operator. """
+
+    def __init__(self, key_iter, chunk_key_count=None):
+        """ Creates the array from an iterable of text keys (which may repeat). """
+        chunk_key_count = chunk_key_count or DEFAULT_CHUNK_KEY_COUNT
+        key_iter = iter(key_iter)
+        chunk_list = []
+        while True:
+            key_list = sorted(islice(key_iter, chunk_key_count))
+            if not key_list:
+                break
+            chunk_list.append(pack_sorted_keys(key_list, chunk_key_count))
+        if len(chunk_list) == 1:
+            (self.key_text, self.key_end_array) = chunk_list[0]
+        else:
+            (self.key_text, self.key_end_array) = pack_sorted_keys(
+                heapq.merge(*[iter_packed_keys(*chunk) for chunk in chunk_list]),
+                chunk_key_count
+                )
+
+    def __len__(self):
+        return len(self.key_end_array)
+
+    def __contains__(self, value):
+        if not isinstance(value, str):
+            return False
+        key_text = self.key_text
+        key_end_array = self.key_end_array
+        low = 0
+        high = len(key_end_array)
+        while low < high:
+            middle = (low + high) >> 1
+            key_start = key_end_array[middle - 1] if middle > 0 else 0
+            key = key_text[key_start:key_end_array[middle]]
+            if key < value:
+                low = middle + 1
+            elif value < key:
+                high = middle
+            else:
+                return True
+        return False
+
+
+def pack_sorted_keys(sorted_key_iter, piece_key_count):
+    """ Returns (key_text, key_end_array) for the distinct keys of a sorted iterable.
+
+        The text is joined from pieces of piece_key_count keys.
+    """
+    key_end_array = array('q')
+    key_text_piece_list = []
+    piece_key_list = []
+    key_end = 0
+    previous_key = None
+    for key in sorted_key_iter:
+        if key != previous_key:
+            piece_key_list.append(key)
+            key_end += len(key)
+            key_end_array.append(key_end)
+            previous_key = key
+            if len(piece_key_list) >= piece_key_count:
+                key_text_piece_list.append(''.join(piece_key_list))
+                piece_key_list = []
+    key_text_piece_list.append(''.join(piece_key_list))
+    return (''.join(key_text_piece_list), key_end_array)
+
+
+def iter_packed_keys(key_text, key_end_array):
+    key_start = 0
+    for key_end in key_end_array:
+        yield key_text[key_start:key_end]
+        key_start = key_end
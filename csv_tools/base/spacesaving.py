@@ -0,0 +1,63 @@
+""" The Space-Saving sketch: approximate counts of the most frequent values in a stream.
+
+    The sketch monitors at most a fixed number of values (its capacity).
+    A value which is not monitored replaces the monitored value with the
+    smallest count, and inherits that count (which is remembered as the
+    value's maximum error).  So every count is an overestimate by at most
+    its error, and any value which occurs more than N / capacity times
+    in a stream of N values is sure to be monitored.
+
+    Metwally, Agrawal, El Abbadi: "Efficient Computation of Frequent
+    and Top-k Elements in Data Streams" (2005).
+"""
+
+import heapq
+
+
+class SpaceSaving:
+    """ Approximate counts of the most frequent hashable values added. """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Space-Saving capacity must be positive: {0}".format(capacity))
+        self.capacity = capacity
+        # monitored value -> [count, error]
+        self.counter_dict = dict()
+        # one (count, sequence, value) entry per monitored value;
+        #  an entry's count may be less than the value's current count,
+        #  it is corrected when the entry reaches the top of the heap.
+        self._count_heap = []
+        self._sequence = 0
+
+    def add(self, value):
+        counter = self.counter_dict.get(value)
+        if counter is not None:
+            counter[0] += 1
+            return
+        count_heap = self._count_heap
+        if len(self.counter_dict) < self.capacity:
+            min_count = 0
+        else:
+            # find the monitored value with the smallest count and replace it
+            while True:
+                (entry_count, _, min_value) = count_heap[0]
+                min_count = self.counter_dict[min_value][0]
+                if entry_count == min_count:
+                    break
+                self._sequence += 1
+                heapq.heapreplace(count_heap, (min_count, self._sequence, min_value))
+            heapq.heappop(count_heap)
+            del self.counter_dict[min_value]
+        self.counter_dict[value] = [min_count + 1, min_count]
+        self._sequence += 1
+        heapq.heappush(count_heap, (min_count + 1, self._sequence, value))
+
+    def items(self):
+        """ Returns a list of (value, count, error) for the monitored values.
+
+            The true count of each value is from (count - error) to count.
+        """
+        return [
+            (value, count, error)
+            for (value, (count, error)) in self.counter_dict.items()
+            ]
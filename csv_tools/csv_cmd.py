@@ -38,7 +38,7 @@ COMMANDS:
     rowcalc    : Execute a custom python script on each row of a CSV stream.
     rownum     : Add a row count column to a CSV stream.
     select     : Select/Project and rename a subset of CSV columns.
-    sort       : Sort CSV rows in memory.
+    sort       : Sort CSV rows; spill to temporary files if memory is limited.
     tail       : Omit all except the final rows of a CSV stream.
     translate  : Translate between CSV encodings. Skip and omit tail rows.
     wsv        : Convert between CSV and Whitespace Separated Value data.
@@ -2,7 +2,7 @@
 ##  Subject to an 'MIT' License.  See LICENSE file in top-level directory  ##
 
 help_text = (
-    "CSV-DISTINCT tool version 20160927:20170512\n"
+    "CSV-DISTINCT tool version 20160927:20261018\n"
     "Find distinct cell values in a column of a CSV file\n"
     "\n"
     "csv-distinct [OPTIONS] SourceColumns [InputFile]\n"
@@ -10,20 +10,134 @@ help_text = (
     "OPTIONS\n"
     "    -F {F}  Column/Field name for counter column\n"
     "    -o {F}  Output file name\n"
+    "    -A {L}  Aggregates to write for each distinct value (e.g. sum:amount,max:ts)\n"
+    "    -T {D}  Directory for temporary files (default=system temp directory)\n"
     "    --ignore-case   Ignore character case when comparing values\n"
+    "    --memory-limit {M}  Approximate memory to use for distinct values (e.g. 512M, 2G)\n"
+    "    --sorted-input  The input is sorted on SourceColumns; write each value as it ends\n"
+    "    --jobs {N}  Number of worker processes used to count distinct values (default=1)\n"
+    "    --approx  Estimate the number of distinct values in each column\n"
+    "    --approx-precision {P}  Precision of the estimates, from 4 to 18 (default=14)\n"
+    "    --merge-sketch {F}  Add the distinct values of a saved sketch file (--approx)\n"
+    "    --save-sketch {F}  Save the sketches of the distinct values to a file (--approx)\n"
+    "    --top {K}  Write only the K most frequent distinct values, by count\n"
+    "    --top-capacity {N}  Number of values to keep for --approx --top (default=max(1000,10*K))\n"
     "\n"
     "SourceColumns is a comma-separated list of column names found in the input stream.\n"
+    "\n"
+    "The -A option is a comma-separated list of aggregates, each a function\n"
+    "and a column name (function:column).  The functions are sum, min, max\n"
+    "and avg (the mean).  Each aggregate is written in a column named\n"
+    "function_column (e.g. sum_amount) after the counter column.\n"
+    "Empty values are ignored; other values must be numbers.  Sums (and the sums\n"
+    "of averages) are rounded to the most decimal places of their values\n"
+    "(e.g. 2 for amounts such as 12.50), and min and max are written as they\n"
+    "appear in the input.  Averages are written with up to 15 significant digits.\n"
+    "Aggregates are not available with --approx.\n"
+    "\n"
+    "Distinct values are counted in memory unless the --memory-limit option is used.\n"
+    "When there are more distinct values than fit in memory, the sorted values\n"
+    "and their partial counts are written to temporary files, which are merged\n"
+    "(and the counts summed) to produce the output.\n"
+    "\n"
+    "With the --sorted-input option, rows with the same values must be adjacent\n"
+    "and in order (e.g. sorted by csv-sort without key options).  Each distinct\n"
+    "value is written as soon as the next value is found, so only one value\n"
+    "is held in memory; the tool stops with an error if the input is not sorted.\n"
+    "\n"
+    "If --jobs is more than 1 (or ALL for one job per CPU), the input is split\n"
+    "into blocks of rows which are parsed and counted by worker processes.\n"
+    "The partial counts are divided by a hash of the distinct values into\n"
+    "partitions, which are summed by the workers in parallel and then merged.\n"
+    "The output is the same as for a single process.  The --memory-limit option\n"
+    "is not used with --jobs; each worker holds one partition of the counts.\n"
+    "\n"
+    "With the --approx option, the distinct values themselves are not written;\n"
+    "instead a single row is written with the estimated number of distinct values\n"
+    "in each of the SourceColumns.  Each column is summarized by a HyperLogLog\n"
+    "sketch of 2^P bytes, the typical error is 1.04/sqrt(2^P) (0.8% for P=14).\n"
+    "Sketches can be saved with --save-sketch and combined with later runs\n"
+    "with --merge-sketch (e.g. to count distinct values over many daily files\n"
+    "without reading them again).  If --merge-sketch is used without an\n"
+    "InputFile, then only the sketch files are read.\n"
+    "\n"
+    "With the --top option, the K distinct values with the largest counts are\n"
+    "written in order of count (largest first), with a count column\n"
+    "(named by -F, or 'count').  All the values are counted, but only K are\n"
+    "kept when the counts are sorted.  With --approx and --top, only N values\n"
+    "are counted at a time (the Space-Saving algorithm); each count may be\n"
+    "too large by up to the value of an extra error column, and any value\n"
+    "which occurs more than 1/N of the time is sure to be found.\n"
 )
 
 import sys
 import csv
 import io
+import base64
+import decimal
+import json
+import math
+import os
+import heapq
+import shutil
+import tempfile
+import zlib
+from array import array
+from itertools import chain, islice
 
 from ._csv_helpers import (
     decode_delimiter_name
     ,decode_charset_name
     ,decode_newline
     )
+from .base.hyperloglog import (
+    HyperLogLog
+    )
+from .base.spacesaving import (
+    SpaceSaving
+    )
+from .base.csvblock import (
+    iter_record_blocks
+    )
+from .base.parallel import (
+    create_pool
+    ,imap_ordered
+    ,lookup_job_count
+    )
+from .base.runfile import (
+    ROW_SAMPLE_COUNT
+    ,RUN_FILE_CHARSET
+    ,estimate_row_capacity
+    ,merge_run_files
+    ,open_run_file
+    ,parse_memory_size
+    ,read_run_file
+    ,write_named_run_file
+    ,RunFileSet
+    )
+
+# Rough memory used by the dictionary entry and the count of a distinct value
+DISTINCT_ROW_OVERHEAD = 100
+# approximate size of the text of a min or max aggregate (a short str)
+AGGREGATE_TEXT_OVERHEAD = 56
+# sums of numbers with more decimal places than this are not rounded (floats have about 15 digits)
+AGGREGATE_DECIMAL_PLACE_COUNT_MAX = 15
+
+# Functions which can be used in aggregate columns (-A)
+AGGREGATE_FUNCTION_NAME_LIST = ['sum', 'min', 'max', 'avg']
+
+# Saved sketch files are identified by this name
+SKETCH_FORMAT_NAME = 'csv-distinct-hyperloglog-1'
+
+# Default number of values counted by --approx --top is the larger of these
+TOP_CAPACITY_MIN = 1000
+TOP_CAPACITY_FACTOR = 10
+
+# Number of rows sent to a worker process at a time (with --jobs)
+DEFAULT_BLOCK_ROW_COUNT = 100000
+
+# Number of partitions of the partial counts for each worker process (with --jobs)
+PARTITION_COUNT_FACTOR = 2
 
 def main(arg_list, stdin, stdout, stderr):
     in_io = stdin
@@ -45,6 +159,20 @@ def main(arg_list, stdin, stdout, stderr):
     in_source_column_name_list_string = None
     in_counter_column_name = None
     should_ignore_case = False
+    memory_limit_str = None
+    memory_limit = None
+    temp_dir_name = None
+    should_approximate = False
+    approx_precision = None
+    merge_sketch_file_name_list = []
+    save_sketch_file_name = None
+    top_count = None
+    top_capacity = None
+    is_sorted_input = False
+    job_count_str = None
+    aggregate_spec_list = []
+    err_msg = None
+    exit_code = 0
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -145,6 +273,84 @@ def main(arg_list, stdin, stdout, stderr):
                 csv_cell_width_limit = int(arg)
         elif (arg == "--ignore-case"):
             should_ignore_case = True
+        elif (arg == "--approx"
+        ):
+            should_approximate = True
+        elif (arg == "--approx-precision"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    approx_precision = int(arg)
+                except ValueError:
+                    err_msg = "Invalid precision: " + arg
+        elif (arg == "--merge-sketch"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                merge_sketch_file_name_list.append(arg)
+        elif (arg == "--save-sketch"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                save_sketch_file_name = arg
+        elif (arg == "--top"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    top_count = int(arg)
+                except ValueError:
+                    top_count = 0
+                if (0 >= top_count):
+                    err_msg = "Invalid top count: " + arg
+        elif (arg == "--top-capacity"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    top_capacity = int(arg)
+                except ValueError:
+                    top_capacity = 0
+                if (0 >= top_capacity):
+                    err_msg = "Invalid top capacity: " + arg
+        elif (arg == "--sorted-input"
+        ):
+            is_sorted_input = True
+        elif (arg == "--jobs"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                job_count_str = arg
+        elif (arg == "-A"
+            or arg == "--aggregate"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    aggregate_spec_list.extend(parse_aggregate_spec_list(arg))
+                except ValueError as exc:
+                    err_msg = str(exc)
+        elif (arg == "--memory-limit"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                memory_limit_str = arg
+        elif (arg == "-T"
+            or arg == "--temp-dir"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                temp_dir_name = arg
         elif (None != arg
           and 0 < len(arg)
           ):
@@ -157,7 +363,43 @@ def main(arg_list, stdin, stdout, stderr):
     if (None == in_source_column_name_list_string):
         show_help = True
 
-    if (show_help):
+    job_count = 1
+    try:
+        memory_limit = parse_memory_size(memory_limit_str)
+        job_count = lookup_job_count(job_count_str)
+        if (should_approximate):
+            # check the precision
+            HyperLogLog(approx_precision)
+    except ValueError as exc:
+        err_msg = str(exc)
+    if (None != err_msg):
+        pass
+    elif ((not should_approximate or None != top_count)
+        and (None != approx_precision
+            or 0 < len(merge_sketch_file_name_list)
+            or None != save_sketch_file_name
+            )
+        ):
+        err_msg = "--approx-precision, --merge-sketch and --save-sketch require --approx (without --top)"
+    elif (None != top_capacity
+        and (not should_approximate or None == top_count)
+        ):
+        err_msg = "--top-capacity requires --approx and --top"
+    elif (should_approximate
+        and 0 < len(aggregate_spec_list)
+        ):
+        err_msg = "-A cannot be used with --approx"
+
+    if (None != top_count
+        and None == in_counter_column_name
+        ):
+        in_counter_column_name = 'count'
+
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
         in_source_column_name_list = []
@@ -224,15 +466,54 @@ def main(arg_list, stdin, stdout, stderr):
                 ,lineterminator=output_row_terminator
                 )
             try:
-                execute(
-                  in_csv, 
-                  out_csv, 
-                  input_delimiter, 
-                  output_delimiter,
-                  in_source_column_name_list,
-                  in_counter_column_name 
-                  ,should_ignore_case
-                  )
+                if (should_approximate
+                    and None != top_count
+                    ):
+                    if (None == top_capacity):
+                        top_capacity = max(TOP_CAPACITY_MIN, TOP_CAPACITY_FACTOR * top_count)
+                    execute_top_approx(
+                        in_csv
+                        ,out_csv
+                        ,in_source_column_name_list
+                        ,in_counter_column_name
+                        ,should_ignore_case
+                        ,top_count
+                        ,top_capacity
+                        )
+                elif (should_approximate):
+                    if (None == input_file_name
+                        and 0 < len(merge_sketch_file_name_list)
+                        ):
+                        # only combine the saved sketches
+                        in_csv = None
+                    execute_approx(
+                        in_csv
+                        ,out_csv
+                        ,in_source_column_name_list
+                        ,should_ignore_case
+                        ,approx_precision
+                        ,merge_sketch_file_name_list
+                        ,save_sketch_file_name
+                        )
+                else:
+                    execute(
+                      in_csv, 
+                      out_csv, 
+                      input_delimiter, 
+                      output_delimiter,
+                      in_source_column_name_list,
+                      in_counter_column_name 
+                      ,should_ignore_case
+                      ,memory_limit
+                      ,temp_dir_name
+                      ,top_count
+                      ,is_sorted_input
+                      ,job_count
+                      ,in_io
+                      ,aggregate_spec_list
+                      )
+            except ValueError as exc:
+                err_msg = str(exc)
             except BrokenPipeError:
                 # ignore BrokenPipeError; it is raised when a downstream process exits early (head.exe does this)
                 pass
@@ -244,6 +525,11 @@ def main(arg_list, stdin, stdout, stderr):
                 in_file.close()
             if (None != out_file):
                 out_file.close()
+        if (None != err_msg):
+            err_io.write(err_msg)
+            err_io.write("\n")
+            exit_code = 1
+    return exit_code
 
 def execute(
     in_csv
@@ -253,7 +539,22 @@ def execute(
     , in_source_column_name_list
     , in_counter_column_name
     , should_ignore_case
+    , memory_limit=None
+    , temp_dir_name=None
+    , top_count=None
+    , is_sorted_input=False
+    , job_count=1
+    , in_io=None
+    , aggregate_spec_list=None
     ):
+    """ Count the distinct values of the source columns.
+
+        If job_count is more than 1, then in_io is the text stream of in_csv,
+        and the rows are counted in worker processes.
+        aggregate_spec_list is a list of (function_name, column_name);
+        if there are aggregates, then each distinct row has an array
+        of its count and aggregates (see DistinctRowAggregator) instead of a count.
+    """
     end_row = None
     end_cell = None
     distinct_row_counters = dict()
@@ -283,49 +584,899 @@ def execute(
                 in_source_column_position_list.append(found_column_position)
                 out_column_name_list.append(out_column_name)
             out_column_position += 1
+    aggregator = None
+    if (None != in_header_row
+        and None != aggregate_spec_list
+        and 0 < len(aggregate_spec_list)
+        ):
+        aggregator = DistinctRowAggregator(aggregate_spec_list, in_header_row)
     
+    # write a header row
+    out_row = list(out_column_name_list)
+    if (None != in_counter_column_name):
+        out_row.append(in_counter_column_name)
+    if (None != aggregator):
+        out_row.extend(aggregator.out_column_name_list)
+    out_csv.writerow(out_row)
+
     # look for distinct rows
-    if (0 < len(out_column_name_list)
-        and len(out_column_name_list) == len(in_source_column_position_list)
+    # if there is a memory limit, use the first rows to estimate
+    #  how many distinct rows fit in memory;
+    #  when there are more, the sorted counts are written to a run file
+    #  and the run files are merged when all the input has been read.
+    run_row_key = get_run_row_key
+    distinct_row_overhead = get_distinct_row_overhead
+    top_count_order = get_top_count_order
+    if (None != aggregator):
+        run_row_key = aggregator.get_run_row_key
+        distinct_row_overhead = aggregator.get_distinct_row_overhead
+        top_count_order = aggregator.get_top_count_order
+    run_set = RunFileSet(run_row_key, temp_dir_name)
+    distinct_count_iter = None
+    try:
+        if (0 < len(out_column_name_list)
+            and len(out_column_name_list) == len(in_source_column_position_list)
+            and is_sorted_input
+            ):
+            # distinct rows are counted as they are written
+            distinct_count_iter = iter_sorted_input_counts(
+                in_csv
+                ,compile_distinct_row_key_function(
+                    in_source_column_position_list
+                    ,should_ignore_case
+                    )
+                ,aggregator
+                )
+        elif (0 < len(out_column_name_list)
+            and len(out_column_name_list) == len(in_source_column_position_list)
+            and 1 < job_count
+            ):
+            distinct_count_iter = iter_parallel_counts(
+                in_io
+                ,in_csv.dialect
+                ,in_source_column_position_list
+                ,should_ignore_case
+                ,job_count
+                ,temp_dir_name
+                ,aggregator
+                )
+        elif (0 < len(out_column_name_list)
+            and len(out_column_name_list) == len(in_source_column_position_list)
+            ):
+            get_distinct_row_key = compile_distinct_row_key_function(
+                in_source_column_position_list
+                ,should_ignore_case
+                )
+            distinct_row_count_max = None
+            if (None != memory_limit):
+                in_row_list = list(islice(in_csv, ROW_SAMPLE_COUNT))
+                distinct_row_count_max = estimate_row_capacity(
+                    list(map(get_distinct_row_key, in_row_list))
+                    ,memory_limit
+                    ,distinct_row_overhead
+                    )
+                in_csv = chain(in_row_list, in_csv)
+            if (None == aggregator):
+                for in_row in in_csv:
+                    distinct_row_key = get_distinct_row_key(in_row)
+                    distinct_row_counters[distinct_row_key] = distinct_row_counters.get(distinct_row_key, 0) + 1
+                    if (None != distinct_row_count_max
+                        and distinct_row_count_max < len(distinct_row_counters)
+                        ):
+                        run_set.add_run(iter_sorted_count_rows(distinct_row_counters))
+                        distinct_row_counters.clear()
+            else:
+                for in_row in in_csv:
+                    distinct_row_key = get_distinct_row_key(in_row)
+                    distinct_row_value = distinct_row_counters.get(distinct_row_key)
+                    if (None == distinct_row_value):
+                        distinct_row_value = aggregator.new_value()
+                        distinct_row_counters[distinct_row_key] = distinct_row_value
+                    aggregator.add_row(distinct_row_value, in_row)
+                    if (None != distinct_row_count_max
+                        and distinct_row_count_max < len(distinct_row_counters)
+                        ):
+                        run_set.add_run(iter_sorted_count_rows(distinct_row_counters, aggregator))
+                        distinct_row_counters.clear()
+
+        if (0 < len(run_set)):
+            # the counts still in memory are merged after the spilled runs
+            count_row_iter = run_set.merge(iter_sorted_count_rows(distinct_row_counters, aggregator))
+            distinct_row_counters = None
+            distinct_count_iter = iter_merged_counts(count_row_iter, aggregator)
+        elif (None != top_count
+            and None == distinct_count_iter
+            ):
+            distinct_count_iter = distinct_row_counters.items()
+        elif (None != aggregator
+            and None == distinct_count_iter
+            ):
+            distinct_count_iter = sorted(distinct_row_counters.items())
+        if (None != top_count):
+            # keep a bounded heap of the K largest counts
+            distinct_count_iter = heapq.nsmallest(
+                top_count
+                ,distinct_count_iter
+                ,key=top_count_order
+                )
+        if (None != distinct_count_iter
+            and None != aggregator
+            ):
+            for (distinct_row, distinct_row_value) in distinct_count_iter:
+                out_row = list(distinct_row)
+                if (None != in_counter_column_name):
+                    out_row.append(aggregator.get_count(distinct_row_value))
+                out_row.extend(aggregator.get_out_cells(distinct_row_value))
+                out_csv.writerow(out_row)
+            return
+        if (None != distinct_count_iter):
+            for (distinct_row, distinct_row_count) in distinct_count_iter:
+                out_row = list(distinct_row)
+                if (None != in_counter_column_name):
+                    out_row.append(distinct_row_count)
+                out_csv.writerow(out_row)
+            return
+
+        # construct a new mutable list of the keys so that we can sort it
+        distinct_row_list = list(distinct_row_counters.keys())
+        distinct_row_list.sort()
+        for distinct_row in distinct_row_list:
+            out_row = list(distinct_row)
+            if (None != in_counter_column_name):
+                distinct_row_count = distinct_row_counters[distinct_row]
+                out_row.append(distinct_row_count)
+            out_csv.writerow(out_row)
+    finally:
+        run_set.close()
+
+def iter_parallel_counts(
+    in_io
+    ,in_dialect
+    ,in_source_column_position_list
+    ,should_ignore_case
+    ,job_count
+    ,temp_dir_name
+    ,aggregator=None
+    ):
+    """ Count distinct rows in worker processes; yield (distinct_row, count) in order.
+
+        If there is an aggregator, then the count is an array of the count and aggregates.
+
+        in_io must be positioned after the header row.
+        Each block of rows is counted by a worker, which appends the counts
+        to its own file for each partition (by a hash of the distinct values).
+        Then each partition is summed and sorted by a worker,
+        and the sorted partitions are merged.
+        The rows are sent to the workers as unparsed text,
+        and the counts are exchanged through files.
+    """
+    partition_count = PARTITION_COUNT_FACTOR * job_count
+    run_dir_name = tempfile.mkdtemp(prefix='csv-distinct-', dir=temp_dir_name)
+    pool = None
+    count_row_iter = None
+    try:
+        pool = create_pool(
+            job_count
+            ,init_distinct_worker
+            ,(
+                in_source_column_position_list
+                ,should_ignore_case
+                ,in_dialect.delimiter
+                ,in_dialect.lineterminator
+                ,partition_count
+                ,run_dir_name
+                ,aggregator
+            ))
+        in_block_iter = iter_record_blocks(in_io, DEFAULT_BLOCK_ROW_COUNT)
+        in_line_list_iter = (in_line_list for (_, in_line_list) in in_block_iter)
+        for _ in imap_ordered(pool, count_block, in_line_list_iter, 2 * job_count):
+            pass
+        partition_file_path_list = pool.map(sum_partition, range(partition_count), 1)
+        pool.close()
+        pool.join()
+        pool = None
+
+        run_row_key = get_run_row_key
+        if (None != aggregator):
+            run_row_key = aggregator.get_run_row_key
+        count_row_iter = merge_run_files(
+            [
+                open_run_file(partition_file_path)
+                for partition_file_path in partition_file_path_list
+                if (None != partition_file_path)
+            ]
+            ,key=run_row_key
+            ,temp_dir_name=temp_dir_name
+            )
+        if (None == aggregator):
+            for count_row in count_row_iter:
+                yield (count_row[:-1], int(count_row[-1]))
+        else:
+            value_cell_count = aggregator.value_cell_count
+            for count_row in count_row_iter:
+                yield (count_row[:-value_cell_count], aggregator.read_run_cells(count_row[-value_cell_count:]))
+    finally:
+        if (None != pool):
+            pool.terminate()
+        if (None != count_row_iter):
+            count_row_iter.close()
+        shutil.rmtree(run_dir_name, ignore_errors=True)
+
+# state of a worker process used by iter_parallel_counts()
+distinct_worker_state = None
+# the worker's partition files, opened as they are needed
+distinct_worker_partition_list = None
+
+def init_distinct_worker(
+    in_source_column_position_list
+    ,should_ignore_case
+    ,input_delimiter
+    ,input_row_terminator
+    ,partition_count
+    ,run_dir_name
+    ,aggregator
+    ):
+    global distinct_worker_state
+    global distinct_worker_partition_list
+    get_distinct_row_key = compile_distinct_row_key_function(
+        in_source_column_position_list
+        ,should_ignore_case
+        )
+    distinct_worker_state = (
+        get_distinct_row_key
+        ,input_delimiter
+        ,input_row_terminator
+        ,partition_count
+        ,run_dir_name
+        ,aggregator
+        )
+    distinct_worker_partition_list = [None] * partition_count
+
+def get_partition_file_name(run_dir_name, partition_index, worker_id):
+    return os.path.join(run_dir_name, 'part{0:04d}-{1}.csv'.format(partition_index, worker_id))
+
+def count_block(in_line_list):
+    """ Count the distinct rows in a block of csv text; append the counts to partition files. """
+    (
+        get_distinct_row_key
+        ,input_delimiter
+        ,input_row_terminator
+        ,partition_count
+        ,run_dir_name
+        ,aggregator
+    ) = distinct_worker_state
+    in_csv = csv.reader(
+        in_line_list
+        ,delimiter=input_delimiter
+        ,lineterminator=input_row_terminator
+        )
+    distinct_row_counters = dict()
+    if (None == aggregator):
+        for in_row in in_csv:
+            distinct_row_key = get_distinct_row_key(in_row)
+            distinct_row_counters[distinct_row_key] = distinct_row_counters.get(distinct_row_key, 0) + 1
+    else:
+        for in_row in in_csv:
+            distinct_row_key = get_distinct_row_key(in_row)
+            distinct_row_value = distinct_row_counters.get(distinct_row_key)
+            if (None == distinct_row_value):
+                distinct_row_value = aggregator.new_value()
+                distinct_row_counters[distinct_row_key] = distinct_row_value
+            aggregator.add_row(distinct_row_value, in_row)
+    for (distinct_row_key, distinct_row_count) in distinct_row_counters.items():
+        count_row = [
+            '' if (None == cell_value) else cell_value
+            for cell_value in distinct_row_key
+            ]
+        # a hash which is the same in every process (unlike hash())
+        partition_index = zlib.crc32('\x1f'.join(count_row).encode(RUN_FILE_CHARSET)) % partition_count
+        if (None == aggregator):
+            count_row.append(distinct_row_count)
+        else:
+            count_row.extend(aggregator.get_run_cells(distinct_row_count))
+        partition = distinct_worker_partition_list[partition_index]
+        if (None == partition):
+            partition_io = io.open(
+                get_partition_file_name(run_dir_name, partition_index, os.getpid())
+                ,'a'
+                ,encoding=RUN_FILE_CHARSET
+                ,newline=''
+                )
+            partition = (partition_io, csv.writer(partition_io))
+            distinct_worker_partition_list[partition_index] = partition
+        partition[1].writerow(count_row)
+    # the counts must be on disk when the block is done
+    for partition in distinct_worker_partition_list:
+        if (None != partition):
+            partition[0].flush()
+
+def sum_partition(partition_index):
+    """ Sum the counts of a partition from all the workers; return the path of a sorted run file. """
+    (
+        _
+        ,_
+        ,_
+        ,_
+        ,run_dir_name
+        ,aggregator
+    ) = distinct_worker_state
+    partition_file_prefix = 'part{0:04d}-'.format(partition_index)
+    distinct_row_counters = dict()
+    for file_name in os.listdir(run_dir_name):
+        if (file_name.startswith(partition_file_prefix)):
+            with open_run_file(os.path.join(run_dir_name, file_name)) as partition_io:
+                if (None == aggregator):
+                    for count_row in read_run_file(partition_io):
+                        distinct_row_key = tuple(count_row[:-1])
+                        distinct_row_counters[distinct_row_key] = (
+                            distinct_row_counters.get(distinct_row_key, 0) + int(count_row[-1])
+                            )
+                else:
+                    value_cell_count = aggregator.value_cell_count
+                    for count_row in read_run_file(partition_io):
+                        distinct_row_key = tuple(count_row[:-value_cell_count])
+                        distinct_row_value = aggregator.read_run_cells(count_row[-value_cell_count:])
+                        if (distinct_row_key in distinct_row_counters):
+                            aggregator.merge_value(distinct_row_counters[distinct_row_key], distinct_row_value)
+                        else:
+                            distinct_row_counters[distinct_row_key] = distinct_row_value
+    if (0 == len(distinct_row_counters)):
+        return None
+    return write_named_run_file(
+        iter_sorted_count_rows(distinct_row_counters, aggregator)
+        ,run_dir_name
+        )
+
+def execute_approx(
+    in_csv
+    ,out_csv
+    ,in_source_column_name_list
+    ,should_ignore_case
+    ,approx_precision
+    ,merge_sketch_file_name_list
+    ,save_sketch_file_name
+    ):
+    """ Estimate the number of distinct values in each source column.
+
+        Each column has a HyperLogLog sketch, which uses constant memory.
+        If in_csv is None, then only the sketch files are read.
+    """
+    end_row = None
+    out_column_name_list = list(in_source_column_name_list)
+    in_source_column_position_list = None
+    if (None != in_csv):
+        in_header_row = next(in_csv, end_row)
+        out_column_name_list = list()
+        in_source_column_position_list = list()
+        if (None != in_header_row):
+            for (out_column_name, in_source_column_position) in zip(
+                in_source_column_name_list
+                ,find_column_position_list(in_header_row, in_source_column_name_list)
+                ):
+                if (None != in_source_column_position):
+                    in_source_column_position_list.append(in_source_column_position)
+                    out_column_name_list.append(out_column_name)
+
+    sketch_list = [HyperLogLog(approx_precision) for _ in out_column_name_list]
+    if (None != in_source_column_position_list
+        and 0 < len(in_source_column_position_list)
         ):
-        in_row = next(in_csv, end_row)
-        while (end_row != in_row):
-            out_column_position = 0
-            out_row = list()
-            while (out_column_position < len(out_column_name_list)):
-                in_source_column_position = in_source_column_position_list[out_column_position]
-                cell_value = None
-                if (in_source_column_position < len(in_row)):
+        sketch_column_list = list(zip(in_source_column_position_list, sketch_list))
+        for in_row in in_csv:
+            in_row_length = len(in_row)
+            for (in_source_column_position, sketch) in sketch_column_list:
+                if (in_source_column_position < in_row_length):
                     cell_value = in_row[in_source_column_position]
-                if (None != cell_value
-                    and should_ignore_case
-                    ):
-                    cell_value = cell_value.upper()
-                out_row.append(cell_value)
-                out_column_position += 1
+                    if (should_ignore_case):
+                        cell_value = cell_value.upper()
+                    sketch.add(cell_value)
 
-            distinct_row_key = tuple(out_row)
-            distinct_row_count = distinct_row_counters.get(distinct_row_key, 0)
-            distinct_row_count += 1
-            distinct_row_counters[distinct_row_key] = distinct_row_count 
-            in_row = next(in_csv, end_row)
+    if (0 < len(merge_sketch_file_name_list)):
+        # the merged counts are only meaningful for columns which are in the input and the sketches
+        for in_source_column_name in in_source_column_name_list:
+            if (not in_source_column_name in out_column_name_list):
+                raise ValueError("Input has no column {0}".format(in_source_column_name))
+    for merge_sketch_file_name in merge_sketch_file_name_list:
+        merge_sketch_dict = load_sketch_file(merge_sketch_file_name)
+        for (out_column_name, sketch) in zip(out_column_name_list, sketch_list):
+            merge_sketch = merge_sketch_dict.get(normalize_column_name(out_column_name))
+            if (None == merge_sketch):
+                raise ValueError("Sketch file {0} has no column {1}".format(
+                    merge_sketch_file_name
+                    ,out_column_name
+                    ))
+            sketch.merge(merge_sketch)
+
+    if (None != save_sketch_file_name):
+        save_sketch_file(save_sketch_file_name, out_column_name_list, sketch_list)
+
+    out_csv.writerow(out_column_name_list)
+    out_csv.writerow([sketch.estimate() for sketch in sketch_list])
+
+def execute_top_approx(
+    in_csv
+    ,out_csv
+    ,in_source_column_name_list
+    ,in_counter_column_name
+    ,should_ignore_case
+    ,top_count
+    ,top_capacity
+    ):
+    """ Write the (approximately) most frequent distinct rows, using a Space-Saving sketch. """
+    end_row = None
+    out_column_name_list = list()
+    in_source_column_position_list = list()
+    in_header_row = next(in_csv, end_row)
+    if (None != in_header_row):
+        for (out_column_name, in_source_column_position) in zip(
+            in_source_column_name_list
+            ,find_column_position_list(in_header_row, in_source_column_name_list)
+            ):
+            if (None != in_source_column_position):
+                in_source_column_position_list.append(in_source_column_position)
+                out_column_name_list.append(out_column_name)
+
+    top_sketch = SpaceSaving(top_capacity)
+    if (0 < len(in_source_column_position_list)):
+        get_distinct_row_key = compile_distinct_row_key_function(
+            in_source_column_position_list
+            ,should_ignore_case
+            )
+        for in_row in in_csv:
+            top_sketch.add(get_distinct_row_key(in_row))
 
-    # write a header row
     out_row = list(out_column_name_list)
-    if (None != in_counter_column_name):
-        out_row.append(in_counter_column_name)
+    out_row.append(in_counter_column_name)
+    out_row.append(in_counter_column_name + '_error')
     out_csv.writerow(out_row)
-
-    # construct a new mutable list of the keys so that we can sort it
-    distinct_row_list = list(distinct_row_counters.keys())
-    distinct_row_list.sort()
-    for distinct_row in distinct_row_list:
+    top_item_list = heapq.nsmallest(
+        top_count
+        ,top_sketch.items()
+        ,key=get_top_count_order
+        )
+    for (distinct_row, distinct_row_count, distinct_row_count_error) in top_item_list:
         out_row = list(distinct_row)
-        if (None != in_counter_column_name):
-            distinct_row_count = distinct_row_counters[distinct_row]
-            out_row.append(distinct_row_count)
+        out_row.append(distinct_row_count)
+        out_row.append(distinct_row_count_error)
         out_csv.writerow(out_row)
 
+def load_sketch_file(sketch_file_name):
+    """ Read a sketch file; return a dictionary of HyperLogLog sketches by normalized column name. """
+    try:
+        with io.open(sketch_file_name, 'rt', encoding='utf_8') as sketch_io:
+            sketch_file_dict = json.load(sketch_io)
+    except OSError as exc:
+        raise ValueError("Cannot read sketch file {0}: {1}".format(sketch_file_name, exc))
+    except ValueError:
+        sketch_file_dict = None
+    if (not isinstance(sketch_file_dict, dict)
+        or SKETCH_FORMAT_NAME != sketch_file_dict.get('format')
+        ):
+        raise ValueError("Not a sketch file: " + sketch_file_name)
+    sketch_dict = dict()
+    for (column_name, register_text) in sketch_file_dict['columns'].items():
+        sketch_dict[normalize_column_name(column_name)] = HyperLogLog(
+            sketch_file_dict['precision']
+            ,base64.b64decode(register_text)
+            )
+    return sketch_dict
+
+def save_sketch_file(sketch_file_name, column_name_list, sketch_list):
+    precision = None
+    column_dict = dict()
+    for (column_name, sketch) in zip(column_name_list, sketch_list):
+        precision = sketch.precision
+        column_dict[column_name] = base64.b64encode(bytes(sketch.registers)).decode('ascii')
+    sketch_file_dict = {
+        'format': SKETCH_FORMAT_NAME,
+        'precision': precision,
+        'columns': column_dict,
+        }
+    # write to a temporary file first so that a failed run
+    #  does not leave a partly written sketch file
+    temp_file_name = sketch_file_name + '.tmp{0}'.format(os.getpid())
+    try:
+        with io.open(temp_file_name, 'wt', encoding='utf_8') as sketch_io:
+            json.dump(sketch_file_dict, sketch_io)
+        os.replace(temp_file_name, sketch_file_name)
+    finally:
+        if (os.path.exists(temp_file_name)):
+            os.remove(temp_file_name)
+
+def find_column_position_list(in_header_row, in_column_name_list):
+    """ Find the position of each column in a header row (None if not found).
+
+        If a name appears more than once in the header row,
+        then the first position is used.
+    """
+    norm_header_row = list(map(normalize_column_name, in_header_row))
+    in_column_position_list = list()
+    for in_column_name in in_column_name_list:
+        in_column_position = None
+        norm_column_name = normalize_column_name(in_column_name)
+        if (norm_column_name in norm_header_row):
+            in_column_position = norm_header_row.index(norm_column_name)
+        in_column_position_list.append(in_column_position)
+    return in_column_position_list
+
+def normalize_column_name(column_name):
+    return column_name.strip().lower()
+
+def compile_distinct_row_key_function(
+    in_source_column_position_list
+    ,should_ignore_case
+    ):
+    """ Make a function which gets the tuple of distinct column values from a row.
+
+        Values which are missing from short rows are None.
+    """
+    def get_distinct_row_key(in_row):
+        in_row_length = len(in_row)
+        distinct_row_key = tuple([
+            in_row[in_source_column_position] if (in_source_column_position < in_row_length) else None
+            for in_source_column_position in in_source_column_position_list
+            ])
+        if (should_ignore_case):
+            distinct_row_key = tuple([
+                cell_value.upper() if (None != cell_value) else None
+                for cell_value in distinct_row_key
+                ])
+        return distinct_row_key
+    return get_distinct_row_key
+
+class DistinctRowAggregator:
+    """ Aggregates (sum, min, max, avg) of columns of the rows with the same distinct values.
+
+        The value of each distinct row is a list: an array of floats (rather than
+        a list of number objects), followed by the cell text of each min and max.
+        The array has the count of rows first, then for each sum its total and
+        the most decimal places of its values, for each avg the same and a count
+        of the values, and for each min or max its number.
+        Sums are rounded to their decimal places when they are written,
+        so the rounding errors of adding fractions as floats are not written.
+    """
+
+    def __init__(self, aggregate_spec_list, in_header_row):
+        """ aggregate_spec_list is a list of (function_name, in_column_name).
+
+            Raises a ValueError if a column is not in the header row.
+        """
+        # (function_name, in_column_name, in_column_position, number_position, text_position)
+        self.aggregate_list = []
+        self.out_column_name_list = []
+        initial_number_list = [0.0]
+        text_count = 0
+        in_column_position_list = find_column_position_list(
+            in_header_row
+            ,[in_column_name for (_, in_column_name) in aggregate_spec_list]
+            )
+        for ((function_name, in_column_name), in_column_position) in zip(
+            aggregate_spec_list
+            ,in_column_position_list
+            ):
+            if (None == in_column_position):
+                raise ValueError("Aggregate column not found: " + in_column_name)
+            text_position = None
+            if ('min' == function_name
+                or 'max' == function_name
+                ):
+                text_count += 1
+                text_position = text_count
+            self.aggregate_list.append((
+                function_name
+                ,in_column_name
+                ,in_column_position
+                ,len(initial_number_list)
+                ,text_position
+                ))
+            self.out_column_name_list.append(function_name + '_' + in_column_name)
+            if ('min' == function_name):
+                initial_number_list.append(float('inf'))
+            elif ('max' == function_name):
+                initial_number_list.append(float('-inf'))
+            elif ('avg' == function_name):
+                # total, decimal places, count
+                initial_number_list.extend([0.0, 0.0, 0.0])
+            else:
+                # total, decimal places
+                initial_number_list.extend([0.0, 0.0])
+        self.initial_numbers = array('d', initial_number_list)
+        self.initial_text_list = [''] * text_count
+        # number of cells of a value in a run file
+        self.number_cell_count = len(initial_number_list)
+        self.value_cell_count = self.number_cell_count + text_count
+
+    def new_value(self):
+        return [array('d', self.initial_numbers)] + self.initial_text_list
+
+    def add_row(self, value, in_row):
+        numbers = value[0]
+        numbers[0] += 1
+        in_row_length = len(in_row)
+        for (function_name, in_column_name, in_column_position, number_position, text_position) in self.aggregate_list:
+            if (in_column_position >= in_row_length):
+                continue
+            cell_value = in_row[in_column_position]
+            if ('' == cell_value):
+                continue
+            try:
+                number = float(cell_value)
+            except ValueError:
+                raise ValueError("Column {0} has a value which is not a number: {1}".format(
+                    in_column_name
+                    ,cell_value
+                    ))
+            if (None != text_position):
+                # (equal numbers keep the least text, so the result does not depend on the row order)
+                if ('' == value[text_position]
+                    or ('min' == function_name and number < numbers[number_position])
+                    or ('max' == function_name and number > numbers[number_position])
+                    or (number == numbers[number_position] and cell_value < value[text_position])
+                    ):
+                    numbers[number_position] = number
+                    value[text_position] = cell_value
+            else:
+                numbers[number_position] += number
+                decimal_place_count = get_decimal_place_count(cell_value)
+                if (decimal_place_count > numbers[number_position + 1]):
+                    numbers[number_position + 1] = decimal_place_count
+                if ('avg' == function_name):
+                    numbers[number_position + 2] += 1
+
+    def merge_value(self, value, other_value):
+        """ Add the rows of other_value to value. """
+        numbers = value[0]
+        other_numbers = other_value[0]
+        numbers[0] += other_numbers[0]
+        for (function_name, _, _, number_position, text_position) in self.aggregate_list:
+            number = other_numbers[number_position]
+            if (None != text_position):
+                if ('' == other_value[text_position]):
+                    continue
+                if ('' == value[text_position]
+                    or ('min' == function_name and number < numbers[number_position])
+                    or ('max' == function_name and number > numbers[number_position])
+                    or (number == numbers[number_position] and other_value[text_position] < value[text_position])
+                    ):
+                    numbers[number_position] = number
+                    value[text_position] = other_value[text_position]
+            else:
+                numbers[number_position] += number
+                numbers[number_position + 1] = max(numbers[number_position + 1], other_numbers[number_position + 1])
+                if ('avg' == function_name):
+                    numbers[number_position + 2] += other_numbers[number_position + 2]
+
+    def get_count(self, value):
+        return int(value[0][0])
+
+    def get_out_cells(self, value):
+        """ Returns the aggregate values to write; empty if there were no numbers. """
+        numbers = value[0]
+        out_cell_list = []
+        for (function_name, _, _, number_position, text_position) in self.aggregate_list:
+            if (None != text_position):
+                out_cell_list.append(value[text_position])
+                continue
+            number = round_aggregate_sum(numbers[number_position], int(numbers[number_position + 1]))
+            if ('avg' == function_name):
+                number_count = numbers[number_position + 2]
+                out_cell_list.append(
+                    format_aggregate_number(number / number_count) if (0 < number_count) else ''
+                    )
+            else:
+                out_cell_list.append(format_aggregate_sum(number, int(numbers[number_position + 1])))
+        return out_cell_list
+
+    def get_run_cells(self, value):
+        # repr() writes the exact float
+        return [repr(number) for number in value[0]] + value[1:]
+
+    def read_run_cells(self, cell_list):
+        number_cell_count = self.number_cell_count
+        return [array('d', map(float, cell_list[:number_cell_count]))] + cell_list[number_cell_count:]
+
+    def get_run_row_key(self, count_row):
+        # rows in run files are the distinct values followed by the value cells
+        return count_row[:-self.value_cell_count]
+
+    def get_distinct_row_overhead(self, distinct_row_key):
+        return (DISTINCT_ROW_OVERHEAD
+            + sys.getsizeof(self.initial_numbers)
+            + sys.getsizeof(self.new_value())
+            + AGGREGATE_TEXT_OVERHEAD * len(self.initial_text_list)
+            )
+
+    def get_top_count_order(self, distinct_count_item):
+        return (-distinct_count_item[1][0][0], distinct_count_item[0])
+
+def parse_aggregate_spec_list(aggregate_spec_list_string):
+    """ Parse 'function:column,...' into a list of (function_name, column_name). """
+    aggregate_spec_list = []
+    for aggregate_spec in aggregate_spec_list_string.split(','):
+        (function_name, _, in_column_name) = aggregate_spec.partition(':')
+        function_name = function_name.strip().lower()
+        if (function_name not in AGGREGATE_FUNCTION_NAME_LIST
+            or 0 == len(in_column_name)
+            ):
+            raise ValueError("Invalid aggregate: " + aggregate_spec)
+        aggregate_spec_list.append((function_name, in_column_name))
+    return aggregate_spec_list
+
+def get_decimal_place_count(cell_value):
+    """ The number of digits after the decimal point of a number as written (e.g. 2 for '12.50'). """
+    if ('e' in cell_value
+        or 'E' in cell_value
+        or cell_value != cell_value.strip()
+        ):
+        try:
+            exponent = decimal.Decimal(cell_value.strip()).as_tuple().exponent
+        except decimal.InvalidOperation:
+            return 0
+        if (isinstance(exponent, int)
+            and 0 > exponent
+            ):
+            return -exponent
+        return 0
+    point_position = cell_value.find('.')
+    if (0 > point_position):
+        return 0
+    return len(cell_value) - point_position - 1
+
+def round_aggregate_sum(number, decimal_place_count):
+    """ Round a sum of numbers with at most decimal_place_count decimal places.
+
+        A float sum of fractions is (slightly) off the exact sum,
+        and the error grows with the count of numbers,
+        but (for sums of less than about 15 significant digits) the exact sum
+        is the sum rounded to the decimal places of the numbers.
+    """
+    if (decimal_place_count > AGGREGATE_DECIMAL_PLACE_COUNT_MAX
+        or not math.isfinite(number)
+        ):
+        return number
+    # (adding 0.0 turns -0.0 into 0.0)
+    return round(number, decimal_place_count) + 0.0
+
+def format_aggregate_sum(number, decimal_place_count):
+    """ Format a sum rounded by round_aggregate_sum(), with no more decimal places than its numbers. """
+    if (decimal_place_count > AGGREGATE_DECIMAL_PLACE_COUNT_MAX
+        or not math.isfinite(number)
+        ):
+        return format_aggregate_number(number)
+    number_text = format(number, '.{0}f'.format(decimal_place_count))
+    if ('.' in number_text):
+        number_text = number_text.rstrip('0').rstrip('.')
+    return number_text
+
+def format_aggregate_number(number):
+    """ Format an aggregate number (an average, or a sum which is not rounded) for output.
+
+        A number without a fraction is written as an integer;
+        other numbers are written with 15 significant digits.
+    """
+    if (None == number):
+        return ''
+    if (number.is_integer()
+        and abs(number) < 2**53
+        ):
+        return str(int(number))
+    return format(number, '.15g')
+
+def get_distinct_row_overhead(distinct_row_key):
+    return DISTINCT_ROW_OVERHEAD
+
+def get_top_count_order(distinct_count_item):
+    # largest count first, then in order of the distinct values
+    return (-distinct_count_item[1], distinct_count_item[0])
+
+def get_run_row_key(count_row):
+    # rows in run files are the distinct values followed by a count
+    return count_row[:-1]
+
+def iter_sorted_count_rows(distinct_row_counters, aggregator=None):
+    """ Yield a row of the distinct values and the count of each key, in key order.
+
+        Missing values (None) are written to run files as empty values.
+        If there is an aggregator, the count is replaced by the cells of its value.
+    """
+    for distinct_row_key in sorted(distinct_row_counters.keys()):
+        count_row = [
+            '' if (None == cell_value) else cell_value
+            for cell_value in distinct_row_key
+            ]
+        if (None == aggregator):
+            count_row.append(distinct_row_counters[distinct_row_key])
+        else:
+            count_row.extend(aggregator.get_run_cells(distinct_row_counters[distinct_row_key]))
+        yield count_row
+
+def iter_sorted_input_counts(in_csv, get_distinct_row_key, aggregator=None):
+    """ Yield (distinct_row, count) for each run of rows with the same distinct values.
+
+        If there is an aggregator, the count is an array of the count and aggregates.
+        Raises a ValueError if the input is not sorted on the distinct values.
+    """
+    in_row_position = 0
+    distinct_row = None
+    distinct_row_count = 0
+    distinct_row_value = None
+    for in_row in in_csv:
+        in_row_position += 1
+        distinct_row_key = get_distinct_row_key(in_row)
+        if (0 < distinct_row_count
+            and distinct_row_key == distinct_row
+            ):
+            distinct_row_count += 1
+            if (None != aggregator):
+                aggregator.add_row(distinct_row_value, in_row)
+        else:
+            if (0 < distinct_row_count):
+                if (distinct_row_key < distinct_row):
+                    raise ValueError(
+                        "Input is not sorted on the source columns: row {0} has values {1} after {2}".format(
+                            in_row_position
+                            ,list(distinct_row_key)
+                            ,list(distinct_row)
+                            ))
+                if (None == aggregator):
+                    yield (distinct_row, distinct_row_count)
+                else:
+                    yield (distinct_row, distinct_row_value)
+            distinct_row = distinct_row_key
+            distinct_row_count = 1
+            if (None != aggregator):
+                distinct_row_value = aggregator.new_value()
+                aggregator.add_row(distinct_row_value, in_row)
+    if (0 < distinct_row_count):
+        if (None == aggregator):
+            yield (distinct_row, distinct_row_count)
+        else:
+            yield (distinct_row, distinct_row_value)
+
+def iter_merged_counts(count_row_iter, aggregator=None):
+    """ Yield (distinct_row, count) from sorted count rows, summing the counts of equal rows.
+
+        If there is an aggregator, the count rows have the cells of its values,
+        which are merged.
+    """
+    if (None != aggregator):
+        for merged_item in iter_merged_aggregates(count_row_iter, aggregator):
+            yield merged_item
+        return
+    distinct_row = None
+    distinct_row_count = 0
+    for count_row in count_row_iter:
+        count_row_key = count_row[:-1]
+        if (None != distinct_row
+            and count_row_key == distinct_row
+            ):
+            distinct_row_count += int(count_row[-1])
+        else:
+            if (None != distinct_row):
+                yield (distinct_row, distinct_row_count)
+            distinct_row = count_row_key
+            distinct_row_count = int(count_row[-1])
+    if (None != distinct_row):
+        yield (distinct_row, distinct_row_count)
+
+def iter_merged_aggregates(count_row_iter, aggregator):
+    value_cell_count = aggregator.value_cell_count
+    distinct_row = None
+    distinct_row_value = None
+    for count_row in count_row_iter:
+        count_row_key = count_row[:-value_cell_count]
+        count_row_value = aggregator.read_run_cells(count_row[-value_cell_count:])
+        if (None != distinct_row
+            and count_row_key == distinct_row
+            ):
+            aggregator.merge_value(distinct_row_value, count_row_value)
+        else:
+            if (None != distinct_row):
+                yield (distinct_row, distinct_row_value)
+            distinct_row = count_row_key
+            distinct_row_value = count_row_value
+    if (None != distinct_row):
+        yield (distinct_row, distinct_row_value)
 
 def console_main():
     main(sys.argv, sys.stdin, sys.stdout, sys.stderr)
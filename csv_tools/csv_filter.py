@@ -5,13 +5,16 @@
 ## python 2 does not work due mostly to issues with csv and io modules with unicode data
 
 help_text = (
-    "CSV-FILTER tool version 20170330:20201220\n"
+    "CSV-FILTER tool version 20170330:20261018\n"
     "Selects rows from a CSV file\n"
     "\n"
     "csv-filter [OPTIONS] FilterArguments... [InputFile]\n"
     "\n"
     "OPTIONS\n"
     "    -o {F}  Output file name\n"
+    "    --sorted-keys  Keep the keys of 'in @File' filters in a sorted array\n"
+    "    --bloom-filter {P}  Keep the keys of 'in @File' filters in a Bloom filter\n"
+    "                        with a false positive rate P (e.g. 0.01)\n"
     "\n"
     "The FilterArguments indicates which rows will be selected.\n"
     "\n"
@@ -24,22 +27,119 @@ help_text = (
     "Valid operators ({OP}) are: '=', '!=', 'is', 'isnt'.\n"
     "'is'/'isnt' and '='/'!=' behave similarly, but 'is' will recognize \n"
     "a value of 'NULL' as a NULL value (and not the character string 'NULL').\n"
+    "A value of '' (two single quotes) is an empty value.\n"
+    "\n"
+    "The numeric operators '<', '<=', '>', '>=' compare the cell values as numbers;\n"
+    "cells which are not numbers are not selected.\n"
+    "The operators 'prefix', 'suffix' and 'contains' compare parts of the cell values,\n"
+    "and 'matches' selects cell values in which a regular expression is found.\n"
+    "The operators 'in' and 'notin' compare the cell values to a list of values\n"
+    "in parentheses, separated by whitespace or commas, e.g. STATE in ( CA WA ).\n"
+    "\n"
+    "The values of 'in' and 'notin' may also be read from a CSV file\n"
+    "with the form {ColumnName} in @{File}.  The values are read from the column\n"
+    "of File with the same name as ColumnName, or from its first column.\n"
+    "Only these values are kept in memory (in a set).  For very large files,\n"
+    "--sorted-keys keeps them in a sorted array instead, which uses less\n"
+    "memory but makes each lookup slower.  --bloom-filter uses even less memory,\n"
+    "but a few rows whose values are not in File may be treated as if they were\n"
+    "(so 'in' may select them and 'notin' may leave them out).\n"
+    "\n"
+    "Filters may be combined with AND, OR, NOT and parentheses\n"
+    "(AND is evaluated before OR).  The combined expression is compiled\n"
+    "into one python function before the rows are read.\n"
+    "When every selected row must contain a value of the expression\n"
+    "(e.g. for '=', 'prefix' or 'contains'), rows whose text does not contain it\n"
+    "are skipped before they are parsed.  Rows which contain a quote character\n"
+    "are always parsed.\n"
     "\n"
     "For example:\n"
     "\n"
     "    csv-filter COMPOUND = CHLORPYRIFOS  EPest.csv\n"
+    "    csv-filter COMPOUND prefix CHLOR AND ( YEAR >= 2010 OR STATE in '(CA,WA)' ) EPest.csv\n"
+    "    csv-filter SITE_ID in @sites.csv EPest.csv\n"
+    "\n"
+    "(Parentheses and operators such as '<' must be quoted or escaped in most shells.)\n"
     "\n"
 )
 
 import sys
 import csv
 import io
+import os
+import re
+from itertools import (
+    chain
+    ,islice
+    )
 
 from ._csv_helpers import (
     decode_delimiter_name
     ,decode_charset_name
     ,decode_newline
     )
+from .base.bloom import (
+    BloomFilter
+    )
+from .base.runfile import (
+    ROW_SAMPLE_COUNT
+    )
+from .base.sortedkeys import (
+    SortedKeyArray
+    )
+
+# Operators of a filter comparison: {Column} {OP} {Value}
+FILTER_OP_EQ = '='
+FILTER_OP_NOT_EQ = '!='
+FILTER_OP_IS = 'is'
+FILTER_OP_IS_NOT = 'isnt'
+FILTER_OP_LT = '<'
+FILTER_OP_LE = '<='
+FILTER_OP_GT = '>'
+FILTER_OP_GE = '>='
+FILTER_OP_PREFIX = 'prefix'
+FILTER_OP_SUFFIX = 'suffix'
+FILTER_OP_CONTAINS = 'contains'
+FILTER_OP_MATCHES = 'matches'
+FILTER_OP_IN = 'in'
+FILTER_OP_NOT_IN = 'notin'
+FILTER_OP_LIST = [
+    FILTER_OP_EQ
+    ,FILTER_OP_NOT_EQ
+    ,FILTER_OP_IS
+    ,FILTER_OP_IS_NOT
+    ,FILTER_OP_LT
+    ,FILTER_OP_LE
+    ,FILTER_OP_GT
+    ,FILTER_OP_GE
+    ,FILTER_OP_PREFIX
+    ,FILTER_OP_SUFFIX
+    ,FILTER_OP_CONTAINS
+    ,FILTER_OP_MATCHES
+    ,FILTER_OP_IN
+    ,FILTER_OP_NOT_IN
+    ]
+FILTER_NUMBER_OP_SET = frozenset([FILTER_OP_LT, FILTER_OP_LE, FILTER_OP_GT, FILTER_OP_GE])
+FILTER_SET_OP_SET = frozenset([FILTER_OP_IN, FILTER_OP_NOT_IN])
+# operators which only select cells that contain the (non-empty) filter value
+PREFILTER_OP_SET = frozenset([
+    FILTER_OP_EQ
+    ,FILTER_OP_IS
+    ,FILTER_OP_PREFIX
+    ,FILTER_OP_SUFFIX
+    ,FILTER_OP_CONTAINS
+    ])
+# the prefix of a file name which has the values of an 'in' or 'notin' filter
+FILTER_KEY_FILE_PREFIX = '@'
+# records are only prefiltered for a few texts; beyond that, searching each line costs more than parsing it
+PREFILTER_TEXT_COUNT_MAX = 16
+
+# Keywords which combine filters
+FILTER_AND = 'and'
+FILTER_OR = 'or'
+FILTER_NOT = 'not'
+# the tag of a comparison in a filter expression tree
+FILTER_COMPARE = 'compare'
 
 def main(arg_list, stdin, stdout, stderr):
     DEFAULT_BUFFERING = -1
@@ -62,6 +162,10 @@ def main(arg_list, stdin, stdout, stderr):
     csv_cell_width_limit = 4*1024*1024  # python default is 131072 = 0x00020000
     output_buffering = DEFAULT_BUFFERING
     filter_arg_list = list()
+    should_sort_keys = False
+    bloom_filter_error_rate = None
+    err_msg = None
+    exit_code = 0
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -151,6 +255,22 @@ def main(arg_list, stdin, stdout, stderr):
                 arg_index += 1
                 arg = arg_list[arg_index]
                 output_row_terminator = arg
+        elif (arg == "--sorted-keys"
+        ):
+            should_sort_keys = True
+        elif (arg == "--bloom-filter"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    bloom_filter_error_rate = float(arg)
+                except ValueError:
+                    bloom_filter_error_rate = None
+                if (None == bloom_filter_error_rate
+                    or not (0.0 < bloom_filter_error_rate < 1.0)
+                ):
+                    err_msg = "Bloom filter false positive rate must be between 0 and 1: " + arg
         elif (arg == "--cell-width-limit"
         ):
             if (arg_index < arg_count):
@@ -160,16 +280,35 @@ def main(arg_list, stdin, stdout, stderr):
         elif (None != arg
           and 0 < len(arg)
         ):
-            # [20170330 [db] This is sort of a hack to "parse" the filter expression
-            #  based on the fact that we only currently support a Name=Value expression
-            #  (which consists of 3 distinct tokens/arguments)]
-            if (3 > len(filter_arg_list)):
-                filter_arg_list.append(arg)
-            elif (None == input_file_name):
-                input_file_name = arg
+            # the filter expression is parsed below;
+            #  the argument after the expression is the input file name
+            filter_arg_list.append(arg)
         arg_index += 1
 
-    if (show_help):
+    if (should_sort_keys
+        and None != bloom_filter_error_rate
+    ):
+        err_msg = "--sorted-keys and --bloom-filter cannot be used together"
+
+    filter_expression = None
+    if (0 == len(filter_arg_list)):
+        show_help = True
+    else:
+        try:
+            (filter_expression, extra_arg_list) = parse_filter_expression(filter_arg_list)
+            if (1 == len(extra_arg_list)):
+                input_file_name = extra_arg_list[0]
+            elif (1 < len(extra_arg_list)):
+                raise ValueError("Unexpected filter argument: " + extra_arg_list[0])
+        except ValueError as exc:
+            if (None == err_msg):
+                err_msg = str(exc)
+
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
         input_charset_name = decode_charset_name(input_charset_name)
@@ -220,13 +359,27 @@ def main(arg_list, stdin, stdout, stderr):
             if (out_close_file):
                 out_file = out_io
 
+            filter_expression = load_filter_key_files(
+                filter_expression
+                ,input_charset_name
+                ,in_newline_mode
+                ,input_charset_error_mode
+                ,input_delimiter
+                ,input_row_terminator
+                ,should_sort_keys
+                ,bloom_filter_error_rate
+                )
+
             in_csv = csv.reader(in_io, delimiter=input_delimiter, lineterminator=input_row_terminator)
             out_csv = csv.writer(out_io, delimiter=output_delimiter, lineterminator=output_row_terminator)
             execute(
                  in_csv
                 ,out_csv
-                ,filter_arg_list
+                ,filter_expression
+                ,in_io=in_io
                 )
+        except ValueError as exc:
+            err_msg = str(exc)
         except BrokenPipeError:
             pass
         finally:
@@ -234,26 +387,129 @@ def main(arg_list, stdin, stdout, stderr):
                 in_file.close()
             if (None != out_file):
                 out_file.close()
+        if (None != err_msg):
+            err_io.write(err_msg)
+            err_io.write("\n")
+            exit_code = 1
+    return exit_code
 
 def execute(
     in_csv
     ,out_csv
-    ,filter_arg_list
+    ,filter_expression
+    ,in_io=None
 ):
+    """ Write the rows which are selected by a filter expression (see parse_filter_expression()).
+
+        in_io is the text stream read by in_csv; when it is given,
+        records whose raw text cannot match the expression are skipped without being parsed.
+    """
     end_row = None
     row_is_selected = None
     header_row = next(in_csv, end_row)
     if (None != header_row):
         row_is_selected = compile_filter_expression(
-            filter_arg_list
+            filter_expression
             ,header_row
             )
     if (None != row_is_selected):
         out_csv.writerow(header_row)
+        in_dialect = in_csv.dialect
+        prefilter_text_list = None
+        if (None != in_io
+            and None == in_dialect.escapechar
+            and None != in_dialect.quotechar
+        ):
+            prefilter_text_list = get_filter_text_list(filter_expression)
+        if (None != prefilter_text_list
+            and len(prefilter_text_list) <= PREFILTER_TEXT_COUNT_MAX
+        ):
+            # the rows after the header are read again, without the records which cannot match
+            in_csv = iter_prefiltered_rows(in_io, in_dialect, prefilter_text_list)
         for in_row in in_csv:
             if (row_is_selected(in_row)):
                 out_csv.writerow(in_row)
 
+def get_filter_text_list(filter_expression):
+    """ Find texts which the raw text of a record must contain for a filter expression to select it.
+
+        Returns a list of texts (a selected record contains at least one of them),
+        or None if the expression can select records which contain none of them.
+        (Records with a quote character are always read, see iter_prefiltered_rows(),
+        so only cells of records without quote characters are compared to their raw text.)
+    """
+    if (FILTER_AND == filter_expression[0]):
+        left_text_list = get_filter_text_list(filter_expression[1])
+        right_text_list = get_filter_text_list(filter_expression[2])
+        if (None == left_text_list):
+            return right_text_list
+        if (None == right_text_list
+            or len(left_text_list) <= len(right_text_list)
+        ):
+            return left_text_list
+        return right_text_list
+    if (FILTER_OR == filter_expression[0]):
+        left_text_list = get_filter_text_list(filter_expression[1])
+        right_text_list = get_filter_text_list(filter_expression[2])
+        if (None == left_text_list
+            or None == right_text_list
+        ):
+            return None
+        return left_text_list + right_text_list
+    if (FILTER_NOT == filter_expression[0]):
+        return None
+
+    (_, _, f_op, f_column_value) = filter_expression
+    if (f_op in PREFILTER_OP_SET):
+        f_column_value_list = [f_column_value]
+    elif (FILTER_OP_IN == f_op
+        and isinstance(f_column_value, frozenset)
+        and len(f_column_value) <= PREFILTER_TEXT_COUNT_MAX
+    ):
+        f_column_value_list = sorted(f_column_value)
+    else:
+        return None
+    for text in f_column_value_list:
+        if (None == text
+            or 0 == len(text)
+        ):
+            return None
+    return f_column_value_list
+
+def iter_prefiltered_rows(in_io, in_dialect, text_list):
+    """ Yields the rows read from in_io, except rows which cannot contain one of the texts.
+
+        Only a line which starts a record and has no quote character is skipped,
+        since such a line is a whole record whose cells are its raw text.
+        Every other line is handed to the reader, which decides where its record ends
+        (so stray quote characters in unquoted cells are read as they would be without the prefilter).
+    """
+    quotechar = in_dialect.quotechar
+    text = None
+    text_search = None
+    if (1 == len(text_list)):
+        text = text_list[0]
+    else:
+        text_search = re.compile('|'.join(map(re.escape, text_list))).search
+    is_record_start = True
+    def iter_candidate_lines():
+        nonlocal is_record_start
+        for line in in_io:
+            if (is_record_start
+                and quotechar not in line
+                and not (text in line
+                    if None != text
+                    else None != text_search(line)
+                    )
+            ):
+                continue
+            is_record_start = False
+            yield line
+    in_csv = csv.reader(iter_candidate_lines(), dialect=in_dialect)
+    for in_row in in_csv:
+        yield in_row
+        # the reader has read the whole record, so the next line starts a record
+        is_record_start = True
 
 def normalize_column_name(in_column_name):
     out_column_name = in_column_name
@@ -262,82 +518,361 @@ def normalize_column_name(in_column_name):
         out_column_name = out_column_name.lower()
     return out_column_name
 
-def coalesce_cell_value(in_cell_value, default_cell_value):
-    out_cell_value = in_cell_value
-    if (None == out_cell_value):
-        out_cell_value = default_cell_value
-    elif (0 == len(out_cell_value)):
-        out_cell_value = default_cell_value
-    return out_cell_value
+def parse_filter_expression(filter_arg_list):
+    """ Parse filter arguments into an expression tree.
+
+        The tree is made of tuples:
+            (FILTER_OR, left, right), (FILTER_AND, left, right), (FILTER_NOT, operand)
+            and comparisons (FILTER_COMPARE, column_name, op, value).
+        Returns (filter_expression, extra_arg_list),
+        where extra_arg_list has the arguments after the expression.
+        Raises a ValueError if the arguments are not an expression.
+    """
+    (filter_expression, arg_position) = parse_filter_or(filter_arg_list, 0)
+    return (filter_expression, filter_arg_list[arg_position:])
+
+def is_filter_keyword(filter_arg_list, arg_position, keyword):
+    return (arg_position < len(filter_arg_list)
+        and keyword == filter_arg_list[arg_position].lower()
+        )
+
+def parse_filter_or(filter_arg_list, arg_position):
+    (filter_expression, arg_position) = parse_filter_and(filter_arg_list, arg_position)
+    while (is_filter_keyword(filter_arg_list, arg_position, FILTER_OR)):
+        (right_expression, arg_position) = parse_filter_and(filter_arg_list, arg_position + 1)
+        filter_expression = (FILTER_OR, filter_expression, right_expression)
+    return (filter_expression, arg_position)
+
+def parse_filter_and(filter_arg_list, arg_position):
+    (filter_expression, arg_position) = parse_filter_not(filter_arg_list, arg_position)
+    while (is_filter_keyword(filter_arg_list, arg_position, FILTER_AND)):
+        (right_expression, arg_position) = parse_filter_not(filter_arg_list, arg_position + 1)
+        filter_expression = (FILTER_AND, filter_expression, right_expression)
+    return (filter_expression, arg_position)
+
+def parse_filter_not(filter_arg_list, arg_position):
+    if (is_filter_keyword(filter_arg_list, arg_position, FILTER_NOT)):
+        (filter_expression, arg_position) = parse_filter_not(filter_arg_list, arg_position + 1)
+        return ((FILTER_NOT, filter_expression), arg_position)
+    if (is_filter_keyword(filter_arg_list, arg_position, '(')):
+        (filter_expression, arg_position) = parse_filter_or(filter_arg_list, arg_position + 1)
+        if (not is_filter_keyword(filter_arg_list, arg_position, ')')):
+            raise ValueError("Missing ')' in filter expression")
+        return (filter_expression, arg_position + 1)
+    return parse_filter_comparison(filter_arg_list, arg_position)
+
+def parse_filter_comparison(filter_arg_list, arg_position):
+    if (arg_position + 3 > len(filter_arg_list)):
+        raise ValueError("Incomplete filter: " + ' '.join(filter_arg_list[arg_position:]))
+    f_column_name = filter_arg_list[arg_position]
+    f_op = filter_arg_list[arg_position + 1].strip().lower()
+    arg_position += 2
+    if (f_op not in FILTER_OP_LIST):
+        raise ValueError("Invalid filter operator: " + filter_arg_list[arg_position - 1])
+
+    if (f_op in FILTER_SET_OP_SET
+        and filter_arg_list[arg_position].startswith(FILTER_KEY_FILE_PREFIX)
+    ):
+        # the values are read from a file when the input is opened (see load_filter_key_files())
+        f_column_value = FilterKeyFile(filter_arg_list[arg_position][len(FILTER_KEY_FILE_PREFIX):])
+        if (0 == len(f_column_value.file_name)):
+            raise ValueError("Missing file name after " + FILTER_KEY_FILE_PREFIX)
+        arg_position += 1
+    elif (f_op in FILTER_SET_OP_SET):
+        # a list of values in parentheses, which may be separate arguments
+        if (not filter_arg_list[arg_position].startswith('(')):
+            raise ValueError("Missing '(' after " + f_op)
+        value_arg_list = []
+        is_list_complete = False
+        while (not is_list_complete
+            and arg_position < len(filter_arg_list)
+            ):
+            value_arg = filter_arg_list[arg_position]
+            if (0 == len(value_arg_list)):
+                value_arg = value_arg[1:]
+            if (value_arg.endswith(')')):
+                value_arg = value_arg[:-1]
+                is_list_complete = True
+            value_arg_list.append(value_arg)
+            arg_position += 1
+        if (not is_list_complete):
+            raise ValueError("Missing ')' after " + f_op)
+        f_column_value = frozenset([
+            decode_filter_value(value.strip(), f_op)
+            for value_arg in value_arg_list
+            for value in value_arg.split(',')
+            if (0 < len(value.strip()))
+            ])
+    else:
+        f_column_value = decode_filter_value(filter_arg_list[arg_position], f_op)
+        arg_position += 1
+        if (f_op in FILTER_NUMBER_OP_SET):
+            try:
+                f_column_value = float(f_column_value)
+            except ValueError:
+                raise ValueError("Filter value is not a number: " + f_column_value)
+        elif (FILTER_OP_MATCHES == f_op):
+            try:
+                f_column_value = re.compile(f_column_value)
+            except re.error as exc:
+                raise ValueError("Invalid regular expression {0}: {1}".format(f_column_value, exc))
+    return ((FILTER_COMPARE, f_column_name, f_op, f_column_value), arg_position)
+
+def decode_filter_value(f_column_value, f_op):
+    if ("''" == f_column_value):
+        f_column_value = ''
+    elif (f_op in {FILTER_OP_IS, FILTER_OP_IS_NOT}
+        and "NULL" == f_column_value
+    ):
+        f_column_value = None
+    return f_column_value
+
+class FilterKeyFile:
+    """ The file of values of an 'in @File' (or 'notin @File') filter, before it is read. """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+def load_filter_key_files(
+    filter_expression
+    ,input_charset_name
+    ,in_newline_mode
+    ,input_charset_error_mode
+    ,input_delimiter
+    ,input_row_terminator
+    ,should_sort_keys=False
+    ,bloom_filter_error_rate=None
+):
+    """ Returns a copy of a filter expression in which each FilterKeyFile is replaced by its set of keys. """
+    if (FILTER_AND == filter_expression[0]
+        or FILTER_OR == filter_expression[0]
+    ):
+        return (
+            filter_expression[0]
+            ,load_filter_key_files(
+                filter_expression[1]
+                ,input_charset_name
+                ,in_newline_mode
+                ,input_charset_error_mode
+                ,input_delimiter
+                ,input_row_terminator
+                ,should_sort_keys
+                ,bloom_filter_error_rate
+                )
+            ,load_filter_key_files(
+                filter_expression[2]
+                ,input_charset_name
+                ,in_newline_mode
+                ,input_charset_error_mode
+                ,input_delimiter
+                ,input_row_terminator
+                ,should_sort_keys
+                ,bloom_filter_error_rate
+                )
+            )
+    if (FILTER_NOT == filter_expression[0]):
+        return (
+            filter_expression[0]
+            ,load_filter_key_files(
+                filter_expression[1]
+                ,input_charset_name
+                ,in_newline_mode
+                ,input_charset_error_mode
+                ,input_delimiter
+                ,input_row_terminator
+                ,should_sort_keys
+                ,bloom_filter_error_rate
+                )
+            )
+    (_, f_column_name, f_op, f_column_value) = filter_expression
+    if (not isinstance(f_column_value, FilterKeyFile)):
+        return filter_expression
+    try:
+        key_file = io.open(
+             f_column_value.file_name
+            ,mode='rt'
+            ,encoding=input_charset_name
+            ,newline=in_newline_mode
+            ,errors=input_charset_error_mode
+            )
+    except OSError as exc:
+        raise ValueError("Cannot read key file {0}: {1}".format(f_column_value.file_name, exc.strerror))
+    try:
+        key_csv = csv.reader(key_file, delimiter=input_delimiter, lineterminator=input_row_terminator)
+        key_set = read_filter_key_set(
+            key_file
+            ,key_csv
+            ,f_column_name
+            ,should_sort_keys
+            ,bloom_filter_error_rate
+            )
+    finally:
+        key_file.close()
+    return (FILTER_COMPARE, f_column_name, f_op, key_set)
+
+def read_filter_key_set(
+    key_file
+    ,key_csv
+    ,column_name
+    ,should_sort_keys=False
+    ,bloom_filter_error_rate=None
+):
+    """ Read the keys of a key file from its column named column_name (or its first column).
+
+        Returns a frozenset, a SortedKeyArray or a BloomFilter of the keys.
+    """
+    key_column_position = 0
+    header_row = next(key_csv, None)
+    if (None != header_row):
+        column_name = normalize_column_name(column_name)
+        column_position = 0
+        while (column_position < len(header_row)):
+            if (column_name == normalize_column_name(header_row[column_position])):
+                key_column_position = column_position
+            column_position += 1
+    key_set = None
+    if (None != bloom_filter_error_rate):
+        # the sample of rows sizes the filter
+        key_row_sample = list(islice(key_csv, ROW_SAMPLE_COUNT))
+        key_set = BloomFilter(
+            estimate_key_count(key_file, key_row_sample)
+            ,bloom_filter_error_rate
+            )
+        key_csv = chain(key_row_sample, key_csv)
+    key_iter = (
+        key_row[key_column_position]
+        for key_row in key_csv
+        if (key_column_position < len(key_row))
+        )
+    if (None != key_set):
+        for key in key_iter:
+            key_set.add(key)
+    elif (should_sort_keys):
+        key_set = SortedKeyArray(key_iter)
+    else:
+        key_set = frozenset(key_iter)
+    return key_set
+
+def estimate_key_count(key_file, key_row_sample):
+    """ Estimate the number of rows in a key file from its size and the sample rows. """
+    key_count = len(key_row_sample)
+    if (ROW_SAMPLE_COUNT > key_count):
+        # the sample is all of the file
+        return key_count
+    key_row_text_size = 0
+    for key_row in key_row_sample:
+        key_row_text_size += len(key_row) + sum(map(len, key_row))
+    try:
+        key_file_size = os.fstat(key_file.fileno()).st_size
+    except (OSError, ValueError):
+        key_file_size = 0
+    if (0 == key_file_size
+        or 0 == key_row_text_size
+    ):
+        return BLOOM_FILTER_CAPACITY_DEFAULT
+    return max(key_count, key_file_size * key_count // key_row_text_size)
+
+BLOOM_FILTER_CAPACITY_DEFAULT = 10*1000*1000
+
+def to_filter_number(cell_value):
+    """ Convert a cell value to a number; a value which is not a number is NaN (which never compares true). """
+    try:
+        return float(cell_value)
+    except (TypeError, ValueError):
+        return FILTER_NAN
+
+FILTER_NAN = float('nan')
 
 def compile_filter_expression(
-    filter_arg_list
+    filter_expression
     ,header_row
 ):
-    f_op_eq = '='
-    f_op_not_eq = '!='
-    f_op_is = 'is'
-    f_op_is_not = 'isnt'
+    """ Compile a filter expression into a function of a row which returns True if it is selected.
 
-    column_name_list = list()
+        The expression is translated to python code which refers to cells
+        by their position, and compiled once.
+        Returns None if a column of the expression is not in the header row.
+    """
     column_position_lookup = dict()
     if (None != header_row):
         column_position = 0
         while (column_position < len(header_row)):
             column_name = header_row[column_position]
             column_name = normalize_column_name(column_name)
-            column_name_list.append(column_name)
             column_position_lookup[column_name] = column_position
             column_position += 1
 
-    f_column_name = None
-    f_op = None
-    f_column_value = None
-    if 0 < len(filter_arg_list):
-        f_column_name = filter_arg_list[0]
-        f_column_name = normalize_column_name(f_column_name)
-    if 1 < len(filter_arg_list):
-        f_op = filter_arg_list[1]
-        f_op = f_op.strip()
-        f_op = f_op.lower()
-    if 2 < len(filter_arg_list):
-        f_column_value = filter_arg_list[2]
-    
-    if (None != f_column_value):
-        if ("''" == f_column_value):
-            f_column_value = ''
-        elif (f_op in  {f_op_is,f_op_is_not}
-            and "NULL" == f_column_value
-        ):
-            f_column_value = None
-
-    f_value_predicate = None
-    if (f_op_eq == f_op):
-        f_value_predicate = lambda cell_value : (cell_value == f_column_value)
-    elif (f_op_not_eq == f_op):
-        f_value_predicate = lambda cell_value : (cell_value != f_column_value)
-    elif (f_op_is == f_op):
-        f_value_predicate = lambda cell_value : (f_column_value == coalesce_cell_value(cell_value, None))
-    elif (f_op_is_not == f_op):
-        f_value_predicate = lambda cell_value : (f_column_value != coalesce_cell_value(cell_value, None))
-
-    f_column_position = column_position_lookup.get(f_column_name, None)
-
-    def row_is_selected(in_row):
-        cell_value = None
-        if (f_column_position < len(in_row)):
-            cell_value = in_row[f_column_position]
-        return f_value_predicate(cell_value)
-
-    f_row_predicate = None
-    if (None != f_column_position
-        and None != f_value_predicate
-    ):
-        f_row_predicate = row_is_selected
-    
-    return f_row_predicate
+    # values used by the code are in its namespace, as v1, v2, ...
+    code_namespace = {
+        'to_filter_number': to_filter_number,
+        }
+    column_position_list = []
+    missing_column_name_list = []
+    def translate_filter_expression(filter_expression):
+        if (FILTER_OR == filter_expression[0]
+            or FILTER_AND == filter_expression[0]
+            ):
+            # a chain of the same operator is one python expression (not nested parentheses)
+            operand_list = []
+            pending_operand_list = [filter_expression]
+            while (0 < len(pending_operand_list)):
+                operand = pending_operand_list.pop()
+                if (operand[0] == filter_expression[0]):
+                    pending_operand_list.append(operand[2])
+                    pending_operand_list.append(operand[1])
+                else:
+                    operand_list.append(translate_filter_expression(operand))
+            return "({0})".format(
+                (" " + filter_expression[0] + " ").join(operand_list)
+                )
+        if (FILTER_NOT == filter_expression[0]):
+            return "(not {0})".format(translate_filter_expression(filter_expression[1]))
+        (_, f_column_name, f_op, f_column_value) = filter_expression
+        f_column_position = column_position_lookup.get(normalize_column_name(f_column_name))
+        if (None == f_column_position):
+            missing_column_name_list.append(f_column_name)
+            return "False"
+        column_position_list.append(f_column_position)
+        cell_code = "row[{0}]".format(f_column_position)
+        value_code = "v{0}".format(len(code_namespace))
+        code_namespace[value_code] = f_column_value
+        if (FILTER_OP_EQ == f_op):
+            return "({0} == {1})".format(cell_code, value_code)
+        if (FILTER_OP_NOT_EQ == f_op):
+            return "({0} != {1})".format(cell_code, value_code)
+        if (FILTER_OP_IS == f_op):
+            # an empty cell value is NULL
+            return "({1} == ({0} or None))".format(cell_code, value_code)
+        if (FILTER_OP_IS_NOT == f_op):
+            return "({1} != ({0} or None))".format(cell_code, value_code)
+        if (f_op in FILTER_NUMBER_OP_SET):
+            return "(to_filter_number({0}) {1} {2})".format(cell_code, f_op, value_code)
+        if (FILTER_OP_PREFIX == f_op):
+            return "(None != {0} and {0}.startswith({1}))".format(cell_code, value_code)
+        if (FILTER_OP_SUFFIX == f_op):
+            return "(None != {0} and {0}.endswith({1}))".format(cell_code, value_code)
+        if (FILTER_OP_CONTAINS == f_op):
+            return "(None != {0} and {1} in {0})".format(cell_code, value_code)
+        if (FILTER_OP_MATCHES == f_op):
+            return "(None != {0} and None != {1}.search({0}))".format(cell_code, value_code)
+        if (FILTER_OP_IN == f_op):
+            return "({0} in {1})".format(cell_code, value_code)
+        return "({0} not in {1})".format(cell_code, value_code)
 
+    expression_code = translate_filter_expression(filter_expression)
+    if (0 < len(missing_column_name_list)):
+        return None
 
+    # short rows are padded, so that a missing cell value is None
+    column_count = max(column_position_list) + 1
+    function_code = (
+        "def row_is_selected(row):\n"
+        "    if (len(row) < {0}):\n"
+        "        row = row + [None] * ({0} - len(row))\n"
+        "    return {1}\n"
+        ).format(column_count, expression_code)
+    exec(compile(function_code, "<csv-filter>", "exec"), code_namespace)
+    return code_namespace['row_is_selected']
 
 def console_main():
     main(sys.argv, sys.stdin, sys.stdout, sys.stderr)
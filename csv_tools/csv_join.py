@@ -10,12 +10,22 @@ help_text = (
     "CSV-JOIN tool version 20170524\n"
     "Joins two CSV files on common column values\n"
     "\n"
-    "csv-join [OPTIONS] {INNER|OUTER} File2 Columns2 '=' Columns1 [File1]\n"
+    "csv-join [OPTIONS] {INNER|OUTER|SEMI|ANTI} File2 Columns2 '=' Columns1 [File1]\n"
     "\n"
     "OPTIONS\n"
     "    -o {F}  Output file name\n"
     "    --column-prefix {S}  Prefix for column names from File2\n"
     "    --include-join-keys  Include columns from Column2 in the output\n"
+    "    -T {D}  Directory for temporary files (default=system temp directory)\n"
+    "    --memory-limit {M}  Approximate memory to use for File2 (e.g. 512M, 2G)\n"
+    "    --output-order {O}  Output row order if File2 exceeds the memory limit:\n"
+    "                        INPUT (File1 order, default) or PARTITION\n"
+    "    --index-file {F}  Index file of File2 row positions (created if needed)\n"
+    "    --sorted  Both files are sorted on the join columns; use a merge join\n"
+    "    --jobs {N}  Number of worker processes used to join File1 rows (default=1)\n"
+    "    --bloom-filter {P}  Use a Bloom filter of File2 keys with a false positive rate P\n"
+    "                        (e.g. 0.01) to skip File1 rows if File2 is partitioned\n"
+    "    --approximate  For SEMI and ANTI joins, keep only a Bloom filter of File2 keys\n"
     "\n"
     "Joins rows from File1 (or STDIN) to rows in File2 by matching column values\n"
     "for equality.  \n"
@@ -23,6 +33,7 @@ help_text = (
     "Columns1 and Columns2 are comma-separated lists of column names.\n"
     "\n"
     "File2 will be read entirely into memory and rows will be indexed.\n"
+    "Only the File2 columns which are written to the output are kept in memory.\n"
     "When a row is read from File1, corresponding rows from File2 will be\n"
     "looked-up and appended to the row from File1.\n"
     "If the INNER option is used, and if no corresponding rows are found in File2\n"
@@ -30,10 +41,48 @@ help_text = (
     "If the OUTER option is used, and if no corresponding rows are found in File2\n"
     "then the row will be written to the output with an empty value for each column\n"
     "that would come from File2.\n"
+    "If the SEMI option is used, then each row from File1 which has corresponding\n"
+    "rows in File2 is written once, without any columns from File2.\n"
+    "If the ANTI option is used, then each row from File1 which has no\n"
+    "corresponding rows in File2 is written, without any columns from File2.\n"
+    "SEMI and ANTI joins only keep the set of File2 join keys in memory.\n"
     "\n"
     "By default, the join key columns from File2 will not be written to the output\n"
     "since they are redundant.\n"
     "\n"
+    "If File2 does not fit within the --memory-limit, then both files are\n"
+    "split into partition files by a hash of the join columns, and each\n"
+    "partition of File2 is joined in memory to the same partition of File1.\n"
+    "With --output-order PARTITION, joined rows are written as each partition\n"
+    "is joined, otherwise they are sorted back into the order of File1.\n"
+    "With --bloom-filter, File1 rows whose keys are not in File2 are\n"
+    "recognized by the filter and are not written to partition files.\n"
+    "\n"
+    "For SEMI and ANTI joins of very large key sets, the --approximate option\n"
+    "replaces the set of File2 keys with a Bloom filter (which uses about\n"
+    "10 bits per key for a 1% false positive rate, the default).  A few File1\n"
+    "rows without a match may then be treated as matched, so a SEMI join may\n"
+    "write them and an ANTI join may leave them out.\n"
+    "\n"
+    "If the --index-file option is used, the positions of the File2 rows for\n"
+    "each join key are saved in an index file, which is reused by later joins\n"
+    "as long as File2 (and the join columns) do not change.\n"
+    "Only the index is held in memory, matching rows are read from File2.\n"
+    "The File2 encoding must be ASCII-compatible (e.g. UTF-8),\n"
+    "with LF or CR-LF line endings.\n"
+    "\n"
+    "If the --sorted option is used, File1 and File2 are read together\n"
+    "and only the File2 rows with the current join key are held in memory.\n"
+    "Both files must be sorted on the join columns as text\n"
+    "(e.g. by csv-sort without key options);\n"
+    "the join stops with an error if rows are found out of order.\n"
+    "\n"
+    "If --jobs is more than 1 (or ALL for one job per CPU), File1 is split into\n"
+    "blocks of rows which are joined by worker processes; the workers share\n"
+    "the File2 index which is built in memory, and the output is written\n"
+    "in the order of File1.  This applies when File2 fits in memory and\n"
+    "neither --sorted nor --index-file is used.\n"
+    "\n"
     "Example:\n"
     "    csv-join INNER oil_wells.csv state,well_id = state,site_id  production.csv\n"
     "\n"
@@ -42,12 +91,64 @@ help_text = (
 import sys
 import csv
 import io
+import os
+import hashlib
+import marshal
+from itertools import chain, islice
 
 from ._csv_helpers import (
     decode_delimiter_name
     ,decode_charset_name
     ,decode_newline
     )
+from .base.bloom import (
+    BloomFilter
+    )
+from .base.csvblock import (
+    iter_record_blocks
+    ,iter_record_offsets
+    ,read_record_lines_at
+    )
+from .base.parallel import (
+    create_pool
+    ,imap_ordered
+    ,lookup_job_count
+    )
+from .base.runfile import (
+    ROW_SAMPLE_COUNT
+    ,estimate_object_size
+    ,estimate_row_capacity
+    ,create_run_file
+    ,parse_memory_size
+    ,PartitionFileSet
+    ,RunFileSet
+    )
+
+outer_join_type = 0
+inner_join_type = 1
+semi_join_type = 2
+anti_join_type = 3
+
+# join types which only need to know if File2 has a key, not its rows
+key_only_join_type_set = {semi_join_type, anti_join_type}
+
+output_order_input = 0
+output_order_partition = 1
+
+# Limits for the number of partitions used when File2 does not fit in memory
+PARTITION_COUNT_MIN = 4
+PARTITION_COUNT_MAX = 128
+
+# Index files are identified by this name,
+#  and validated against File2 with a hash of this much content from each end.
+JOIN_INDEX_FORMAT_NAME = 'csv-join-index-1'
+JOIN_INDEX_HASH_BLOCK_SIZE = 1024*1024
+
+# Number of File1 rows sent to a worker process at a time (with --jobs)
+PROBE_BLOCK_ROW_COUNT = 10000
+
+# Number of keys a Bloom filter is sized for if the size of File2 is unknown
+BLOOM_FILTER_CAPACITY_DEFAULT = 10*1000*1000
 
 def main(arg_list, stdin, stdout, stderr):
     DEFAULT_BUFFERING = -1
@@ -76,6 +177,16 @@ def main(arg_list, stdin, stdout, stderr):
     input_column_list_string = None
     join_table_column_prefix = ''
     should_exclude_join_columns = True
+    is_sorted_join = False
+    memory_limit_str = None
+    output_order_name = None
+    temp_dir_name = None
+    join_index_file_name = None
+    job_count_str = None
+    bloom_filter_error_rate = None
+    should_approximate = False
+    err_msg = None
+    exit_code = 0
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -181,6 +292,58 @@ def main(arg_list, stdin, stdout, stderr):
             or arg == "--include-join-key"
         ):
             should_exclude_join_columns = False
+        elif (arg == "--sorted"
+        ):
+            is_sorted_join = True
+        elif (arg == "--index-file"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                join_index_file_name = arg
+        elif (arg == "--memory-limit"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                memory_limit_str = arg
+        elif (arg == "--output-order"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                output_order_name = arg
+                if (not (output_order_name.upper() in {'INPUT','PARTITION'})):
+                    err_msg = "Unknown output order: " + output_order_name
+        elif (arg == "--bloom-filter"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                try:
+                    bloom_filter_error_rate = float(arg)
+                except ValueError:
+                    bloom_filter_error_rate = None
+                if (None == bloom_filter_error_rate
+                    or not (0.0 < bloom_filter_error_rate < 1.0)
+                ):
+                    err_msg = "Bloom filter false positive rate must be between 0 and 1: " + arg
+        elif (arg == "--approximate"
+        ):
+            should_approximate = True
+        elif (arg == "--jobs"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                job_count_str = arg
+        elif (arg == "-T"
+            or arg == "--temp-dir"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                temp_dir_name = arg
         elif (None != arg
           and 0 < len(arg)
           ):
@@ -206,10 +369,30 @@ def main(arg_list, stdin, stdout, stderr):
     else: 
         join_type_name = join_type_name.upper()
     
-    if (not (join_type_name in {'INNER','OUTER'})):
+    if (not (join_type_name in {'INNER','OUTER','SEMI','ANTI'})):
         show_help = True
+    elif (should_approximate
+        and not (join_type_name in {'SEMI','ANTI'})
+        and None == err_msg
+    ):
+        err_msg = "--approximate requires a SEMI or ANTI join"
 
-    if (show_help):
+    memory_limit = None
+    job_count = 1
+    try:
+        memory_limit = parse_memory_size(memory_limit_str)
+    except ValueError:
+        err_msg = "Invalid memory limit: " + memory_limit_str
+    try:
+        job_count = lookup_job_count(job_count_str)
+    except ValueError:
+        err_msg = "Invalid job count: " + job_count_str
+
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
         column_name_separator = ','
@@ -284,39 +467,79 @@ def main(arg_list, stdin, stdout, stderr):
                 ,lineterminator=output_row_terminator
                 )
 
-            join_file = io.open(
-                 join_table_file_name
-                ,mode=read_text_io_mode
-                ,encoding=input_charset_name
-                ,newline=in_newline_mode
-                ,errors=input_charset_error_mode
-                )
-            join_csv = csv.reader(
-                join_file
-                ,delimiter=input_delimiter
-                ,lineterminator=input_row_terminator
-                )
+            if (None != join_index_file_name):
+                if (not (input_row_terminator in {'\n', '\r\n'})):
+                    raise ValueError("--index-file requires LF or CR-LF line endings")
+                execute_indexed(
+                     in_csv
+                    ,out_csv
+                    ,join_table_file_name
+                    ,join_index_file_name
+                    ,input_charset_name
+                    ,input_charset_error_mode
+                    ,input_delimiter
+                    ,join_type_name
+                    ,join_table_column_prefix
+                    ,join_table_column_name_list
+                    ,input_column_name_list
+                    ,should_exclude_join_columns
+                    )
+            else:
+                join_file = io.open(
+                     join_table_file_name
+                    ,mode=read_text_io_mode
+                    ,encoding=input_charset_name
+                    ,newline=in_newline_mode
+                    ,errors=input_charset_error_mode
+                    )
+                join_csv = csv.reader(
+                    join_file
+                    ,delimiter=input_delimiter
+                    ,lineterminator=input_row_terminator
+                    )
 
-            # execute() will close join_file,
-            # but if an exception is raised, 
-            # we won't know if join_file is closed, 
-            # so we will end up trying to close it again
-            execute(
-                 in_csv
-                ,out_csv
-                ,join_file
-                ,join_csv
-                ,join_type_name
-                ,join_operator_symbol
-                ,join_table_column_prefix
-                ,join_table_column_name_list
-                ,input_column_name_list
-                ,should_exclude_join_columns
-                )
-            # set join_file to None since execute() will have closed it
-            join_file = None
+                if (is_sorted_join):
+                    execute_sorted(
+                         in_csv
+                        ,out_csv
+                        ,join_csv
+                        ,join_type_name
+                        ,join_table_column_prefix
+                        ,join_table_column_name_list
+                        ,input_column_name_list
+                        ,should_exclude_join_columns
+                        )
+                else:
+                    # execute() will close join_file,
+                    # but if an exception is raised, 
+                    # we won't know if join_file is closed, 
+                    # so we will end up trying to close it again
+                    execute(
+                         in_csv
+                        ,out_csv
+                        ,join_file
+                        ,join_csv
+                        ,join_type_name
+                        ,join_operator_symbol
+                        ,join_table_column_prefix
+                        ,join_table_column_name_list
+                        ,input_column_name_list
+                        ,should_exclude_join_columns
+                        ,memory_limit
+                        ,output_order_name
+                        ,temp_dir_name
+                        ,job_count
+                        ,in_io
+                        ,out_io
+                        ,bloom_filter_error_rate
+                        ,should_approximate
+                        )
+                    # set join_file to None since execute() will have closed it
+                    join_file = None
         except BrokenPipeError:
             pass
+        except ValueError as exc:
+            err_msg = str(exc)
         finally:
             if (None != in_file):
                 in_file.close()
@@ -327,6 +550,11 @@ def main(arg_list, stdin, stdout, stderr):
             if (None != join_file):
                 join_file.close()
                 join_file = None
+        if (None != err_msg):
+            err_io.write(err_msg)
+            err_io.write("\n")
+            exit_code = 1
+    return exit_code
 
 def execute(
     in_csv
@@ -339,175 +567,1043 @@ def execute(
     ,join_key_column_name_list
     ,in_key_column_name_list
     ,should_exclude_join_columns
+    ,memory_limit=None
+    ,output_order_name=None
+    ,temp_dir_name=None
+    ,job_count=1
+    ,in_io=None
+    ,out_io=None
+    ,bloom_filter_error_rate=None
+    ,should_approximate=False
 ):
+    """ Join File1 rows to File2 rows which are indexed in memory (a hash join).
+
+        If File2 does not fit within memory_limit, a partitioned join is used
+        (with an optional Bloom filter of the File2 keys to skip File1 rows).
+        If job_count is more than 1, then in_io and out_io are the text streams
+        of in_csv and out_csv, and File1 rows are joined in worker processes.
+        If should_approximate is True (for SEMI and ANTI joins),
+        only a Bloom filter of the File2 keys is kept.
+    """
     end_row = None
 
-    outer_join_type = 0
-    inner_join_type = 1
-    join_type = outer_join_type
-    if (None != join_type_name):
-        if ('OUTER' == join_type_name.upper()):
-            join_type = outer_join_type
-        elif ('INNER' == join_type_name.upper()):
-            join_type = inner_join_type
+    join_type = lookup_join_type(join_type_name)
 
-    # read join_table into a dictionary
-    join_dict = dict()
-    join_in_column_name_list = None
-    join_norm_column_name_list = None
+    # read join_table into a dictionary (or a set of keys)
+    join_dict = new_join_table(join_type)
+    join_key_filter = None
     join_out_column_name_list = None
     join_out_column_position_list = None
     join_key_column_position_list = None
+    join_partition_set = None
     header_row = next(join_csv,None)
     if (None != header_row):
-        join_in_column_name_list = list(header_row) # copy
-        join_norm_column_name_list = []
-        join_column_position = 0
-        while (join_column_position < len(join_in_column_name_list)):
-            column_name = join_in_column_name_list[join_column_position]
-            norm_column_name = normalize_column_name(column_name)
-            join_norm_column_name_list.append(norm_column_name)
-            join_column_position += 1
-
-        join_key_column_position_list = []
-        join_column_position = 0
-        while (join_column_position < len(join_key_column_name_list)):
-            key_column_name = join_key_column_name_list[join_column_position]
-            key_column_name = normalize_column_name(key_column_name)
-            found_column_position = -1
-            in_column_position = 0
-            while (0 > found_column_position
-                and in_column_position < len(join_norm_column_name_list)
-            ):
-                norm_column_name = join_norm_column_name_list[in_column_position]
-                if (norm_column_name == key_column_name):
-                    found_column_position = in_column_position
-                in_column_position += 1
-            join_key_column_position_list.append(found_column_position)
-            join_column_position += 1
-
-        join_out_column_name_list = []
-        join_out_column_position_list = []
-        join_column_position = 0
-        while (join_column_position < len(join_in_column_name_list)):
-            column_name = join_in_column_name_list[join_column_position]
-            out_column_name = column_name
-            if (None != join_column_name_prefix):
-                out_column_name = join_column_name_prefix + column_name
-            if (should_exclude_join_columns):
-                found_join_key_position = -1
-                join_key_position = 0
-                while (0 > found_join_key_position
-                    and join_key_position < len(join_key_column_position_list)
-                ):
-                    column_position = join_key_column_position_list[join_key_position]
-                    if (join_column_position == column_position):
-                        found_join_key_position = join_key_position
-                    join_key_position += 1
-                if (0 <= found_join_key_position):
-                    out_column_name = None
-            if (None != out_column_name):
-                join_out_column_name_list.append(out_column_name)
-                join_out_column_position_list.append(join_column_position)
-            join_column_position += 1
+        join_key_column_position_list = find_column_position_list(
+            header_row
+            ,join_key_column_name_list
+            )
+        (join_out_column_name_list, join_out_column_position_list) = make_join_out_column_lists(
+            header_row
+            ,join_key_column_position_list
+            ,join_column_name_prefix
+            ,should_exclude_join_columns
+            ,join_type
+            )
         
-    if (None != join_key_column_position_list):
-        in_row = next(join_csv,None)
-        while (None != in_row):
-            row_key_list = []
-            for key_column_position in join_key_column_position_list:
-                key_value = None
-                if (0 <= key_column_position
-                    and key_column_position < len(in_row)
-                ):
-                    key_value = in_row[key_column_position]
-                row_key_list.append(key_value)
-            row_key = tuple(row_key_list)
-            join_row_list = join_dict.get(row_key,[])
-            join_row_list.append(in_row)
-            join_dict[row_key] = join_row_list
+    try:
+        if (None != join_key_column_position_list):
+            # only the File2 output cells are kept in the dictionary
+            project_join_row = make_join_row_projector(join_out_column_position_list)
+            # if there is a memory limit, 
+            #  use the first rows to estimate how many rows fit in memory
+            join_row_count_max = None
+            join_row_sample = None
+            if (should_approximate):
+                # a Bloom filter has a fixed size, so there is no need for partitions
+                join_row_sample = list(islice(join_csv, ROW_SAMPLE_COUNT))
+                join_dict = BloomFilter(
+                    estimate_join_row_count(join_file, join_row_sample)
+                    ,bloom_filter_error_rate
+                    )
+                join_csv = chain(join_row_sample, join_csv)
+            elif (None != memory_limit):
+                join_row_sample = list(islice(join_csv, ROW_SAMPLE_COUNT))
+                join_row_count_max = estimate_join_row_capacity(
+                    join_row_sample
+                    ,join_key_column_position_list
+                    ,project_join_row
+                    ,memory_limit
+                    )
+                if (None != bloom_filter_error_rate):
+                    # the filter is only used if File2 is partitioned,
+                    #  but every key must be added to it as File2 is read
+                    join_key_filter = BloomFilter(
+                        estimate_join_row_count(join_file, join_row_sample)
+                        ,bloom_filter_error_rate
+                        )
+                join_csv = chain(join_row_sample, join_csv)
+            join_row_count = 0
             in_row = next(join_csv,None)
-    # close join_file so that we don't keep it open the whole time we are reading the input table
-    if (None != join_file):
-        join_file.close()
+            while (None != in_row
+                and (None == join_row_count_max or join_row_count < join_row_count_max)
+            ):
+                row_key = get_row_key(in_row, join_key_column_position_list)
+                add_join_out_row(join_dict, row_key, project_join_row(in_row))
+                if (None != join_key_filter):
+                    join_key_filter.add(row_key)
+                join_row_count += 1
+                in_row = next(join_csv,None)
+            if (None != in_row):
+                # File2 does not fit in memory,
+                #  move it to partition files on disk
+                join_partition_set = partition_join_table(
+                    join_file
+                    ,join_dict
+                    ,join_row_sample
+                    ,chain([in_row], join_csv)
+                    ,join_key_column_position_list
+                    ,project_join_row
+                    ,memory_limit
+                    ,temp_dir_name
+                    ,join_key_filter
+                    )
+                join_dict = None
+        # close join_file so that we don't keep it open the whole time we are reading the input table
+        if (None != join_file):
+            join_file.close()
     
 
-    # start processing the input,
-    # first build a key column position list
-    # [20170524 [db] This code is copy-pasted from the code above,
-    #  it could be centralized into some awkward functions]
-    in_column_name_list = None
-    norm_column_name_list = None
-    out_column_name_list = None
-    key_column_position_list = None
-    header_row = next(in_csv,None)
-    if (None != header_row):
-        in_column_name_list = list(header_row) # copy
-        norm_column_name_list = []
-        out_column_name_list = []
-        for column_name in in_column_name_list:
-            norm_column_name = normalize_column_name(column_name)
-            norm_column_name_list.append(norm_column_name)
-            out_column_name = column_name
-            out_column_name_list.append(out_column_name)
-
-        key_column_position_list = []
-        column_position = 0
-        while (column_position < len(in_key_column_name_list)):
-            key_column_name = in_key_column_name_list[column_position]
-            key_column_name = normalize_column_name(key_column_name)
-            found_column_position = -1
-            in_column_position = 0
-            while (0 > found_column_position
-                and in_column_position < len(norm_column_name_list)
+        # start processing the input,
+        # first build a key column position list
+        (out_column_name_list, key_column_position_list) = read_input_header(
+            in_csv
+            ,in_key_column_name_list
+            )
+
+        # write header row
+        if (None != out_column_name_list):
+            if (None != join_out_column_name_list):
+                out_column_name_list += join_out_column_name_list
+            out_csv.writerow(out_column_name_list)
+
+        if (None != join_partition_set):
+            if (None != out_column_name_list):
+                execute_partitioned(
+                    in_csv
+                    ,out_csv
+                    ,join_partition_set
+                    ,join_type
+                    ,join_key_column_position_list
+                    ,key_column_position_list
+                    ,join_out_column_name_list
+                    ,output_order_name
+                    ,temp_dir_name
+                    ,join_key_filter
+                    )
+        elif (1 < job_count
+            and None != out_column_name_list
+        ):
+            execute_parallel_probe(
+                in_io
+                ,out_io
+                ,in_csv.dialect
+                ,out_csv.dialect
+                ,join_dict
+                ,join_type
+                ,key_column_position_list
+                ,join_out_column_name_list
+                ,job_count
+                )
+        else:
+            # process incoming rows
+            in_row = next(in_csv,None)
+            while (None != in_row):
+                row_key = get_row_key(in_row, key_column_position_list)
+                write_joined_rows(
+                    out_csv
+                    ,in_row
+                    ,get_join_out_rows(join_dict, row_key)
+                    ,join_type
+                    ,join_out_column_name_list
+                    )
+                in_row = next(in_csv,None)
+    finally:
+        if (None != join_partition_set):
+            join_partition_set.close()
+
+def execute_parallel_probe(
+    in_io
+    ,out_io
+    ,in_dialect
+    ,out_dialect
+    ,join_dict
+    ,join_type
+    ,key_column_position_list
+    ,join_out_column_name_list
+    ,job_count
+):
+    """ Join the rest of File1 to join_dict in worker processes.
+
+        in_io must be positioned after the File1 header.
+        The workers are forked after join_dict is built,
+        so they share it rather than receiving a copy;
+        blocks of unparsed File1 text are sent to the workers,
+        and the joined text of each block is written in File1 order.
+    """
+    pool = None
+    try:
+        pool = create_pool(
+            job_count
+            ,init_join_worker
+            ,(
+                join_dict
+                ,join_type
+                ,key_column_position_list
+                ,join_out_column_name_list
+                ,(in_dialect.delimiter, in_dialect.lineterminator)
+                ,(out_dialect.delimiter, out_dialect.lineterminator)
+            )
+            ,should_share_initargs=True
+            )
+        in_block_iter = iter_record_blocks(in_io, PROBE_BLOCK_ROW_COUNT)
+        in_line_list_iter = (in_line_list for (_, in_line_list) in in_block_iter)
+        for out_text in imap_ordered(pool, probe_block, in_line_list_iter, 2 * job_count):
+            out_io.write(out_text)
+        pool.close()
+        pool.join()
+        pool = None
+    finally:
+        if (None != pool):
+            pool.terminate()
+
+# state of a worker process used by execute_parallel_probe()
+join_worker_state = None
+
+def init_join_worker(*worker_state):
+    global join_worker_state
+    join_worker_state = worker_state
+
+def probe_block(in_line_list):
+    """ Join a block of File1 csv text; return the joined csv text. """
+    (
+        join_dict
+        ,join_type
+        ,key_column_position_list
+        ,join_out_column_name_list
+        ,(input_delimiter, input_row_terminator)
+        ,(output_delimiter, output_row_terminator)
+    ) = join_worker_state
+    in_csv = csv.reader(
+        in_line_list
+        ,delimiter=input_delimiter
+        ,lineterminator=input_row_terminator
+        )
+    out_io = io.StringIO(newline='')
+    out_csv = csv.writer(
+        out_io
+        ,delimiter=output_delimiter
+        ,lineterminator=output_row_terminator
+        )
+    for in_row in in_csv:
+        row_key = get_row_key(in_row, key_column_position_list)
+        write_joined_rows(
+            out_csv
+            ,in_row
+            ,get_join_out_rows(join_dict, row_key)
+            ,join_type
+            ,join_out_column_name_list
+            )
+    return out_io.getvalue()
+
+def estimate_join_row_capacity(
+    join_row_sample
+    ,join_key_column_position_list
+    ,project_join_row
+    ,memory_limit
+):
+    """ Estimate how many File2 rows fit in the join dictionary.
+
+        Only the output cells of each row are stored,
+        so the sample rows are measured after they are projected.
+    """
+    join_row_sample = [
+        (get_row_key(join_row, join_key_column_position_list), project_join_row(join_row))
+        for join_row in join_row_sample
+        ]
+    def get_dict_overhead_size(join_row_item):
+        # each row has about 100 bytes of dict/list overhead,
+        #  the key tuple is counted by estimate_row_capacity
+        return 100
+    return estimate_row_capacity(
+        join_row_sample
+        ,memory_limit
+        ,get_dict_overhead_size
+        )
+
+def encode_join_partition_row(row_key, join_out_row):
+    """ Make a File2 partition row from a key and the output cells of a row.
+
+        The first cell flags which key cells are missing (None),
+        so that missing cells are not confused with empty ones;
+        it is empty if no key cells are missing.
+    """
+    missing_key_flags = ''
+    if (None in row_key):
+        missing_key_flags = ''.join(['1' if (None == key_value) else '0' for key_value in row_key])
+    partition_row = [missing_key_flags]
+    partition_row.extend(row_key)
+    partition_row.extend(join_out_row)
+    return partition_row
+
+def decode_join_partition_row(partition_row, key_column_count):
+    """ Get (row_key, join_out_row) from a File2 partition row. """
+    missing_key_flags = partition_row[0]
+    row_key = partition_row[1:key_column_count + 1]
+    if (0 < len(missing_key_flags)):
+        row_key = [
+            None if ('1' == missing_key_flag) else key_value
+            for (missing_key_flag, key_value) in zip(missing_key_flags, row_key)
+            ]
+    join_out_row = tuple(map(sys.intern, partition_row[key_column_count + 1:]))
+    return (tuple(row_key), join_out_row)
+
+def get_join_file_size(join_file):
+    join_file_size = None
+    if (None != join_file):
+        try:
+            join_file_size = os.fstat(join_file.fileno()).st_size
+        except (OSError, ValueError):
+            join_file_size = None
+    return join_file_size
+
+def estimate_join_row_count(join_file, join_row_sample):
+    """ Estimate the number of File2 rows from its size and the sample rows. """
+    join_row_count = len(join_row_sample)
+    if (ROW_SAMPLE_COUNT > join_row_count):
+        # the sample is all of File2
+        return join_row_count
+    join_row_text_size = 0
+    for join_row in join_row_sample:
+        join_row_text_size += len(join_row) + sum(map(len, join_row))
+    join_file_size = get_join_file_size(join_file)
+    if (None == join_file_size
+        or 0 == join_file_size
+        or 0 == join_row_text_size
+    ):
+        return BLOOM_FILTER_CAPACITY_DEFAULT
+    return max(join_row_count, join_file_size * join_row_count // join_row_text_size)
+
+def partition_join_table(
+    join_file
+    ,join_dict
+    ,join_row_sample
+    ,join_csv
+    ,join_key_column_position_list
+    ,project_join_row
+    ,memory_limit
+    ,temp_dir_name
+    ,join_key_filter=None
+):
+    """ Move the File2 rows (the ones in join_dict and the rest of join_csv) to partition files.
+
+        Rows are partitioned by a hash of their key,
+        there are enough partitions to make each one fit within memory_limit
+        (assuming that the keys are not too skewed).
+        Partition rows hold the key and the output cells of each File2 row.
+        The keys of the remaining rows are also added to join_key_filter.
+    """
+    # estimate the size of File2 in memory from the sample rows
+    join_row_mem_size = 0
+    join_row_text_size = 0
+    for join_row in (join_row_sample or []):
+        join_row_mem_size += estimate_object_size(project_join_row(join_row))
+        join_row_mem_size += estimate_object_size(get_row_key(join_row, join_key_column_position_list))
+        join_row_text_size += len(join_row) + sum(map(len, join_row))
+    join_file_size = get_join_file_size(join_file)
+    partition_count = PARTITION_COUNT_MIN
+    if (None != join_file_size
+        and 0 < join_row_text_size
+    ):
+        join_table_mem_size = join_file_size * join_row_mem_size // join_row_text_size
+        partition_count = 2 * (join_table_mem_size // memory_limit + 1)
+    partition_count = max(PARTITION_COUNT_MIN, min(PARTITION_COUNT_MAX, partition_count))
+
+    join_partition_set = PartitionFileSet(partition_count, temp_dir_name)
+    try:
+        # rows for each key are written in their original order
+        for row_key in join_dict:
+            partition_index = hash(row_key) % partition_count
+            for join_out_row in get_join_out_rows(join_dict, row_key):
+                join_partition_set.writerow(
+                    partition_index
+                    ,encode_join_partition_row(row_key, join_out_row)
+                    )
+        join_dict.clear()
+        for join_row in join_csv:
+            row_key = get_row_key(join_row, join_key_column_position_list)
+            if (None != join_key_filter):
+                join_key_filter.add(row_key)
+            partition_index = hash(row_key) % partition_count
+            join_partition_set.writerow(
+                partition_index
+                ,encode_join_partition_row(row_key, project_join_row(join_row))
+                )
+    except:
+        join_partition_set.close()
+        raise
+    return join_partition_set
+
+def execute_partitioned(
+    in_csv
+    ,out_csv
+    ,join_partition_set
+    ,join_type
+    ,join_key_column_position_list
+    ,key_column_position_list
+    ,join_out_column_name_list
+    ,output_order_name
+    ,temp_dir_name
+    ,join_key_filter=None
+):
+    """ Join File1 to a partitioned File2 (a "grace" hash join).
+
+        File1 is partitioned the same way as File2, 
+        then each pair of partitions is joined in memory.
+        If the output order is "input", then each File1 row is tagged
+        with its position and the joined partitions are merged by position;
+        if the output order is "partition", then rows are written
+        as each partition is joined.
+        File1 rows whose keys are not in join_key_filter (a Bloom filter
+        of the File2 keys) are joined right away instead of being partitioned.
+    """
+    partition_count = len(join_partition_set)
+    join_key_column_count = len(join_key_column_position_list)
+    should_keep_input_order = (output_order_partition != lookup_output_order(output_order_name))
+    in_partition_set = PartitionFileSet(partition_count, temp_dir_name)
+    out_run_set = None
+    out_row_iter = None
+    unmatched_run_io = None
+    try:
+        # rows in the File1 partitions start with a position cell
+        #  if the output must be in input order
+        in_partition_key_column_position_list = key_column_position_list
+        if (should_keep_input_order):
+            in_partition_key_column_position_list = [
+                (key_column_position + 1) if (0 <= key_column_position) else -1
+                for key_column_position in key_column_position_list
+                ]
+        # File1 rows which have no match are written to a run file
+        #  (tagged with their position) if the output is in input order
+        unmatched_csv = out_csv
+        if (None != join_key_filter
+            and should_keep_input_order
+        ):
+            unmatched_run_io = create_run_file(temp_dir_name)
+            unmatched_csv = csv.writer(unmatched_run_io)
+        in_row_position = 0
+        for in_row in in_csv:
+            row_key = get_row_key(in_row, key_column_position_list)
+            if (should_keep_input_order):
+                in_row = [str(in_row_position)] + in_row
+            if (None != join_key_filter
+                and not (row_key in join_key_filter)
             ):
-                norm_column_name = norm_column_name_list[in_column_position]
-                if (norm_column_name == key_column_name):
-                    found_column_position = in_column_position
-                in_column_position += 1
-            key_column_position_list.append(found_column_position)
-            column_position += 1
-
-    # write header row
+                write_joined_rows(
+                    unmatched_csv
+                    ,in_row
+                    ,()
+                    ,join_type
+                    ,join_out_column_name_list
+                    )
+            else:
+                partition_index = hash(row_key) % partition_count
+                in_partition_set.writerow(partition_index, in_row)
+            in_row_position += 1
+
+        def get_out_row_position(out_row):
+            return int(out_row[0])
+        out_partition_csv = out_csv
+        if (should_keep_input_order):
+            out_run_set = RunFileSet(get_out_row_position, temp_dir_name)
+        if (None != unmatched_run_io):
+            unmatched_run_io.seek(0)
+            out_run_set.add_run_file(unmatched_run_io)
+            unmatched_run_io = None
+        partition_index = 0
+        while (partition_index < partition_count):
+            join_dict = new_join_table(join_type)
+            for partition_row in join_partition_set.read_partition(partition_index):
+                (row_key, join_out_row) = decode_join_partition_row(partition_row, join_key_column_count)
+                add_join_out_row(join_dict, row_key, join_out_row)
+            join_partition_set.close_partition(partition_index)
+
+            out_run_io = None
+            if (should_keep_input_order):
+                # joined rows keep the position cell, it is removed after the merge
+                out_run_io = create_run_file(temp_dir_name)
+                out_partition_csv = csv.writer(out_run_io)
+            for in_row in in_partition_set.read_partition(partition_index):
+                row_key = get_row_key(in_row, in_partition_key_column_position_list)
+                write_joined_rows(
+                    out_partition_csv
+                    ,in_row
+                    ,get_join_out_rows(join_dict, row_key)
+                    ,join_type
+                    ,join_out_column_name_list
+                    )
+            in_partition_set.close_partition(partition_index)
+            join_dict = None
+            if (None != out_run_io):
+                out_run_io.seek(0)
+                out_run_set.add_run_file(out_run_io)
+            partition_index += 1
+
+        if (should_keep_input_order):
+            out_row_iter = out_run_set.merge()
+            for out_row in out_row_iter:
+                out_csv.writerow(out_row[1:])
+    finally:
+        if (None != out_row_iter):
+            out_row_iter.close()
+        if (None != out_run_set):
+            out_run_set.close()
+        if (None != unmatched_run_io):
+            unmatched_run_io.close()
+        in_partition_set.close()
+
+def lookup_output_order(output_order_name):
+    output_order = output_order_input
+    if (None != output_order_name):
+        if ('PARTITION' == output_order_name.upper()):
+            output_order = output_order_partition
+        elif ('INPUT' == output_order_name.upper()):
+            output_order = output_order_input
+    return output_order
+
+def execute_sorted(
+    in_csv
+    ,out_csv
+    ,join_csv
+    ,join_type_name
+    ,join_column_name_prefix
+    ,join_key_column_name_list
+    ,in_key_column_name_list
+    ,should_exclude_join_columns
+):
+    """ Join two inputs which are both sorted on their join columns.
+
+        Both inputs are read in lockstep (a "merge join"),
+        so only the File2 rows which share the current key are held in memory.
+        Keys are compared as text (the default csv-sort order),
+        and a ValueError is raised if either input is found to be out of order.
+    """
+    end_row = None
+    join_type = lookup_join_type(join_type_name)
+
+    join_out_column_name_list = None
+    join_out_column_position_list = None
+    join_key_column_position_list = None
+    header_row = next(join_csv,None)
+    if (None != header_row):
+        join_key_column_position_list = find_column_position_list(
+            header_row
+            ,join_key_column_name_list
+            )
+        (join_out_column_name_list, join_out_column_position_list) = make_join_out_column_lists(
+            header_row
+            ,join_key_column_position_list
+            ,join_column_name_prefix
+            ,should_exclude_join_columns
+            ,join_type
+            )
+
+    (out_column_name_list, key_column_position_list) = read_input_header(
+        in_csv
+        ,in_key_column_name_list
+        )
     if (None != out_column_name_list):
         if (None != join_out_column_name_list):
             out_column_name_list += join_out_column_name_list
         out_csv.writerow(out_column_name_list)
 
-    # process incoming rows
+    if (None == out_column_name_list):
+        return
+    join_group_iter = iter([])
+    if (None != join_key_column_position_list):
+        join_group_iter = iter_sorted_key_groups(
+            join_csv
+            ,join_key_column_position_list
+            ,"File2"
+            )
+    project_join_row = make_join_row_projector(join_out_column_position_list)
+    def next_join_group():
+        (join_row_key, join_row_list) = next(join_group_iter, (None, None))
+        join_exact_key_list = None
+        if (None != join_row_list):
+            if ('' in join_row_key):
+                # missing cells are sorted as empty text, but (as in the hash join)
+                #  they only match missing cells, so the group keeps the exact keys
+                join_exact_key_list = [
+                    get_row_key(join_row, join_key_column_position_list)
+                    for join_row in join_row_list
+                    ]
+            join_row_list = list(map(project_join_row, join_row_list))
+        return (join_row_key, join_row_list, join_exact_key_list)
+    (join_row_key, join_out_row_list, join_exact_key_list) = next_join_group()
+
+    in_row_position = 0
+    prev_row_key = None
     in_row = next(in_csv,None)
     while (None != in_row):
-        out_row = None
-        row_key_list = []
-        for key_column_position in key_column_position_list:
-            key_value = None
-            if (0 <= key_column_position
-                and key_column_position < len(in_row)
-            ):
-                key_value = in_row[key_column_position]
-            row_key_list.append(key_value)
-        row_key = tuple(row_key_list)
-        join_row_list = join_dict.get(row_key,[])
-        if (0 == len(join_row_list)):
-            if (outer_join_type == join_type):
-                join_row = []
-                for column_name in join_out_column_name_list:
-                    cell_value = None
-                    join_row.append(cell_value)
-                join_row_list = [join_row]
-            elif (inner_join_type == join_type):
-                pass
-        for join_row in join_row_list:
-            out_row = list(in_row)
-            for column_position in join_out_column_position_list:
-                if (0 <= column_position):
-                    cell_value = None
-                    if (column_position < len(join_row)):
-                        cell_value = join_row[column_position]
-                    out_row.append(cell_value)
-            out_csv.writerow(out_row)        
+        in_row_position += 1
+        row_key = get_sorted_row_key(in_row, key_column_position_list)
+        if (None != prev_row_key
+            and row_key < prev_row_key
+        ):
+            raise_unsorted_key_error("File1", in_row_position, row_key, prev_row_key)
+        prev_row_key = row_key
+        # advance File2 to the first key which is not less than the File1 key
+        while (None != join_row_key
+            and join_row_key < row_key
+        ):
+            (join_row_key, join_out_row_list, join_exact_key_list) = next_join_group()
+        matched_row_list = []
+        if (None != join_row_key
+            and join_row_key == row_key
+        ):
+            matched_row_list = join_out_row_list
+            if (None != join_exact_key_list):
+                exact_row_key = get_row_key(in_row, key_column_position_list)
+                matched_row_list = [
+                    join_out_row
+                    for (join_exact_key, join_out_row) in zip(join_exact_key_list, join_out_row_list)
+                    if (join_exact_key == exact_row_key)
+                    ]
+        write_joined_rows(
+            out_csv
+            ,in_row
+            ,matched_row_list
+            ,join_type
+            ,join_out_column_name_list
+            )
+        in_row = next(in_csv,None)
+
+def execute_indexed(
+    in_csv
+    ,out_csv
+    ,join_file_name
+    ,join_index_file_name
+    ,join_charset_name
+    ,join_charset_error_mode
+    ,join_delimiter
+    ,join_type_name
+    ,join_column_name_prefix
+    ,join_key_column_name_list
+    ,in_key_column_name_list
+    ,should_exclude_join_columns
+):
+    """ Join File1 to File2 using an index file of File2 row offsets.
+
+        The index maps each File2 key to the byte offsets of its rows.
+        If the index file is missing or does not match File2 (by size, 
+        modification time, and a hash of its content), then the index
+        is built from File2 and saved.
+        Only the index is held in memory; matching File2 rows are read
+        from File2 as they are needed.
+    """
+    join_type = lookup_join_type(join_type_name)
+    join_index = load_join_index(
+        join_index_file_name
+        ,join_file_name
+        ,join_charset_name
+        ,join_delimiter
+        ,join_key_column_name_list
+        )
+    if (None == join_index):
+        join_index = build_join_index(
+            join_file_name
+            ,join_charset_name
+            ,join_charset_error_mode
+            ,join_delimiter
+            ,join_key_column_name_list
+            )
+        save_join_index(join_index_file_name, join_index)
+
+    join_out_column_name_list = None
+    join_out_column_position_list = None
+    header_row = join_index['header_row']
+    join_offset_dict = join_index['offset_dict']
+    if (None != header_row):
+        join_key_column_position_list = find_column_position_list(
+            header_row
+            ,join_key_column_name_list
+            )
+        (join_out_column_name_list, join_out_column_position_list) = make_join_out_column_lists(
+            header_row
+            ,join_key_column_position_list
+            ,join_column_name_prefix
+            ,should_exclude_join_columns
+            ,join_type
+            )
+
+    (out_column_name_list, key_column_position_list) = read_input_header(
+        in_csv
+        ,in_key_column_name_list
+        )
+    if (None != out_column_name_list):
+        if (None != join_out_column_name_list):
+            out_column_name_list += join_out_column_name_list
+        out_csv.writerow(out_column_name_list)
+    if (None == out_column_name_list):
+        return
+
+    project_join_row = make_join_row_projector(join_out_column_position_list)
+    def read_join_out_row(join_offset):
+        join_line_list = read_record_lines_at(join_bin_io, join_offset)
+        join_text = b''.join(join_line_list).decode(join_charset_name, join_charset_error_mode)
+        return project_join_row(next(csv.reader([join_text], delimiter=join_delimiter), []))
+
+    with io.open(join_file_name, 'rb') as join_bin_io:
         in_row = next(in_csv,None)
+        while (None != in_row):
+            row_key = get_row_key(in_row, key_column_position_list)
+            join_offset_list = join_offset_dict.get(row_key,())
+            if (isinstance(join_offset_list, int)):
+                join_offset_list = (join_offset_list,)
+            if (join_type in key_only_join_type_set):
+                join_out_row_list = [()] * len(join_offset_list)
+            else:
+                join_out_row_list = [read_join_out_row(join_offset) for join_offset in join_offset_list]
+            write_joined_rows(
+                out_csv
+                ,in_row
+                ,join_out_row_list
+                ,join_type
+                ,join_out_column_name_list
+                )
+            in_row = next(in_csv,None)
+
+def get_join_file_signature(join_file_name):
+    """ Get (size, modification time, content hash) to identify a version of File2.
+
+        The content hash covers the start and the end of the file
+        so that it is quick to compute for large files.
+    """
+    join_file_stat = os.stat(join_file_name)
+    join_file_size = join_file_stat.st_size
+    content_hash = hashlib.sha1()
+    content_hash.update(str(join_file_size).encode('ascii'))
+    with io.open(join_file_name, 'rb') as join_bin_io:
+        content_hash.update(join_bin_io.read(JOIN_INDEX_HASH_BLOCK_SIZE))
+        if (JOIN_INDEX_HASH_BLOCK_SIZE < join_file_size):
+            join_bin_io.seek(max(JOIN_INDEX_HASH_BLOCK_SIZE, join_file_size - JOIN_INDEX_HASH_BLOCK_SIZE))
+            content_hash.update(join_bin_io.read(JOIN_INDEX_HASH_BLOCK_SIZE))
+    return (join_file_size, join_file_stat.st_mtime_ns, content_hash.hexdigest())
+
+def build_join_index(
+    join_file_name
+    ,join_charset_name
+    ,join_charset_error_mode
+    ,join_delimiter
+    ,join_key_column_name_list
+):
+    """ Scan File2 and map each key to the byte offsets of its rows. """
+    (join_file_size, join_file_mtime, join_content_hash) = get_join_file_signature(join_file_name)
+    header_row = None
+    join_offset_dict = dict()
+    with io.open(join_file_name, 'rb') as join_bin_io:
+        join_record_iter = iter_record_offsets(join_bin_io)
+        join_key_column_position_list = None
+        for (join_offset, join_line_list) in join_record_iter:
+            join_text = b''.join(join_line_list).decode(join_charset_name, join_charset_error_mode)
+            join_row = next(csv.reader([join_text], delimiter=join_delimiter), [])
+            if (None == join_key_column_position_list):
+                header_row = join_row
+                join_key_column_position_list = find_column_position_list(
+                    header_row
+                    ,join_key_column_name_list
+                    )
+            else:
+                # keys with a single row map to an int; others to a list
+                row_key = get_row_key(join_row, join_key_column_position_list)
+                join_offset_list = join_offset_dict.get(row_key)
+                if (None == join_offset_list):
+                    join_offset_dict[row_key] = join_offset
+                elif (isinstance(join_offset_list, int)):
+                    join_offset_dict[row_key] = [join_offset_list, join_offset]
+                else:
+                    join_offset_list.append(join_offset)
+    return {
+        'format': JOIN_INDEX_FORMAT_NAME,
+        'file_size': join_file_size,
+        'file_mtime': join_file_mtime,
+        'content_hash': join_content_hash,
+        'charset': join_charset_name,
+        'delimiter': join_delimiter,
+        'key_column_name_list': list(map(normalize_column_name, join_key_column_name_list)),
+        'header_row': header_row,
+        'offset_dict': join_offset_dict,
+        }
+
+def load_join_index(
+    join_index_file_name
+    ,join_file_name
+    ,join_charset_name
+    ,join_delimiter
+    ,join_key_column_name_list
+):
+    """ Load an index file, return None if it is missing or does not match File2. """
+    join_index = None
+    try:
+        with io.open(join_index_file_name, 'rb') as join_index_io:
+            join_index = marshal.load(join_index_io)
+    except (OSError, EOFError, ValueError, TypeError):
+        # the index is missing, or it was written by another version of python
+        join_index = None
+    if (not isinstance(join_index, dict)
+        or JOIN_INDEX_FORMAT_NAME != join_index.get('format')
+    ):
+        return None
+    (join_file_size, join_file_mtime, join_content_hash) = get_join_file_signature(join_file_name)
+    if (join_index.get('file_size') != join_file_size
+        or join_index.get('file_mtime') != join_file_mtime
+        or join_index.get('content_hash') != join_content_hash
+        or join_index.get('charset') != join_charset_name
+        or join_index.get('delimiter') != join_delimiter
+        or join_index.get('key_column_name_list') != list(map(normalize_column_name, join_key_column_name_list))
+    ):
+        return None
+    return join_index
+
+def save_join_index(join_index_file_name, join_index):
+    # write to a temporary file first so that other processes
+    #  never see a partly written index
+    temp_file_name = join_index_file_name + '.tmp{0}'.format(os.getpid())
+    try:
+        with io.open(temp_file_name, 'wb') as join_index_io:
+            marshal.dump(join_index, join_index_io)
+        os.replace(temp_file_name, join_index_file_name)
+    finally:
+        if (os.path.exists(temp_file_name)):
+            os.remove(temp_file_name)
+
+def lookup_join_type(join_type_name):
+    join_type = outer_join_type
+    if (None != join_type_name):
+        if ('OUTER' == join_type_name.upper()):
+            join_type = outer_join_type
+        elif ('INNER' == join_type_name.upper()):
+            join_type = inner_join_type
+        elif ('SEMI' == join_type_name.upper()):
+            join_type = semi_join_type
+        elif ('ANTI' == join_type_name.upper()):
+            join_type = anti_join_type
+    return join_type
+
+def find_column_position_list(
+    header_row
+    ,key_column_name_list
+):
+    """ Find the position of each key column in a header row (-1 if not found). """
+    norm_column_name_list = list(map(normalize_column_name, header_row))
+    key_column_position_list = []
+    for key_column_name in key_column_name_list:
+        key_column_name = normalize_column_name(key_column_name)
+        found_column_position = -1
+        in_column_position = 0
+        while (0 > found_column_position
+            and in_column_position < len(norm_column_name_list)
+        ):
+            norm_column_name = norm_column_name_list[in_column_position]
+            if (norm_column_name == key_column_name):
+                found_column_position = in_column_position
+            in_column_position += 1
+        key_column_position_list.append(found_column_position)
+    return key_column_position_list
+
+def make_join_out_column_lists(
+    join_header_row
+    ,join_key_column_position_list
+    ,join_column_name_prefix
+    ,should_exclude_join_columns
+    ,join_type=None
+):
+    """ Make lists of the names and positions of the File2 columns to write. """
+    join_out_column_name_list = []
+    join_out_column_position_list = []
+    join_column_position = 0
+    if (join_type in key_only_join_type_set):
+        # SEMI and ANTI joins do not write any File2 columns
+        join_column_position = len(join_header_row)
+    while (join_column_position < len(join_header_row)):
+        column_name = join_header_row[join_column_position]
+        out_column_name = column_name
+        if (None != join_column_name_prefix):
+            out_column_name = join_column_name_prefix + column_name
+        if (should_exclude_join_columns
+            and join_column_position in join_key_column_position_list
+        ):
+            out_column_name = None
+        if (None != out_column_name):
+            join_out_column_name_list.append(out_column_name)
+            join_out_column_position_list.append(join_column_position)
+        join_column_position += 1
+    return (join_out_column_name_list, join_out_column_position_list)
 
+def read_input_header(
+    in_csv
+    ,in_key_column_name_list
+):
+    """ Read the File1 header; return its output column names and key positions. """
+    out_column_name_list = None
+    key_column_position_list = None
+    header_row = next(in_csv,None)
+    if (None != header_row):
+        out_column_name_list = list(header_row) # copy
+        key_column_position_list = find_column_position_list(
+            header_row
+            ,in_key_column_name_list
+            )
+    return (out_column_name_list, key_column_position_list)
+
+def get_row_key(in_row, key_column_position_list):
+    row_key_list = []
+    for key_column_position in key_column_position_list:
+        key_value = None
+        if (0 <= key_column_position
+            and key_column_position < len(in_row)
+        ):
+            key_value = in_row[key_column_position]
+        row_key_list.append(key_value)
+    return tuple(row_key_list)
+
+def get_sorted_row_key(in_row, key_column_position_list):
+    # missing cells are compared as empty text (as csv-sort does);
+    #  rows with the same sorted key are matched by get_row_key() if it has an empty value
+    row_key_list = []
+    for key_column_position in key_column_position_list:
+        key_value = ''
+        if (0 <= key_column_position
+            and key_column_position < len(in_row)
+        ):
+            key_value = in_row[key_column_position]
+        row_key_list.append(key_value)
+    return tuple(row_key_list)
+
+def iter_sorted_key_groups(
+    in_csv
+    ,key_column_position_list
+    ,file_label
+):
+    """ Yield (row_key, row_list) for each run of rows with the same key. """
+    in_row_position = 0
+    group_row_key = None
+    group_row_list = None
+    for in_row in in_csv:
+        in_row_position += 1
+        row_key = get_sorted_row_key(in_row, key_column_position_list)
+        if (None != group_row_key
+            and row_key == group_row_key
+        ):
+            group_row_list.append(in_row)
+        else:
+            if (None != group_row_key):
+                if (row_key < group_row_key):
+                    raise_unsorted_key_error(file_label, in_row_position, row_key, group_row_key)
+                yield (group_row_key, group_row_list)
+            group_row_key = row_key
+            group_row_list = [in_row]
+    if (None != group_row_key):
+        yield (group_row_key, group_row_list)
+
+def raise_unsorted_key_error(file_label, in_row_position, row_key, prev_row_key):
+    raise ValueError(
+        "{0} is not sorted on the join columns: row {1} has key {2} after key {3}".format(
+            file_label
+            ,in_row_position
+            ,list(row_key)
+            ,list(prev_row_key)
+            ))
+
+def make_join_row_projector(join_out_column_position_list):
+    """ Make a function which reduces a File2 row to a tuple of its output cells.
+
+        Only the output cells of File2 rows are kept in memory.
+        Cell values are interned, so that a value which is repeated
+        in many rows (e.g. a category or a status) is stored once.
+        Cells which are missing from short rows are None.
+    """
+    if (None == join_out_column_position_list):
+        join_out_column_position_list = []
+    def project_join_row(join_row):
+        join_row_length = len(join_row)
+        return tuple([
+            sys.intern(join_row[column_position]) if (column_position < join_row_length) else None
+            for column_position in join_out_column_position_list
+            ])
+    return project_join_row
+
+def new_join_table(join_type):
+    """ Make an empty table of File2 rows by key (just a set of keys for SEMI and ANTI joins). """
+    if (join_type in key_only_join_type_set):
+        return set()
+    return dict()
+
+def add_join_out_row(join_dict, row_key, join_out_row):
+    if (not isinstance(join_dict, dict)):
+        # a set of keys (or a Bloom filter of keys)
+        join_dict.add(row_key)
+        return
+    # keys with a single row map to the row tuple; others to a list of row tuples
+    join_out_row_list = join_dict.get(row_key)
+    if (None == join_out_row_list):
+        join_dict[row_key] = join_out_row
+    elif (isinstance(join_out_row_list, tuple)):
+        join_dict[row_key] = [join_out_row_list, join_out_row]
+    else:
+        join_out_row_list.append(join_out_row)
+
+def get_join_out_rows(join_dict, row_key):
+    if (not isinstance(join_dict, dict)):
+        # a set of keys (or a Bloom filter of keys) has an empty row for each key
+        if (row_key in join_dict):
+            return ((),)
+        return ()
+    join_out_row_list = join_dict.get(row_key)
+    if (None == join_out_row_list):
+        return ()
+    if (isinstance(join_out_row_list, tuple)):
+        return (join_out_row_list,)
+    return join_out_row_list
+
+def write_joined_rows(
+    out_csv
+    ,in_row
+    ,join_out_row_list
+    ,join_type
+    ,join_out_column_name_list
+):
+    """ Write in_row joined to each of the (projected) File2 rows in join_out_row_list. """
+    if (semi_join_type == join_type):
+        if (0 < len(join_out_row_list)):
+            out_csv.writerow(in_row)
+        return
+    if (anti_join_type == join_type):
+        if (0 == len(join_out_row_list)):
+            out_csv.writerow(in_row)
+        return
+    if (0 == len(join_out_row_list)):
+        if (outer_join_type == join_type):
+            join_out_row = ()
+            if (None != join_out_column_name_list):
+                join_out_row = (None,) * len(join_out_column_name_list)
+            join_out_row_list = (join_out_row,)
+        elif (inner_join_type == join_type):
+            pass
+    for join_out_row in join_out_row_list:
+        out_row = list(in_row)
+        out_row.extend(join_out_row)
+        out_csv.writerow(out_row)
 
 def normalize_column_name(in_column_name):
     out_column_name = in_column_name
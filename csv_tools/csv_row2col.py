@@ -2,7 +2,7 @@
 ##  Subject to an 'MIT' License.  See LICENSE file in top-level directory  ##
 
 help_text = (
-    "CSV-ROW2COL tool version 20170921:20201220\n"
+    "CSV-ROW2COL tool version 20170921:20261018\n"
     "Transpose named rows into columns\n"
     "\n"
     "csv-row2col [OPTIONS] EACH NameColumn GROUP BY GroupColumns [InputFile]\n"
@@ -13,7 +13,10 @@ help_text = (
     "    -N {N}  Read available Name values from the first N rows (default=ALL).\n"
     "    -o {F}  Output file name.\n"
     "    -u      Name first expansion column exactly as value of NameColumn.\n"
+    "    -T {D}  Directory for temporary files (default=system temp directory)\n"
     "    --ignore-case   Ignore character case when comparing values\n"
+    "    --unsorted  Group rows with the same GroupColumns anywhere in the input\n"
+    "    --memory-limit {M}  Approximate memory to use for --unsorted groups (e.g. 512M, 2G)\n"
     "\n"
     "GroupColumns and ExpansionColumns are each a comma-separated list of \n"
     "column names found in the input stream.\n"
@@ -40,16 +43,27 @@ help_text = (
     "\n"
     "Rows are read and grouped sequentially, whenever the group columns change\n"
     "a new row will be written to the output stream.\n"
-    "By default, all rows are read into memory before writing the output\n"
+    "By default, all rows are read before writing the output\n"
     "in order to discover the available \"name\" values.\n"
+    "If the input can be read twice (e.g. it is a file, not a pipe),\n"
+    "then only the names are kept from the first reading, and the rows\n"
+    "are read again to write the output; otherwise all the rows are held in memory.\n"
     "Use the \"-N\" option to read only the first N rows when discovering\n"
-    "the available names.  This is useful for large datasets.\n"
+    "the available names.  This is useful for large datasets which are piped.\n"
+    "\n"
+    "With the --unsorted option, the rows of a group do not need to be adjacent;\n"
+    "groups are collected in memory and written in order of the GroupColumns\n"
+    "(as if the input had been sorted first).  If the --memory-limit option is used\n"
+    "and the groups do not fit, then the sorted partial groups are written\n"
+    "to temporary files, which are merged to produce the output.\n"
+    "In either mode, if a group has more than one row with the same name,\n"
+    "then the values of the last row are used.\n"
 )
 
 import sys
 import csv
 import io
-from itertools import chain
+from itertools import chain, islice
 
 from ._csv_helpers import (
     decode_delimiter_name
@@ -57,6 +71,15 @@ from ._csv_helpers import (
     ,decode_newline
     ,normalize_column_name
 )
+from .base.runfile import (
+    ROW_SAMPLE_COUNT
+    ,estimate_row_capacity
+    ,parse_memory_size
+    ,RunFileSet
+    )
+
+# Rough memory used by the dictionaries which hold a row of an unsorted group
+GROUP_ROW_OVERHEAD = 200
 
 def main(arg_list, stdin, stdout, stderr):
     DEFAULT_BUFFERING=-1
@@ -87,6 +110,12 @@ def main(arg_list, stdin, stdout, stderr):
     in_expand_column_name_list_str = None
     in_expand_column_name_template_str = "{0}_{1}"
     should_not_suffix_first_expand_column = False
+    is_unsorted_input = False
+    memory_limit_str = None
+    memory_limit = None
+    temp_dir_name = None
+    err_msg = None
+    exit_code = 0
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -213,6 +242,21 @@ def main(arg_list, stdin, stdout, stderr):
             should_ignore_case = True
         elif (arg == "-u"):
             should_not_suffix_first_expand_column = True
+        elif (arg == "--unsorted"):
+            is_unsorted_input = True
+        elif (arg == "--memory-limit"
+        ):
+            arg_index += 1
+            if (arg_index < arg_count):
+                arg = arg_list[arg_index]
+                memory_limit_str = arg
+        elif (arg == "-T"
+            or arg == "--temp-dir"
+        ):
+            arg_index += 1
+            if (arg_index < arg_count):
+                arg = arg_list[arg_index]
+                temp_dir_name = arg
         elif (arg == "--column-format"):
             arg_index += 1
             if (arg_index < arg_count):
@@ -278,7 +322,21 @@ def main(arg_list, stdin, stdout, stderr):
     ):
         show_help = True
 
-    if (show_help):
+    try:
+        memory_limit = parse_memory_size(memory_limit_str)
+    except ValueError as exc:
+        err_msg = str(exc)
+    if (None == err_msg
+        and None != memory_limit
+        and not is_unsorted_input
+        ):
+        err_msg = "--memory-limit requires --unsorted"
+
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
         # set global CSV column width
@@ -354,6 +412,10 @@ def main(arg_list, stdin, stdout, stderr):
                   ,in_name_column_name
                   ,in_group_column_name_list
                   ,in_expand_column_name_list
+                  ,is_unsorted_input
+                  ,memory_limit
+                  ,temp_dir_name
+                  ,in_io
                   )
             except BrokenPipeError:
                 # ignore BrokenPipeError; it is raised when a downstream process exits early (head.exe does this)
@@ -366,6 +428,7 @@ def main(arg_list, stdin, stdout, stderr):
                 in_file.close()
             if (None != out_file):
                 out_file.close()
+    return exit_code
 
 def execute(
     in_csv
@@ -378,7 +441,17 @@ def execute(
     ,in_name_column_name
     ,in_group_column_name_list
     ,in_expand_column_name_list
+    ,is_unsorted_input=False
+    ,memory_limit=None
+    ,temp_dir_name=None
+    ,in_io=None
     ):
+    """ Write a row for each group, with columns for each name and expansion column.
+
+        If in_io is the seekable text stream of in_csv, then the names are
+        discovered by reading all the rows once without keeping them,
+        and then the stream is read again from the start.
+    """
     end_row = None
     end_cell = None
     name_dict = dict()
@@ -392,6 +465,13 @@ def execute(
     in_group_column_position_list = list()
     in_row_position = 0
     in_row = end_row
+    # the names can be read in a first pass over the input if we can return to the start
+    in_start_position = None
+    if (None != in_io
+        and None == input_row_count_max
+        and in_io.seekable()
+        ):
+        in_start_position = in_io.tell()
     # find column offsets from header row
     in_header_row = next(in_csv, end_row)
     if (None != in_header_row):
@@ -490,7 +570,20 @@ def execute(
     # Create a dictionary of the distinct values in the name column,
     #  and keep track of the named values for each row:
     in_row_list = []
-    if (in_name_column_position is not None):
+    if (in_name_column_position is not None
+        and None != in_start_position
+        ):
+        # only the names are kept; the rows are read again below
+        for in_row in in_csv:
+            in_name_value = ""
+            if (in_name_column_position < len(in_row)):
+                in_name_value = in_row[in_name_column_position]
+            name_dict[in_name_value] = name_dict.get(in_name_value, 0) + 1
+        in_io.seek(in_start_position)
+        in_csv = csv.reader(in_io, dialect=in_csv.dialect)
+        # skip the header row
+        next(in_csv, end_row)
+    elif (in_name_column_position is not None):
         in_row_count = 0
         in_row = next(in_csv, end_row)
         while (end_row != in_row
@@ -535,10 +628,40 @@ def execute(
     out_row = list(out_column_name_list)
     out_csv.writerow(out_row)
 
+    if (is_unsorted_input):
+        in_csv = chain(in_row_list, in_csv)
+        if (0 < len(in_group_column_position_list)
+            and 0 < len(in_expand_column_position_list)
+            and None != in_name_column_position
+            ):
+            execute_unsorted(
+                in_csv
+                ,out_csv
+                ,out_row_count_max
+                ,should_ignore_case
+                ,in_name_column_position
+                ,in_group_column_position_list
+                ,in_expand_column_position_list
+                ,name_value_list
+                ,memory_limit
+                ,temp_dir_name
+                )
+        return
+
+    # The output row of a group has the group values followed by a slot
+    #  of expansion values for each name.  Find the position of each name's slot once,
+    #  so that the values of each input row are stored directly in the output row.
+    group_column_count = len(in_group_column_position_list)
+    expand_column_count = len(in_expand_column_position_list)
+    name_slot_position_dict = dict()
+    for (name_position, name_value) in enumerate(name_value_list):
+        name_slot_position_dict[name_value] = group_column_count + name_position * expand_column_count
+    empty_out_row = [None] * (group_column_count + len(name_value_list) * expand_column_count)
+
     # Read over the rows keeping track of a current group row,
     #  when the group row doesn't match the input row, start a new group row.
     group_row_key = None
-    group_row_attributes = None
+    group_out_row = None
     out_row_count = 0
     # Add a terminator row in order to ensure we print the last group:
     terminator_row = []
@@ -592,31 +715,188 @@ def execute(
             # Convert to tuple for deep comparison:
             row_key = tuple(row_key)
 
-            out_row = None
             if (row_key != group_row_key):
                 if (group_row_key is not None):
-                    # Create a new ouput row:
-                    out_row = list(group_row_key)
-                    for name_value in name_value_list:
-                        expand_value_list = group_row_attributes.get(name_value,[])
-                        expand_column_position = 0
-                        while (expand_column_position < len(in_expand_column_position_list)):
-                            expand_value = None
-                            if (expand_column_position < len(expand_value_list)):
-                                expand_value = expand_value_list[expand_column_position]
-                            out_row.append(expand_value)
-                            expand_column_position += 1
-                    out_csv.writerow(out_row)
+                    out_csv.writerow(group_out_row)
                     out_row_count += 1
                 # Update our "current" group row information:
                 group_row_key = row_key
-                group_row_attributes = dict()
-            # Remember list of expand values for the current named row:
-            group_row_attributes[in_name_value] = expand_value_list
+                group_out_row = list(empty_out_row)
+                group_out_row[:group_column_count] = row_key
+            # Store the expand values for the current named row in its slot
+            #  (rows with names which were not discovered have no slot):
+            name_slot_position = name_slot_position_dict.get(in_name_value)
+            if (None != name_slot_position):
+                group_out_row[name_slot_position:name_slot_position + expand_column_count] = expand_value_list
             in_row_count += 1
             in_row = next(in_csv, end_row)
 
 
+def execute_unsorted(
+    in_csv
+    ,out_csv
+    ,out_row_count_max
+    ,should_ignore_case
+    ,in_name_column_position
+    ,in_group_column_position_list
+    ,in_expand_column_position_list
+    ,name_value_list
+    ,memory_limit
+    ,temp_dir_name
+    ):
+    """ Pivot rows whose groups are not adjacent, by collecting the groups in a dictionary.
+
+        Groups are written in order of their group values.
+        If there is a memory limit and the groups do not fit, then the sorted partial
+        groups are written to run files, which are merged when all the rows are read.
+    """
+    group_column_count = len(in_group_column_position_list)
+    expand_column_count = len(in_expand_column_position_list)
+    # each group has a slot for each name: a flag ('1' if the group has a row
+    #  with that name), followed by the expand values.
+    name_slot_width = 1 + expand_column_count
+    name_slot_position_dict = dict()
+    for (name_position, name_value) in enumerate(name_value_list):
+        name_slot_position_dict[name_value] = name_position * name_slot_width
+    empty_slot_list = [''] * (len(name_value_list) * name_slot_width)
+
+    def get_group_row_key(in_row):
+        # missing values are empty, so that keys can be sorted and written to run files
+        in_row_length = len(in_row)
+        group_row_key = tuple([
+            in_row[in_column_position]
+                if (None != in_column_position and in_column_position < in_row_length)
+                else ''
+            for in_column_position in in_group_column_position_list
+            ])
+        if (should_ignore_case):
+            group_row_key = tuple([cell_value.upper() for cell_value in group_row_key])
+        return group_row_key
+
+    def get_expand_value_list(in_row):
+        in_row_length = len(in_row)
+        return [
+            in_row[in_column_position]
+                if (None != in_column_position and in_column_position < in_row_length)
+                else None
+            for in_column_position in in_expand_column_position_list
+            ]
+
+    def get_name_value(in_row):
+        if (in_name_column_position < len(in_row)):
+            return in_row[in_name_column_position]
+        return ""
+
+    def get_run_row_key(group_run_row):
+        return group_run_row[:group_column_count]
+
+    def get_group_row_overhead(in_row):
+        return GROUP_ROW_OVERHEAD
+
+    # if there is a memory limit, use the first rows to estimate
+    #  how many rows of groups fit in memory.
+    group_row_count_max = None
+    if (None != memory_limit):
+        in_row_sample = list(islice(in_csv, ROW_SAMPLE_COUNT))
+        group_row_count_max = estimate_row_capacity(
+            [
+                (get_group_row_key(in_row), get_expand_value_list(in_row))
+                for in_row in in_row_sample
+            ]
+            ,memory_limit
+            ,get_group_row_overhead
+            )
+        in_csv = chain(in_row_sample, in_csv)
+
+    run_set = RunFileSet(get_run_row_key, temp_dir_name)
+    try:
+        # group key -> list of name slots
+        group_row_dict = dict()
+        group_row_count = 0
+        for in_row in in_csv:
+            group_row_key = get_group_row_key(in_row)
+            group_slot_list = group_row_dict.get(group_row_key)
+            if (None == group_slot_list):
+                group_slot_list = list(empty_slot_list)
+                group_row_dict[group_row_key] = group_slot_list
+            # rows with names which were not discovered have no slot
+            name_slot_position = name_slot_position_dict.get(get_name_value(in_row))
+            if (None != name_slot_position):
+                group_slot_list[name_slot_position] = '1'
+                group_slot_list[name_slot_position + 1:name_slot_position + name_slot_width] = (
+                    get_expand_value_list(in_row)
+                    )
+            group_row_count += 1
+            if (None != group_row_count_max
+                and group_row_count_max < group_row_count
+                ):
+                run_set.add_run(iter_sorted_group_run_rows(group_row_dict))
+                group_row_dict.clear()
+                group_row_count = 0
+
+        group_run_row_iter = iter_sorted_group_run_rows(group_row_dict)
+        if (0 < len(run_set)):
+            # the groups still in memory are merged after the spilled runs
+            group_run_row_iter = run_set.merge(group_run_row_iter)
+        out_row_count = 0
+        for out_row in iter_merged_group_rows(
+            group_run_row_iter
+            ,group_column_count
+            ,expand_column_count
+            ):
+            if (None != out_row_count_max
+                and out_row_count >= out_row_count_max
+                ):
+                break
+            out_csv.writerow(out_row)
+            out_row_count += 1
+    finally:
+        run_set.close()
+
+def iter_sorted_group_run_rows(group_row_dict):
+    """ Yield a run row for each group, in order of the group values.
+
+        A run row has the group values, then for each name value:
+        a flag ('1' if the group has a row with that name) followed by the expand values.
+    """
+    for group_row_key in sorted(group_row_dict.keys()):
+        group_run_row = list(group_row_key)
+        group_run_row.extend(group_row_dict[group_row_key])
+        yield group_run_row
+
+def iter_merged_group_rows(group_run_row_iter, group_column_count, expand_column_count):
+    """ Yield an output row for each group from sorted run rows.
+
+        Run rows of the same group are combined;
+        the values of a later run row replace those of an earlier one.
+    """
+    name_slot_width = 1 + expand_column_count
+    group_run_row = None
+    for next_group_run_row in group_run_row_iter:
+        if (None != group_run_row
+            and next_group_run_row[:group_column_count] == group_run_row[:group_column_count]
+            ):
+            for name_slot_position in range(group_column_count, len(group_run_row), name_slot_width):
+                if ('' != next_group_run_row[name_slot_position]):
+                    group_run_row[name_slot_position:name_slot_position + name_slot_width] = (
+                        next_group_run_row[name_slot_position:name_slot_position + name_slot_width]
+                        )
+        else:
+            if (None != group_run_row):
+                yield get_group_out_row(group_run_row, group_column_count, expand_column_count)
+            group_run_row = list(next_group_run_row)
+    if (None != group_run_row):
+        yield get_group_out_row(group_run_row, group_column_count, expand_column_count)
+
+def get_group_out_row(group_run_row, group_column_count, expand_column_count):
+    """ Remove the name flags from a run row. """
+    out_row = group_run_row[:group_column_count]
+    name_slot_width = 1 + expand_column_count
+    for name_slot_position in range(group_column_count, len(group_run_row), name_slot_width):
+        out_row.extend(group_run_row[name_slot_position + 1:name_slot_position + name_slot_width])
+    return out_row
+
+
 def console_main():
     main(sys.argv, sys.stdin, sys.stdout, sys.stderr)
 
@@ -2,7 +2,7 @@
 ##  Subject to an 'MIT' License.  See LICENSE file in top-level directory  ##
 
 help_text = (
-    "CSV-ROWCALC tool version 20170217:20201215\n"
+    "CSV-ROWCALC tool version 20170217:20261018\n"
     "Executes a custom python script on each row of a CSV file\n"
     "\n"
     "csv-rowcalc [OPTIONS] ScriptFile [CsvInputFile]\n"
@@ -16,6 +16,9 @@ help_text = (
     "    -o {F}  Output file name\n"
     "    -X      Interpret the ScriptFile parameter as a Python statement (not a file name)\n"
     "    --row-var    {S}   Name of row map variable (default='row')\n"
+    "    --exec-each-row    Execute the script for each row (do not compile it into a function)\n"
+    "    --batch {N}  Execute the script for blocks of N rows, as columns (see below)\n"
+    "    --jobs {N}  Number of worker processes which execute the script (default=1)\n"
     "\n"
     "ScriptFile should be a Python script.  It will be executed once per row\n"
     "in a context with some predefined variables, including one called 'row'\n"
@@ -27,18 +30,80 @@ help_text = (
     "\n"
     "    row['GEOID'] = row['GEOID'].rjust(5,'0')\n"
     "\n"
+    "The script is compiled once as the body of a function, which is called\n"
+    "for each row with the variables 'row' and 'row_offset' (the number of the row).\n"
+    "Variables which are set by the script are local to each row.\n"
+    "Scripts which use 'global' statements or the functions globals, locals, vars,\n"
+    "dir, exec or eval, or which set a variable with the name of a builtin or\n"
+    "of a variable set by an include file, are executed for each row instead\n"
+    "(with a new copy of the variables), which is slower.\n"
+    "\n"
+    "With the --batch option, the script is executed once for each block\n"
+    "of N rows.  Instead of 'row', it has a variable called 'columns', which is\n"
+    "a map of column names to lists of the cell values in the block\n"
+    "(or to NumPy arrays of objects, if NumPy can be imported), and the variables\n"
+    "'row_offset' (the number of the first row in the block) and 'row_count'.\n"
+    "The script may set new lists (or arrays) of row_count values into the map.\n"
+    "Rows may be deleted by setting the variable 'row_mask' to a list of\n"
+    "row_count booleans; only the rows with a true value are written.\n"
+    "For example, to double the 'amount' column and drop the rows without one:\n"
+    "\n"
+    "    amounts = columns['amount']\n"
+    "    row_mask = [('' != a) for a in amounts]\n"
+    "    columns['amount'] = [(2*float(a) if '' != a else None) for a in amounts]\n"
+    "\n"
+    "All the rows of a block are given to the script, even if the output\n"
+    "row count (-n) is reached in the middle of the block.\n"
+    "\n"
+    "If --jobs is more than 1 (or ALL for one job per CPU), blocks of rows are\n"
+    "sent to worker processes, which each load the include files and the script.\n"
+    "The rows are written in the same order, with the same row_offset values,\n"
+    "as by a single process; but since each process has its own variables,\n"
+    "a script which keeps state from one row to the next (e.g. a counter\n"
+    "in an include file) should set the variable 'rowcalc_serial' (in the\n"
+    "script or an include file) to be executed in a single process.\n"
 )
 
 import sys
 import csv
 import io
 import ast
+import builtins
+from itertools import chain, compress, islice, repeat
 
 from ._csv_helpers import (
     decode_delimiter_name
     ,decode_charset_name
     ,decode_newline
     )
+from .base.csvblock import (
+    iter_record_blocks
+    )
+from .base.parallel import (
+    create_pool
+    ,imap_ordered
+    ,lookup_job_count
+    )
+# NumPy is optional, and only used by --batch scripts (see import_numpy())
+numpy = None
+is_numpy_import_tried = False
+
+# Name of the function compiled from a script
+SCRIPT_FUNCTION_NAME = '_csv_rowcalc_script'
+
+# Names of the variables of a script which is executed for blocks of rows (--batch)
+BATCH_COLUMNS_VAR_NAME = 'columns'
+BATCH_ROW_COUNT_VAR_NAME = 'row_count'
+BATCH_ROW_MASK_VAR_NAME = 'row_mask'
+
+# A script which sets this variable is not run in worker processes (--jobs)
+SERIAL_VAR_NAME = 'rowcalc_serial'
+
+# Number of rows sent to a worker process at a time (with --jobs)
+DEFAULT_BLOCK_ROW_COUNT = 10000
+
+# Functions which see different variables in a function than at the top level of a script
+SCRIPT_SCOPE_FUNCTION_NAME_SET = frozenset(['dir', 'eval', 'exec', 'globals', 'locals', 'vars'])
 
 def main(arg_list, stdin, stdout, stderr):
     DEFAULT_BUFFERING = -1
@@ -70,6 +135,11 @@ def main(arg_list, stdin, stdout, stderr):
     extra_column_names_string = None
     row_var_name = 'row'
     row_offset_var_name = 'row_offset'
+    err_msg = None
+    exit_code = 0
+    should_exec_each_row = False
+    batch_row_count = None
+    job_count = 1
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -199,6 +269,26 @@ def main(arg_list, stdin, stdout, stderr):
                 arg_index += 1
                 arg = arg_list[arg_index]
                 row_var_name = arg
+        elif (arg == "--exec-each-row"):
+            should_exec_each_row = True
+        elif (arg == "--batch"):
+            arg_index += 1
+            if (arg_index < arg_count):
+                arg = arg_list[arg_index]
+                try:
+                    batch_row_count = int(arg)
+                except ValueError:
+                    batch_row_count = 0
+                if (0 >= batch_row_count):
+                    err_msg = "Invalid batch row count: " + arg
+        elif (arg == "--jobs"):
+            arg_index += 1
+            if (arg_index < arg_count):
+                arg = arg_list[arg_index]
+                try:
+                    job_count = lookup_job_count(arg)
+                except ValueError:
+                    err_msg = "Invalid job count: " + arg
         elif (arg == "-a"
           or arg == "--append-columns"
         ):
@@ -233,26 +323,26 @@ def main(arg_list, stdin, stdout, stderr):
         script_content = script_file_name + '\n'
         script_file_name = None
 
-    if (show_help):
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
-        script_globals = dict()
-        include_script_content = None
-        for include_script_file_name in include_script_file_name_list:
-            include_script_file_content = read_file_content(include_script_file_name)
-            include_script_code = compile(include_script_file_content, include_script_file_name, 'exec')
-            exec(include_script_code, script_globals)
-
         if (None != script_file_name
             and None == script_content
         ):
             script_content = read_file_content(script_file_name)
-        
-        if (None == script_content):
-            script_content = include_script_content
-        elif (None != include_script_content):
-            script_content = include_script_content + "\n" + script_content
-        script_compiled_code = compile_script_content(script_content, script_file_name)
+        (script_compiled_code, script_globals, script_function) = load_script(
+            script_content
+            ,script_file_name
+            ,include_script_file_name_list
+            ,should_exec_each_row
+            ,row_var_name
+            ,row_offset_var_name
+            ,batch_row_count
+            )
 
         extra_column_name_list = []
         if (None != extra_column_names_string):
@@ -332,7 +422,19 @@ def main(arg_list, stdin, stdout, stderr):
                     ,extra_column_name_list
                     ,row_var_name
                     ,row_offset_var_name
-                    )
+                    ,script_function
+                    ,batch_row_count
+                    ,job_count
+                    ,in_io
+                    ,out_io
+                    ,(
+                        script_content
+                        ,script_file_name
+                        ,include_script_file_name_list
+                        ,should_exec_each_row
+                    ))
+        except BatchShapeError as exc:
+            err_msg = str(exc)
         except BrokenPipeError:
             pass
         finally:
@@ -340,6 +442,11 @@ def main(arg_list, stdin, stdout, stderr):
                 in_file.close()
             if (None != out_file):
                 out_file.close()
+        if (None != err_msg):
+            err_io.write(err_msg)
+            err_io.write("\n")
+            exit_code = 1
+    return exit_code
 
 def execute(
     in_csv
@@ -352,7 +459,24 @@ def execute(
     ,extra_column_name_list
     ,row_var_name
     ,row_offset_var_name
+    ,script_function=None
+    ,batch_row_count=None
+    ,job_count=1
+    ,in_io=None
+    ,out_io=None
+    ,script_source=None
 ):
+    """ Run the script on each row and write the rows.
+
+        If there is a script_function (see compile_script_function()),
+        then it is called for each row instead of executing the compiled script.
+        If there is a batch_row_count, then the script is run on blocks of rows
+        (see execute_batches()).
+        If job_count is more than 1, then in_io and out_io are the text streams
+        of in_csv and out_csv, and script_source is a tuple of
+        (script_content, script_file_name, include_script_file_name_list, should_exec_each_row)
+        which is loaded by each worker process.
+    """
     end_row = None
     in_header_row = next(in_csv, end_row)
     out_header_row = None
@@ -365,56 +489,481 @@ def execute(
     in_row_count = 0
 
     # skip rows before in_row_start_offset
-    in_row = next(in_csv, end_row)
-    while (end_row != in_row
-        and in_row_count < in_row_start_offset
-        and (None == in_row_count_max or in_row_count < in_row_count_max)
-    ):
+    #  (without reading ahead, so that in_io is at the next row)
+    in_row_skip_count = in_row_start_offset
+    if (None != in_row_count_max):
+        in_row_skip_count = min(in_row_skip_count, in_row_count_max)
+    for in_row in islice(in_csv, max(0, in_row_skip_count)):
         in_row_count += 1
-        in_row = next(in_csv, end_row)
 
-    out_row_count = 0
-    while (end_row != in_row
-        and (None == in_row_count_max or in_row_count < in_row_count_max)
-        and (None == out_row_count_max or out_row_count < out_row_count_max)
+    if (end_row == in_header_row):
+        pass
+    elif (1 < job_count
+        and None != script_source
+        and not is_serial_script(script_source[0], script_globals)
         ):
+        execute_parallel(
+            in_io
+            ,in_csv.dialect
+            ,out_io
+            ,out_csv.dialect
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count
+            ,in_row_count_max
+            ,out_row_count_max
+            ,row_var_name
+            ,row_offset_var_name
+            ,batch_row_count
+            ,job_count
+            ,script_source
+            )
+    elif (None != batch_row_count):
+        execute_batches(
+            in_csv
+            ,out_csv
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count
+            ,in_row_count_max
+            ,out_row_count_max
+            ,script_compiled_code
+            ,script_globals
+            ,row_offset_var_name
+            ,script_function
+            ,batch_row_count
+            )
+    else:
+        execute_rows(
+            in_csv
+            ,out_csv
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count
+            ,in_row_count_max
+            ,out_row_count_max
+            ,script_compiled_code
+            ,script_globals
+            ,row_var_name
+            ,row_offset_var_name
+            ,script_function
+            )
+
+def execute_rows(
+    in_csv
+    ,out_csv
+    ,in_header_row
+    ,out_header_row
+    ,in_row_count
+    ,in_row_count_max
+    ,out_row_count_max
+    ,script_compiled_code
+    ,script_globals
+    ,row_var_name
+    ,row_offset_var_name
+    ,script_function
+):
+    """ Run the script on each row, as a map of column names to values.
+
+        in_row_count is the number of rows which have been read (and skipped).
+    """
+    default_cell_value = None
+    in_column_count = len(in_header_row)
+    extra_row_dict = dict.fromkeys(out_header_row[in_column_count:], default_cell_value)
+    out_row_count = 0
+    for in_row in in_csv:
+        if ((None != in_row_count_max and in_row_count >= in_row_count_max)
+            or (None != out_row_count_max and out_row_count >= out_row_count_max)
+            ):
+            break
         # make a dictionary for the row
-        # we don't use a csv.DictReader since we want more flexiblity here
-        row_dict = dict()
-        column_position = 0
-        while (column_position < len(in_row)
-            and column_position < len(in_header_row)
-        ):
-            column_name = in_header_row[column_position]
-            row_dict[column_name] = in_row[column_position]
-            column_position += 1
-        # add default values for missing and extra columns
-        default_cell_value = None
-        while (column_position < len(out_header_row)):
-            column_name = out_header_row[column_position]
-            row_dict[column_name] = default_cell_value
-            column_position += 1
-
-        script_variables = dict(script_globals)
-        script_variables[row_var_name] = row_dict
-        script_variables[row_offset_var_name] = in_row_count
-        exec(script_compiled_code, script_variables)
+        # we don't use a csv.DictReader since we want more flexiblity here;
+        # missing and extra columns have default values
+        if (len(in_row) >= in_column_count):
+            row_dict = dict(zip(in_header_row, in_row))
+            if (0 < len(extra_row_dict)):
+                row_dict.update(extra_row_dict)
+        else:
+            row_dict = dict(zip(
+                out_header_row
+                ,chain(in_row, repeat(default_cell_value))
+                ))
+
+        if (None != script_function):
+            row_dict = script_function(row_dict, in_row_count)
+        else:
+            script_variables = dict(script_globals)
+            script_variables[row_var_name] = row_dict
+            script_variables[row_offset_var_name] = in_row_count
+            exec(script_compiled_code, script_variables)
+            row_dict = script_variables[row_var_name]
 
         # check if the row variable has been set to None
-        row_dict = script_variables[row_var_name]
         if (None != row_dict):
-            out_row = list()
-            column_position = 0
-            while (column_position < len(out_header_row)):
-                column_name = out_header_row[column_position]
-                cell_value = row_dict.get(column_name, default_cell_value)
-                out_row.append(cell_value)
-                column_position += 1
+            # (missing columns get the default value, None)
+            out_row = list(map(row_dict.get, out_header_row))
             out_csv.writerow(out_row)
             out_row_count += 1
 
         in_row_count += 1
-        in_row = next(in_csv, end_row)
+
+def execute_parallel(
+    in_io
+    ,in_dialect
+    ,out_io
+    ,out_dialect
+    ,in_header_row
+    ,out_header_row
+    ,in_row_count
+    ,in_row_count_max
+    ,out_row_count_max
+    ,row_var_name
+    ,row_offset_var_name
+    ,batch_row_count
+    ,job_count
+    ,script_source
+):
+    """ Run the script on blocks of rows in worker processes; write the results in order.
+
+        in_io must be positioned after the skipped rows (in_row_count).
+        Each worker loads the script, and runs it on the rows of a block
+        as they would be run by a single process (with the same row_offset values).
+    """
+    block_row_count = DEFAULT_BLOCK_ROW_COUNT
+    if (None != batch_row_count):
+        # blocks are made of whole batches, so the batches are the same as in a single process
+        block_row_count = batch_row_count * max(1, DEFAULT_BLOCK_ROW_COUNT // batch_row_count)
+
+    def iter_offset_blocks():
+        block_row_offset = in_row_count
+        for (record_count, in_line_list) in iter_record_blocks(in_io, block_row_count):
+            if (None != in_row_count_max
+                and block_row_offset >= in_row_count_max
+                ):
+                break
+            yield (block_row_offset, in_line_list)
+            block_row_offset += record_count
+
+    pool = create_pool(
+        job_count
+        ,init_rowcalc_worker
+        ,(
+            script_source
+            ,row_var_name
+            ,row_offset_var_name
+            ,batch_row_count
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count_max
+            ,in_dialect.delimiter
+            ,in_dialect.lineterminator
+            ,out_dialect.delimiter
+            ,out_dialect.lineterminator
+        ))
+    try:
+        out_row_count = 0
+        for out_row_text_list in imap_ordered(pool, run_block, iter_offset_blocks(), 2 * job_count):
+            if (None != out_row_count_max
+                and out_row_count + len(out_row_text_list) >= out_row_count_max
+                ):
+                out_io.write(''.join(out_row_text_list[:out_row_count_max - out_row_count]))
+                break
+            out_io.write(''.join(out_row_text_list))
+            out_row_count += len(out_row_text_list)
+        else:
+            pool.close()
+            pool.join()
+    finally:
+        pool.terminate()
+
+# state of a worker process used by execute_parallel()
+rowcalc_worker_state = None
+
+def init_rowcalc_worker(
+    script_source
+    ,row_var_name
+    ,row_offset_var_name
+    ,batch_row_count
+    ,in_header_row
+    ,out_header_row
+    ,in_row_count_max
+    ,input_delimiter
+    ,input_row_terminator
+    ,output_delimiter
+    ,output_row_terminator
+):
+    global rowcalc_worker_state
+    (
+        script_content
+        ,script_file_name
+        ,include_script_file_name_list
+        ,should_exec_each_row
+    ) = script_source
+    (script_compiled_code, script_globals, script_function) = load_script(
+        script_content
+        ,script_file_name
+        ,include_script_file_name_list
+        ,should_exec_each_row
+        ,row_var_name
+        ,row_offset_var_name
+        ,batch_row_count
+        )
+    rowcalc_worker_state = (
+        script_compiled_code
+        ,script_globals
+        ,script_function
+        ,row_var_name
+        ,row_offset_var_name
+        ,batch_row_count
+        ,in_header_row
+        ,out_header_row
+        ,in_row_count_max
+        ,input_delimiter
+        ,input_row_terminator
+        ,output_delimiter
+        ,output_row_terminator
+        )
+
+class RowTextList(list):
+    """ A list of the lines written by a csv.writer (one for each row). """
+    write = list.append
+
+def run_block(offset_block):
+    """ Run the script on a block of csv text; return a list of the output row texts. """
+    (
+        script_compiled_code
+        ,script_globals
+        ,script_function
+        ,row_var_name
+        ,row_offset_var_name
+        ,batch_row_count
+        ,in_header_row
+        ,out_header_row
+        ,in_row_count_max
+        ,input_delimiter
+        ,input_row_terminator
+        ,output_delimiter
+        ,output_row_terminator
+    ) = rowcalc_worker_state
+    (in_row_count, in_line_list) = offset_block
+    in_csv = csv.reader(
+        in_line_list
+        ,delimiter=input_delimiter
+        ,lineterminator=input_row_terminator
+        )
+    out_row_text_list = RowTextList()
+    out_csv = csv.writer(
+        out_row_text_list
+        ,delimiter=output_delimiter
+        ,lineterminator=output_row_terminator
+        )
+    if (None != batch_row_count):
+        execute_batches(
+            in_csv
+            ,out_csv
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count
+            ,in_row_count_max
+            ,None
+            ,script_compiled_code
+            ,script_globals
+            ,row_offset_var_name
+            ,script_function
+            ,batch_row_count
+            )
+    else:
+        execute_rows(
+            in_csv
+            ,out_csv
+            ,in_header_row
+            ,out_header_row
+            ,in_row_count
+            ,in_row_count_max
+            ,None
+            ,script_compiled_code
+            ,script_globals
+            ,row_var_name
+            ,row_offset_var_name
+            ,script_function
+            )
+    return list(out_row_text_list)
+
+class BatchShapeError(ValueError):
+    """ A --batch script set a column (or row_mask) with the wrong number of values. """
+    pass
+
+def import_numpy():
+    """ Import NumPy the first time it is needed, so that other runs do not pay for it.
+
+        Returns None if NumPy is not installed.
+    """
+    global numpy
+    global is_numpy_import_tried
+    if (not is_numpy_import_tried):
+        is_numpy_import_tried = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+def execute_batches(
+    in_csv
+    ,out_csv
+    ,in_header_row
+    ,out_header_row
+    ,in_row_count
+    ,in_row_count_max
+    ,out_row_count_max
+    ,script_compiled_code
+    ,script_globals
+    ,row_offset_var_name
+    ,script_function
+    ,batch_row_count
+):
+    """ Run the script on blocks of rows, as a map of column names to lists of values.
+
+        in_row_count is the number of rows which have been read (and skipped).
+    """
+    import_numpy()
+    default_cell_value = None
+    in_column_count = len(in_header_row)
+    out_row_count = 0
+    while ((None == in_row_count_max or in_row_count < in_row_count_max)
+        and (None == out_row_count_max or out_row_count < out_row_count_max)
+        ):
+        block_row_count_max = batch_row_count
+        if (None != in_row_count_max):
+            block_row_count_max = min(batch_row_count, in_row_count_max - in_row_count)
+        in_row_list = list(islice(in_csv, block_row_count_max))
+        row_count = len(in_row_list)
+        if (0 == row_count):
+            break
+
+        # make a list of values for each input column;
+        #  missing and extra columns have default values
+        in_row_list = [
+            in_row if (len(in_row) == in_column_count)
+                else list(islice(chain(in_row, repeat(default_cell_value)), in_column_count))
+            for in_row in in_row_list
+            ]
+        column_dict = dict(zip(in_header_row, map(list, zip(*in_row_list))))
+        for column_name in out_header_row[in_column_count:]:
+            column_dict[column_name] = [default_cell_value] * row_count
+        if (None != numpy):
+            for column_name in column_dict:
+                column_dict[column_name] = numpy.array(column_dict[column_name], dtype=object)
+
+        row_mask = None
+        if (None != script_function):
+            (column_dict, row_mask) = script_function(column_dict, in_row_count, row_count, row_mask)
+        else:
+            script_variables = dict(script_globals)
+            script_variables[BATCH_COLUMNS_VAR_NAME] = column_dict
+            script_variables[row_offset_var_name] = in_row_count
+            script_variables[BATCH_ROW_COUNT_VAR_NAME] = row_count
+            script_variables[BATCH_ROW_MASK_VAR_NAME] = row_mask
+            exec(script_compiled_code, script_variables)
+            column_dict = script_variables[BATCH_COLUMNS_VAR_NAME]
+            row_mask = script_variables[BATCH_ROW_MASK_VAR_NAME]
+
+        # (a column may be an array, which can't be compared to None with ==)
+        out_column_list = []
+        for column_name in out_header_row:
+            column_value_list = column_dict.get(column_name)
+            if (None is column_value_list):
+                column_value_list = [default_cell_value] * row_count
+            elif (len(column_value_list) != row_count):
+                raise BatchShapeError("Column {0} has {1} values for a block of {2} rows".format(
+                    column_name
+                    ,len(column_value_list)
+                    ,row_count
+                    ))
+            elif (None != numpy
+                and isinstance(column_value_list, numpy.ndarray)
+                ):
+                # write python numbers, not the repr() of numpy numbers
+                column_value_list = column_value_list.tolist()
+            out_column_list.append(column_value_list)
+        out_row_iter = zip(*out_column_list)
+        if (None is not row_mask):
+            if (len(row_mask) != row_count):
+                raise BatchShapeError("{0} has {1} values for a block of {2} rows".format(
+                    BATCH_ROW_MASK_VAR_NAME
+                    ,len(row_mask)
+                    ,row_count
+                    ))
+            out_row_iter = compress(out_row_iter, row_mask)
+        if (None != out_row_count_max):
+            out_row_iter = islice(out_row_iter, out_row_count_max - out_row_count)
+        for out_row in out_row_iter:
+            out_csv.writerow(out_row)
+            out_row_count += 1
+        in_row_count += row_count
+
+def load_script(
+    script_content
+    ,script_file_name
+    ,include_script_file_name_list
+    ,should_exec_each_row
+    ,row_var_name
+    ,row_offset_var_name
+    ,batch_row_count
+    ):
+    """ Execute the include files and compile the script.
+
+        Returns (script_compiled_code, script_globals, script_function);
+        script_function is None if the script must be executed for each row (or batch).
+    """
+    script_globals = dict()
+    for include_script_file_name in include_script_file_name_list:
+        include_script_file_content = read_file_content(include_script_file_name)
+        include_script_code = compile(include_script_file_content, include_script_file_name, 'exec')
+        exec(include_script_code, script_globals)
+
+    script_compiled_code = compile_script_content(script_content, script_file_name)
+    script_function = None
+    if (None != script_compiled_code
+        and not should_exec_each_row
+        and None != batch_row_count
+        ):
+        script_function = compile_script_function(
+            script_content
+            ,script_file_name
+            ,script_globals
+            ,[
+                BATCH_COLUMNS_VAR_NAME
+                ,row_offset_var_name
+                ,BATCH_ROW_COUNT_VAR_NAME
+                ,BATCH_ROW_MASK_VAR_NAME
+            ]
+            ,[BATCH_COLUMNS_VAR_NAME, BATCH_ROW_MASK_VAR_NAME]
+            )
+    elif (None != script_compiled_code
+        and not should_exec_each_row
+        ):
+        script_function = compile_script_function(
+            script_content
+            ,script_file_name
+            ,script_globals
+            ,[row_var_name, row_offset_var_name]
+            ,[row_var_name]
+            )
+    return (script_compiled_code, script_globals, script_function)
+
+def is_serial_script(script_content, script_globals):
+    """ Check if a script (or an include file) sets the variable which keeps it in one process. """
+    if (script_globals.get(SERIAL_VAR_NAME)):
+        return True
+    script_ast = parse_script_ast_from_string(script_content, None)
+    for node in ast.walk(script_ast):
+        if (isinstance(node, ast.Name)
+            and SERIAL_VAR_NAME == node.id
+            and isinstance(node.ctx, ast.Store)
+            ):
+            return True
+    return False
 
 def read_file_content(in_file_name):
     read_text_io_mode = 'rt'
@@ -454,6 +1003,75 @@ def compile_script_content(
         )
     return script_compiled_code
 
+def compile_script_function(
+    script_content
+    ,script_file_name
+    ,script_globals
+    ,argument_name_list
+    ,result_name_list
+    ):
+    """ Compile a script as the body of a function, e.g. f(row, row_offset) -> row
+
+        The arguments are the initial values of the variables named by argument_name_list,
+        the result is the final value of the variable in result_name_list
+        (or a tuple of the values, if there is more than one).
+        The function is compiled once, and its variables are local to each call,
+        which is much faster than executing the script with a new copy of
+        the global variables for each row.
+        Returns None if the script might behave differently in a function.
+    """
+    if (None == script_content):
+        return None
+    script_ast = parse_script_ast_from_string(script_content, script_file_name)
+    for node in ast.walk(script_ast):
+        if (isinstance(node, ast.Global)
+            or (isinstance(node, ast.Name) and node.id in SCRIPT_SCOPE_FUNCTION_NAME_SET)
+            ):
+            return None
+    result_ast_list = [
+        ast.Name(id=result_name, ctx=ast.Load())
+        for result_name in result_name_list
+        ]
+    if (1 == len(result_ast_list)):
+        return_result_ast = ast.Return(value=result_ast_list[0])
+    else:
+        return_result_ast = ast.Return(value=ast.Tuple(elts=result_ast_list, ctx=ast.Load()))
+    function_ast = ast.FunctionDef(
+        name=SCRIPT_FUNCTION_NAME
+        ,args=ast.arguments(
+            posonlyargs=[]
+            ,args=[ast.arg(arg=argument_name) for argument_name in argument_name_list]
+            ,kwonlyargs=[]
+            ,kw_defaults=[]
+            ,defaults=[]
+            )
+        ,body=script_ast.body + [return_result_ast]
+        ,decorator_list=[]
+        )
+    module_ast = ast.fix_missing_locations(ast.Module(body=[function_ast], type_ignores=[]))
+    script_source_name = '<string>'
+    if (None != script_file_name):
+        script_source_name = script_file_name
+    try:
+        module_code = compile(module_ast, script_source_name, 'exec')
+    except SyntaxError:
+        # e.g. 'from module import *' is only allowed at the top level
+        return None
+    function_namespace = dict()
+    exec(module_code, script_globals, function_namespace)
+    script_function = function_namespace[SCRIPT_FUNCTION_NAME]
+
+    # A variable which is read before it is set gets the global value in a script,
+    #  but is an error in a function; so the script must not set global names.
+    function_code = script_function.__code__
+    local_name_set = set(function_code.co_varnames) | set(function_code.co_cellvars)
+    local_name_set.difference_update(argument_name_list)
+    if (not local_name_set.isdisjoint(script_globals)
+        or not local_name_set.isdisjoint(dir(builtins))
+        ):
+        return None
+    return script_function
+
 # Notice this is the exact same code as the compile_script_content() function
 def parse_script_ast_from_string(
     script_content
@@ -5,32 +5,83 @@
 ## python 2 does not work due mostly to issues with csv and io modules with unicode data
 
 help_text = (
-    "CSV-SORT tool version 20170919\n"
+    "CSV-SORT tool version 20170919:20261018\n"
     "Sort rows in a CSV file\n"
     "\n"
     "csv-sort [OPTIONS] ColumnList [InputFile]\n"
     "\n"
     "OPTIONS\n"
-    "    -N {N}  Maximum number of rows to sort at a time (default=ALL)\n"
+    "    -N {N}  Maximum number of rows to sort in memory at a time (default=ALL)\n"
     "    -n {N}  Maximum number of rows to write (default=ALL)\n"
     "    -o {F}  Output file name\n"
+    "    -T {D}  Directory for temporary files (default=system temp directory)\n"
+    "    --jobs {N}  Number of worker processes used to sort blocks of rows (default=1)\n"
+    "    --memory-limit {M}  Approximate memory to use for sorting (e.g. 512M, 2G)\n"
     "\n"
     "ColumnList is a comma-separated list of column names to be used\n"
-    "as sort keys.\n"
+    "as sort keys.  Each column name may be followed by ':' separated options:\n"
     "\n"
-    "Rows are sorted in memory.\n"
-    "Memory usage can be controlled (somewhat) with the -N option.\n"
+    "    num     Compare values as numbers (int or float)\n"
+    "    iso     Compare values as ISO-8601 dates/times (e.g. 2017-09-19T12:00:00)\n"
+    "    ci      Compare text values ignoring character case\n"
+    "    desc    Sort in descending order (asc is the default)\n"
+    "\n"
+    "For example:  amount:num:desc,date:iso,name:ci\n"
+    "Empty values sort before other values; values which cannot be\n"
+    "interpreted as the requested type sort after other values.\n"
+    "This placement is the same for desc keys, only the other values are reversed.\n"
+    "\n"
+    "Rows are sorted in memory unless the -N or --memory-limit options are used.\n"
+    "When more rows are read than fit in memory, sorted \"runs\" of rows\n"
+    "are written to temporary files and then merged to produce the output.\n"
+    "The number of rows in each run is estimated from the memory limit.\n"
+    "If the -n option is used, only the first N sorted rows are kept in memory.\n"
+    "\n"
+    "If --jobs is more than 1 (or ALL for one job per CPU), the input is split\n"
+    "into blocks of rows which are parsed and sorted by worker processes,\n"
+    "the sorted blocks are then merged.  The output is the same as\n"
+    "for a single process.\n"
 )
 
 import sys
 import csv
 import io
+import re
+import datetime
+import heapq
+import shutil
+import tempfile
+from itertools import chain, islice
+from operator import itemgetter
 
 from ._csv_helpers import (
     decode_delimiter_name
     ,decode_charset_name
     ,decode_newline
     )
+from .base.csvblock import (
+    iter_record_blocks
+    ,iter_record_lines
+    )
+from .base.parallel import (
+    create_pool
+    ,imap_ordered
+    ,lookup_job_count
+    )
+from .base.runfile import (
+    ROW_SAMPLE_COUNT
+    ,estimate_object_size
+    ,estimate_row_capacity
+    ,open_run_file
+    ,parse_memory_size
+    ,RunFileSet
+    ,write_named_run_file
+    )
+
+# Number of rows sorted by each worker process when no limit is given.
+DEFAULT_BLOCK_ROW_COUNT = 100000
+# Rough ratio of the memory used by parsed rows to the size of their text.
+PARSED_ROW_SIZE_FACTOR = 10
 
     
 def main(arg_list, stdin, stdout, stderr):
@@ -55,6 +106,11 @@ def main(arg_list, stdin, stdout, stderr):
     output_row_count_max = None
     in_key_column_name_list_str = None
     in_key_column_name_list = None
+    memory_limit_str = None
+    temp_dir_name = None
+    job_count_str = None
+    err_msg = None
+    exit_code = 0
     # [20160916 [db] I avoided using argparse in order to retain some flexibility for command syntax]
     arg_count = len(arg_list)
     arg_index = 1
@@ -155,7 +211,12 @@ def main(arg_list, stdin, stdout, stderr):
                 if ('ALL' == arg.upper()):
                     input_row_count_max = None
                 else:
-                    input_row_count_max = int(arg)
+                    try:
+                        input_row_count_max = int(arg)
+                    except ValueError:
+                        input_row_count_max = 0
+                    if (1 > input_row_count_max):
+                        err_msg = "Invalid row count: " + arg
         elif (arg == "-n"
             or arg == "--row-count-out"
         ):
@@ -166,6 +227,25 @@ def main(arg_list, stdin, stdout, stderr):
                     output_row_count_max = None
                 else:
                     output_row_count_max = int(arg)
+        elif (arg == "--memory-limit"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                memory_limit_str = arg
+        elif (arg == "--jobs"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                job_count_str = arg
+        elif (arg == "-T"
+            or arg == "--temp-dir"
+        ):
+            if (arg_index < arg_count):
+                arg_index += 1
+                arg = arg_list[arg_index]
+                temp_dir_name = arg
         elif (None != arg
           and 0 < len(arg)
           ):
@@ -180,8 +260,29 @@ def main(arg_list, stdin, stdout, stderr):
 
     if (None == in_key_column_name_list):
         show_help = True
+    else:
+        try:
+            for in_key_column_name in in_key_column_name_list:
+                parse_sort_key_spec(in_key_column_name)
+        except ValueError as exc:
+            err_msg = str(exc)
 
-    if (show_help):
+    memory_limit = None
+    job_count = 1
+    try:
+        memory_limit = parse_memory_size(memory_limit_str)
+    except ValueError:
+        err_msg = "Invalid memory limit: " + memory_limit_str
+    try:
+        job_count = lookup_job_count(job_count_str)
+    except ValueError:
+        err_msg = "Invalid job count: " + job_count_str
+
+    if (None != err_msg):
+        err_io.write(err_msg)
+        err_io.write("\n")
+        exit_code = 2
+    elif (show_help):
         out_io.write(help_text)
     else:
         input_charset_name = decode_charset_name(input_charset_name)
@@ -231,23 +332,39 @@ def main(arg_list, stdin, stdout, stderr):
             if (should_close_out_file):
                 out_file = out_io
 
-            in_csv = csv.reader(
-                in_io
-                ,delimiter=input_delimiter
-                ,lineterminator=input_row_terminator
-                )
             out_csv = csv.writer(
                 out_io
                 ,delimiter=output_delimiter
                 ,lineterminator=output_row_terminator
                 )
-            execute(
-                in_csv
-                ,out_csv
-                ,in_key_column_name_list
-                ,input_row_count_max
-                ,output_row_count_max
-                )
+            if (1 < job_count):
+                execute_parallel(
+                    in_io
+                    ,out_csv
+                    ,in_key_column_name_list
+                    ,input_row_count_max
+                    ,output_row_count_max
+                    ,memory_limit
+                    ,temp_dir_name
+                    ,job_count
+                    ,input_delimiter
+                    ,input_row_terminator
+                    )
+            else:
+                in_csv = csv.reader(
+                    in_io
+                    ,delimiter=input_delimiter
+                    ,lineterminator=input_row_terminator
+                    )
+                execute(
+                    in_csv
+                    ,out_csv
+                    ,in_key_column_name_list
+                    ,input_row_count_max
+                    ,output_row_count_max
+                    ,memory_limit
+                    ,temp_dir_name
+                    )
         except BrokenPipeError:
             pass
         finally:
@@ -257,6 +374,7 @@ def main(arg_list, stdin, stdout, stderr):
             if (None != out_file):
                 out_file.close()
                 out_file = None
+    return exit_code
 
 def execute(
     in_csv
@@ -264,89 +382,444 @@ def execute(
     ,in_key_column_name_list
     ,in_row_count_max
     ,out_row_count_max
+    ,memory_limit=None
+    ,temp_dir_name=None
 ):
     end_row = None
     
     in_header_row = next(in_csv, end_row)
-    # make a list with a slot for each sort key column name
-    in_key_column_position_list = []
-    in_key_column_count = len(in_key_column_name_list)
-    in_key_column_position = 0
-    while (in_key_column_position < in_key_column_count):
-        in_key_column_position_list.append(None)
-        in_key_column_position += 1
-    
-    # find the positions of the key columns within the csv file
-    if (None != in_header_row):
-        in_column_position = 0
-        in_column_count = len(in_header_row)
-        while (in_column_position < in_column_count):
-            in_column_name = in_header_row[in_column_position]
-            in_column_name_norm = normalize_column_name(in_column_name)
-            in_key_column_position = 0
-            found_key_column_position = None
-            while (None == found_key_column_position
-                and in_key_column_position < in_key_column_count
-            ):
-                in_key_column_name = in_key_column_name_list[in_key_column_position]
-                in_key_column_name_norm = normalize_column_name(in_key_column_name)
-                if (in_key_column_name_norm == in_column_name_norm):
-                    found_key_column_position = in_key_column_position
-                in_key_column_position += 1
-            if (None != found_key_column_position):
-                in_key_column_position_list[found_key_column_position] = in_column_position
-            in_column_position += 1
-
-    # define a row key "generator" function which can in-turn be used to define a row key tuple.
-    # instead of using this "yield expression" mechanism,
-    #  we could have created a list of the key values
-    #  but it seemed like better practice to use a light-weight iterator
-    #  instead of a throw-away list
-    def get_row_key_iter(in_row):
-        key_pos = 0
-        col_pos = None
-        while (key_pos < len(in_key_column_position_list)):
-            col_pos = in_key_column_position_list[key_pos]
-            col_value = None
-            if (None != col_pos
-                and 0 <= col_pos
-                and col_pos < len(in_row)
-            ):
-                col_value = in_row[col_pos]
-            yield col_value
-            key_pos += 1
-
-    # define a key extraction function
-    #  which can extract a hashable key object from a csv row
-    def get_row_key(in_row):
-        return tuple(get_row_key_iter(in_row))
+    get_row_key = compile_row_key_function(
+        in_header_row
+        ,in_key_column_name_list
+        )
 
     if (in_header_row != None):
         out_csv.writerow(in_header_row)
 
-    out_row_count = 0
-    in_row = next(in_csv, end_row)
-    while (end_row != in_row
-        and (None == out_row_count_max or out_row_count < out_row_count_max)
-    ):
-        in_row_count = 0
-        in_row_list = list()
-        while (end_row != in_row
-            and (None == in_row_count_max or in_row_count < in_row_count_max)
+    # Read the first rows; they tell us how many rows fit in memory.
+    # Each run is sorted in memory and, if more rows follow it,
+    #  the run is written to a temporary file to be merged later.
+    run_row_count_max = in_row_count_max
+    in_row_list = list(islice(in_csv, ROW_SAMPLE_COUNT))
+    if (None != memory_limit):
+        def get_row_key_size(in_row):
+            return estimate_object_size(get_row_key(in_row))
+        run_row_capacity = estimate_row_capacity(
+            in_row_list
+            ,memory_limit
+            ,get_row_key_size
+            )
+        if (None != run_row_capacity
+            and (None == run_row_count_max or run_row_capacity < run_row_count_max)
         ):
-            in_row_list.append(in_row)
-            in_row_count += 1
-            in_row = next(in_csv, end_row)
-        
+            run_row_count_max = run_row_capacity
+
+    if (None != out_row_count_max
+        and (None == run_row_count_max or out_row_count_max <= run_row_count_max)
+    ):
+        # Only the first N rows will be written, so keep a bounded heap
+        #  of the N smallest rows instead of sorting the whole input.
+        # nsmallest() is stable, rows with equal keys keep their input order.
+        out_row_list = heapq.nsmallest(
+            out_row_count_max
+            ,chain(in_row_list, in_csv)
+            ,key=get_row_key
+            )
+        for out_row in out_row_list:
+            out_csv.writerow(out_row)
+        return
+
+    if (None != run_row_count_max
+        and run_row_count_max < len(in_row_list)
+    ):
+        in_csv = chain(in_row_list[run_row_count_max:], in_csv)
+        del in_row_list[run_row_count_max:]
+    elif (ROW_SAMPLE_COUNT <= len(in_row_list)):
+        if (None == run_row_count_max):
+            in_row_list.extend(in_csv)
+        else:
+            in_row_list.extend(islice(in_csv, run_row_count_max - len(in_row_list)))
+
+    run_set = RunFileSet(get_row_key, temp_dir_name)
+    try:
         in_row_list.sort(key=get_row_key)
+        in_row = next(in_csv, end_row)
+        while (end_row != in_row):
+            run_set.add_run(in_row_list)
+            in_row_list = [in_row]
+            if (None == run_row_count_max):
+                in_row_list.extend(in_csv)
+            else:
+                in_row_list.extend(islice(in_csv, run_row_count_max - 1))
+            in_row_list.sort(key=get_row_key)
+            in_row = next(in_csv, end_row)
+
+        # The last run stays in memory and is merged after the spilled runs
+        #  so that rows with equal keys keep their input order.
         out_row_iter = iter(in_row_list)
-        out_row = next(out_row_iter, end_row)
-        while (end_row != out_row
-            and (None == out_row_count_max or out_row_count < out_row_count_max)
-        ):
+        if (0 < len(run_set)):
+            out_row_iter = run_set.merge(out_row_iter)
+        if (None != out_row_count_max):
+            out_row_iter = islice(out_row_iter, out_row_count_max)
+        for out_row in out_row_iter:
             out_csv.writerow(out_row)
-            out_row_count += 1
-            out_row = next(out_row_iter, end_row)
+    finally:
+        run_set.close()
+
+def execute_parallel(
+    in_io
+    ,out_csv
+    ,in_key_column_name_list
+    ,in_row_count_max
+    ,out_row_count_max
+    ,memory_limit
+    ,temp_dir_name
+    ,job_count
+    ,input_delimiter
+    ,input_row_terminator
+):
+    """ Sort like execute(), but parse and sort blocks of rows in worker processes.
+
+        The workers write their sorted blocks to run files,
+        so that the rows are sent to the workers as unparsed text
+        and are never sent back; the run files are then merged in block order.
+    """
+    end_row = None
+    in_header_row = None
+    in_header_line_list = next(iter_record_lines(in_io), None)
+    if (None != in_header_line_list):
+        in_header_row = next(
+            csv.reader(
+                in_header_line_list
+                ,delimiter=input_delimiter
+                ,lineterminator=input_row_terminator
+                )
+            ,end_row
+            )
+    if (None == in_header_row):
+        return
+    out_csv.writerow(in_header_row)
+    get_row_key = compile_row_key_function(
+        in_header_row
+        ,in_key_column_name_list
+        )
+
+    # Each worker holds one parsed block; the parent holds the text of
+    #  the blocks which are waiting for a worker.
+    block_row_count_max = in_row_count_max
+    block_char_count_max = None
+    if (None != memory_limit):
+        block_char_count_max = max(1, memory_limit // (3 * job_count * PARSED_ROW_SIZE_FACTOR))
+    elif (None == block_row_count_max):
+        block_row_count_max = DEFAULT_BLOCK_ROW_COUNT
+
+    run_dir_name = tempfile.mkdtemp(prefix='csv-sort-', dir=temp_dir_name)
+    run_set = RunFileSet(get_row_key, temp_dir_name)
+    pool = None
+    out_row_iter = None
+    try:
+        pool = create_pool(
+            job_count
+            ,init_sort_worker
+            ,(
+                in_header_row
+                ,in_key_column_name_list
+                ,input_delimiter
+                ,input_row_terminator
+                ,out_row_count_max
+                ,run_dir_name
+            ))
+        in_block_iter = iter_record_blocks(
+            in_io
+            ,block_row_count_max
+            ,block_char_count_max
+            )
+        in_line_list_iter = (in_line_list for (_, in_line_list) in in_block_iter)
+        for run_file_path in imap_ordered(pool, sort_block, in_line_list_iter, 2 * job_count):
+            run_set.add_run_file(open_run_file(run_file_path))
+        pool.close()
+        pool.join()
+        pool = None
+
+        out_row_iter = run_set.merge()
+        out_row_iter_limited = out_row_iter
+        if (None != out_row_count_max):
+            out_row_iter_limited = islice(out_row_iter, out_row_count_max)
+        for out_row in out_row_iter_limited:
+            out_csv.writerow(out_row)
+    finally:
+        if (None != pool):
+            pool.terminate()
+        if (None != out_row_iter):
+            out_row_iter.close()
+        run_set.close()
+        shutil.rmtree(run_dir_name, ignore_errors=True)
+
+# state of a worker process used by execute_parallel()
+sort_worker_state = None
+
+def init_sort_worker(
+    in_header_row
+    ,in_key_column_name_list
+    ,input_delimiter
+    ,input_row_terminator
+    ,out_row_count_max
+    ,run_dir_name
+):
+    global sort_worker_state
+    get_row_key = compile_row_key_function(
+        in_header_row
+        ,in_key_column_name_list
+        )
+    sort_worker_state = (
+        get_row_key
+        ,input_delimiter
+        ,input_row_terminator
+        ,out_row_count_max
+        ,run_dir_name
+        )
+
+def sort_block(in_line_list):
+    """ Parse and sort a block of csv text; return the path of a sorted run file. """
+    (
+        get_row_key
+        ,input_delimiter
+        ,input_row_terminator
+        ,out_row_count_max
+        ,run_dir_name
+    ) = sort_worker_state
+    in_row_list = list(csv.reader(
+        in_line_list
+        ,delimiter=input_delimiter
+        ,lineterminator=input_row_terminator
+        ))
+    if (None != out_row_count_max
+        and out_row_count_max < len(in_row_list)
+    ):
+        # rows after the first N of a block can never be written
+        in_row_list = heapq.nsmallest(out_row_count_max, in_row_list, key=get_row_key)
+    else:
+        in_row_list.sort(key=get_row_key)
+    return write_named_run_file(in_row_list, run_dir_name)
+
+def parse_sort_key_spec(key_spec_str):
+    """ Parse a sort key spec like 'amount:num:desc' into its parts.
+
+        Returns a tuple (column_name, key_type_name, is_descending).
+    """
+    key_spec_part_list = key_spec_str.split(':')
+    column_name = key_spec_part_list[0]
+    key_type_name = 'str'
+    is_descending = False
+    for key_spec_part in key_spec_part_list[1:]:
+        key_spec_part = key_spec_part.strip().lower()
+        if (key_spec_part in key_decoder_dict):
+            key_type_name = key_spec_part
+        elif (key_spec_part == 'desc'):
+            is_descending = True
+        elif (key_spec_part == 'asc'):
+            is_descending = False
+        else:
+            raise ValueError("Unknown sort key option '{0}' in '{1}'".format(key_spec_part, key_spec_str))
+    return (column_name, key_type_name, is_descending)
+
+def compile_row_key_function(
+    in_header_row
+    ,in_key_spec_list
+):
+    """ Make a function which extracts a comparable sort key from a csv row. """
+    # find the positions of the key columns within the csv file,
+    #  key columns which are not in the header are ignored
+    #  since they would have the same (empty) value in every row.
+    in_column_position_lookup = dict()
+    if (None != in_header_row):
+        in_column_position = 0
+        while (in_column_position < len(in_header_row)):
+            in_column_name_norm = normalize_column_name(in_header_row[in_column_position])
+            in_column_position_lookup[in_column_name_norm] = in_column_position
+            in_column_position += 1
+    in_key_column_position_list = []
+    key_decoder_list = []
+    for in_key_spec in in_key_spec_list:
+        (in_key_column_name, key_type_name, is_descending) = parse_sort_key_spec(in_key_spec)
+        in_column_position = in_column_position_lookup.get(normalize_column_name(in_key_column_name))
+        if (None != in_column_position):
+            key_decoder = key_decoder_dict[key_type_name]
+            if (is_descending):
+                key_decoder = make_descending_key_decoder(key_decoder)
+            in_key_column_position_list.append(in_column_position)
+            key_decoder_list.append(key_decoder)
+
+    if (0 == len(in_key_column_position_list)):
+        return get_empty_row_key
+
+    if (1 == len(in_key_column_position_list)):
+        # a single key is compared as a bare value rather than a 1-tuple
+        in_key_column_position = in_key_column_position_list[0]
+        key_decoder = key_decoder_list[0]
+        if (None == key_decoder):
+            def get_row_key(in_row):
+                try:
+                    return in_row[in_key_column_position]
+                except IndexError:
+                    return ''
+        else:
+            def get_row_key(in_row):
+                try:
+                    key_cell = in_row[in_key_column_position]
+                except IndexError:
+                    key_cell = ''
+                return key_decoder(key_cell)
+        return get_row_key
+
+    in_key_column_position_max = max(in_key_column_position_list)
+    get_key_cells = itemgetter(*in_key_column_position_list)
+
+    def pad_row(in_row):
+        # short rows are treated as if the missing cells were empty
+        return list(in_row) + [''] * (in_key_column_position_max + 1 - len(in_row))
+
+    if (all(None == key_decoder for key_decoder in key_decoder_list)):
+        # plain text keys compare as the raw cell values
+        def get_row_key(in_row):
+            try:
+                return get_key_cells(in_row)
+            except IndexError:
+                return get_key_cells(pad_row(in_row))
+    else:
+        key_decoder_list = [
+            key_decoder if (None != key_decoder) else decode_str_key
+            for key_decoder in key_decoder_list
+            ]
+        def get_row_key(in_row):
+            try:
+                key_cells = get_key_cells(in_row)
+            except IndexError:
+                key_cells = get_key_cells(pad_row(in_row))
+            return tuple([
+                key_decoder(key_cell)
+                for key_decoder, key_cell in zip(key_decoder_list, key_cells)
+                ])
+    return get_row_key
+
+def get_empty_row_key(in_row):
+    return ()
+
+def decode_str_key(cell_value):
+    return cell_value
+
+def decode_ci_key(cell_value):
+    return cell_value.casefold()
+
+# Typed keys are decoded to a pair: (kind, value),
+#  where kind orders empty cells first, then decoded values,
+#  then any cells which cannot be decoded (compared as text).
+def decode_num_key(cell_value):
+    try:
+        return (1, int(cell_value))
+    except ValueError:
+        pass
+    try:
+        num_value = float(cell_value)
+    except ValueError:
+        num_value = None
+    if (None != num_value
+        and num_value == num_value  # NaN is not ordered
+    ):
+        return (1, num_value)
+    if (0 == len(cell_value.strip())):
+        return (0, 0)
+    return (2, cell_value)
+
+iso_datetime_pattern = re.compile(
+    r'\s*(\d{4})-(\d{1,2})-(\d{1,2})'
+    r'(?:[T ](\d{1,2}):(\d{2})(?::(\d{2})(?:[.,](\d{1,6})\d*)?)?)?'
+    r'\s*(Z|[+-]\d{2}:?\d{2})?\s*$'
+    )
+
+def decode_iso_key(cell_value):
+    iso_match = iso_datetime_pattern.match(cell_value)
+    if (None != iso_match):
+        (year, month, day, hour, minute, second, fraction, zone) = iso_match.groups()
+        try:
+            datetime_value = datetime.datetime(
+                int(year)
+                ,int(month)
+                ,int(day)
+                ,int(hour or 0)
+                ,int(minute or 0)
+                ,int(second or 0)
+                ,int((fraction or '0').ljust(6, '0'))
+                )
+        except ValueError:
+            datetime_value = None
+        if (None != datetime_value):
+            # convert times with a zone offset to UTC
+            if (None != zone and 'Z' != zone):
+                zone = zone.replace(':', '')
+                zone_offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[3:5]))
+                if ('+' == zone[0]):
+                    datetime_value -= zone_offset
+                else:
+                    datetime_value += zone_offset
+            return (1, datetime_value)
+    if (0 == len(cell_value.strip())):
+        return (0, 0)
+    return (2, cell_value)
+
+key_decoder_dict = {
+    'str': None,
+    'ci': decode_ci_key,
+    'num': decode_num_key,
+    'iso': decode_iso_key,
+    }
+
+# decoders which return a (kind, value) pair
+typed_key_decoder_set = frozenset([
+    decode_num_key
+    ,decode_iso_key
+    ])
+
+class DescendingKey(object):
+    """ Wraps a key value to reverse its ordering. """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+def make_descending_key_decoder(key_decoder):
+    """ Make a key decoder which reverses the order of the decoded values.
+
+        Only the value is reversed, the kind still orders empty cells first
+        and cells which cannot be decoded last.
+    """
+    if (key_decoder in typed_key_decoder_set):
+        def decode_descending_key(cell_value):
+            (key_kind, key_value) = key_decoder(cell_value)
+            return (key_kind, DescendingKey(key_value))
+    else:
+        if (None == key_decoder):
+            key_decoder = decode_str_key
+        def decode_descending_key(cell_value):
+            if (0 == len(cell_value)):
+                return (0, DescendingKey(''))
+            return (1, DescendingKey(key_decoder(cell_value)))
+    return decode_descending_key
 
 def normalize_column_name(column_name):
     norm_column_name = column_name